@@ -15,6 +15,7 @@ import can
 from can import Bus, MessageSync
 
 from player2 import LogReader2
+from profiling import StageProfiler, profiled, DUMP_SUFFIXES
 
 def main():
     parser = argparse.ArgumentParser(
@@ -102,6 +103,22 @@ def main():
         help="""start on frames with time < timestamp""",
     )
 
+    parser.add_argument(
+        "--profile",
+        metavar="FILE",
+        default=None,
+        help="""Time the stages (read, schedule, send), print them to stderr at the end and write them
+                        to this JSON file.""",
+    )
+
+    parser.add_argument(
+        "--profile-dump",
+        choices=sorted(DUMP_SUFFIXES),
+        default=None,
+        help="""With --profile: also write a cProfile (.prof) or tracemalloc (.tracemalloc) dump next
+                        to the JSON file.""",
+    )
+
     parser.add_argument(
         "infile",
         metavar="input-file",
@@ -117,6 +134,8 @@ def main():
         raise SystemExit(errno.EINVAL)
 
     results = parser.parse_args()
+    if results.profile_dump and not results.profile:
+        parser.error("--profile-dump needs --profile")
 
     verbosity = results.verbosity
 
@@ -136,14 +155,28 @@ def main():
         config["data_bitrate"] = results.data_bitrate
     bus = Bus(results.channel, **config)
 
+    if results.profile:
+        # the profiler samples the running stage through signals, which only the main thread gets
+        profiler = StageProfiler()
+        with profiled(profiler, results.profile, results.profile_dump, "CanPlayer"):
+            sendMessages(error_frames, results, verbosity, bus, profiler)
+        return
+
     ##sendMessages(error_frames, results, verbosity, bus)
     th = Thread(target=sendMessages, args=(error_frames, results, verbosity, bus))
     th.start()
 
 
-def sendMessages(error_frames, results, verbosity, bus):
+def sendMessages(error_frames, results, verbosity, bus, profiler=None):
     reader = LogReader2(results.infile, results.start_time)
-    in_sync = MessageSync(reader, timestamps=results.timestamps, gap=results.gap, skip=results.skip)
+    send = bus.send
+    if profiler is None:
+        in_sync = MessageSync(reader, timestamps=results.timestamps, gap=results.gap, skip=results.skip)
+    else:
+        in_sync = profiler.iterate("schedule", MessageSync(profiler.iterate("read", reader, unit="frames"),
+                                                           timestamps=results.timestamps, gap=results.gap,
+                                                           skip=results.skip), unit="frames")
+        send = profiler.wrap("send", bus.send, unit="frames")
     print('Can LogReader (Started on {})'.format(datetime.now()))
     try:
         for message in in_sync:
@@ -151,7 +184,7 @@ def sendMessages(error_frames, results, verbosity, bus):
                 continue
             if verbosity >= 3:
                 print(message)
-            bus.send(message)
+            send(message)
     except KeyboardInterrupt:
         pass
     finally:
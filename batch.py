@@ -0,0 +1,151 @@
+# coding: utf-8
+
+"""
+Batch mode of correct-ts.py: a directory or glob pattern of logs, corrected by a pool of worker processes.
+
+Each input is corrected on its own, into <output>/<name> where name is the file name without the
+compression suffix and .log, e.g. data/vehicle7-2019-08-05/ for vehicle7-2019-08-05.log.gz. What
+correct-ts prints for a single input (the segments and their GPS offsets, malformed lines, the
+canId/nodeId statistics) goes to <output>/<name>/correct-ts.txt, with -stats-only to the report. At
+the end one report covers all inputs: a line per input and the canId/nodeId statistics of all frames.
+The inputs may cover the same time (several loggers of a day), so their statistics are combined, not
+chained: counts and dropouts summed, the first and last frame of all inputs, the intervals within each
+input (see idstats.FrameStatistics.combine).
+"""
+
+import glob
+import os
+import time
+from multiprocessing import Pool
+
+from compressed import COMPRESSED
+from idstats import FrameStatistics, write_statistics
+
+LOG_PATTERNS = ["*.log"] + ["*.log" + suffix for suffix in COMPRESSED]
+REPORT_NAME = "correct-ts.txt"
+
+
+def is_batch(pattern):
+    """
+    :return: True if the input is a directory or a glob pattern, not a single file
+    """
+    return os.path.isdir(pattern) or (glob.has_magic(pattern) and not os.path.exists(pattern))
+
+
+def find_inputs(pattern):
+    """
+    :return: the log files (LOG_PATTERNS) of a directory or the files matching a glob pattern, sorted
+    """
+    if os.path.isdir(pattern):
+        files = [f for p in LOG_PATTERNS for f in glob.glob(os.path.join(pattern, p))]
+    else:
+        files = glob.glob(pattern)
+    return sorted(f for f in set(files) if os.path.isfile(f))
+
+
+def output_name(file_name):
+    """
+    :return: the name of the output directory of an input, e.g. 'x' for 'logs/x.log.gz'
+    """
+    name = os.path.basename(file_name)
+    base, suffix = os.path.splitext(name)
+    if suffix in COMPRESSED:
+        name = base
+    base, suffix = os.path.splitext(name)
+    return base if suffix == ".log" and base else name
+
+
+class InputResult:
+    """
+    What the worker of an input reports back.
+    """
+
+    def __init__(self, input_file, output_dir, corrector=None, wall=0.0, error=None, report=None):
+        """
+        :param correction.LogCorrector corrector: after finish, None if the input failed
+        :param str error: why the input failed
+        :param str report: what the worker printed, if not to REPORT_NAME (correct-ts.py -stats-only)
+        """
+        self.input_file = input_file
+        self.output_dir = output_dir
+        self.error = error
+        self.report = report
+        self.wall = wall
+        self.segments = self.frames = 0
+        self.canIds = self.nodeIds = None
+        if corrector is not None:
+            self.segments = corrector.log_file_nr
+            self.frames = corrector.new_cnt
+            self.canIds = corrector.canIds
+            self.nodeIds = corrector.nodeIds
+
+
+class BatchReport:
+    """
+    Collects the results of the inputs, in input order.
+    """
+
+    def __init__(self):
+        self.inputs = 0
+        self.failed = 0
+        self.segments = 0
+        self.frames = 0
+        self.canIds = FrameStatistics()
+        self.nodeIds = FrameStatistics()
+
+    def add(self, result):
+        self.inputs += 1
+        if result.error is not None:
+            self.failed += 1
+            print(result.input_file, "FAILED", result.error)
+            return
+        self.segments += result.segments
+        self.frames += result.frames
+        self.canIds.combine(result.canIds)
+        self.nodeIds.combine(result.nodeIds)
+        if result.report is not None:
+            print(result.report, end="")
+        print(result.input_file, "->", result.output_dir, " segments=", result.segments, "cnt=", result.frames,
+              "canIds=", len(result.canIds), "time= {:.2f}".format(result.wall))
+
+    def print_totals(self, wall):
+        print("inputs=", self.inputs, "failed=", self.failed, "segments=", self.segments, "cnt=", self.frames,
+              "time= {:.2f}".format(wall))
+
+    def print_statistics(self, file_name=None):
+        write_statistics([("canId", self.canIds), ("nodeId", self.nodeIds)], file_name)
+
+
+def output_dirs(inputs, output):
+    """
+    :param str output: the parent directory of the output directories
+    :return: the output directory of each input, see :func:`output_name`
+    :raise ValueError: if two inputs would get the same directory
+    """
+    dirs = [os.path.join(output, output_name(input_file)) for input_file in inputs]
+    seen = {}
+    for input_file, output_dir in zip(inputs, dirs):
+        if output_dir in seen:
+            raise ValueError("{} and {} would both go to {}".format(seen[output_dir], input_file, output_dir))
+        seen[output_dir] = input_file
+    return dirs
+
+
+def process_batch(inputs, dirs, worker, jobs, options):
+    """
+    Correct the inputs with jobs worker processes.
+
+    :param list inputs: the log files, see :func:`find_inputs`
+    :param list dirs: the output directory of each input, see :func:`output_dirs`
+    :param worker: function of a tuple (input file, output directory, options) returning an
+                   :class:`InputResult`, called in the worker processes
+    :return: the :class:`BatchReport`
+    """
+    wall = time.perf_counter()
+    report = BatchReport()
+    with Pool(min(jobs, len(inputs))) as pool:
+        for result in pool.imap(worker, [(input_file, output_dir, options)
+                                         for input_file, output_dir in zip(inputs, dirs)]):
+            report.add(result)
+    report.print_totals(time.perf_counter() - wall)
+    return report
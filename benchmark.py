@@ -0,0 +1,357 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Throughput benchmarks for the log processing code.
+   python benchmark.py parser data/test-log.log
+   python benchmark.py epoch data/test-log.log
+   python benchmark.py suite -size 20M -baseline benchmark-baseline.json
+
+The suite generates a log with loggen.py and measures frames/s and peak RSS of correct-ts (text and
+NumPy engine), the logfile2sqldb2 import (default, -bulk and -compact), SqliteReader2 range reads of
+both schemas and the replay scheduling of MessageSync, each in its own process. The stages run -repeat
+times in turn and the median of the time and of the peak RSS counts: single runs vary by 20 % and more,
+beyond the tolerance. The first run stores the results as baseline, later runs compare with it and exit
+with status 1 if a stage got slower or bigger than the tolerance allows. Baselines only compare on the
+same machine and with the same -size and -seed.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from candump import parse_line, SYNC_ID, GPS_UTC_ID, GPS_DATE_ID
+from epoch import sync_epoch, gps_epoch
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TOLERANCE = 0.15
+REPEAT = 5
+
+
+# reference implementation, as it was used by correct-ts.py before candump.parse_line
+def getCanData(line):
+    parts = (" ".join(line.split()).split())
+    ts = float(parts[0][1:18])
+    canDevStr = parts[1]
+    parts2 = parts[2].split("#")
+
+    canIdStr = parts2[0]
+    nodeIdStr = parts2[1][0:2]
+    dataStr = parts2[1][8:40]
+    return ts, canDevStr, canIdStr, dataStr, nodeIdStr
+
+
+def check(line):
+    try:
+        if not line.startswith("("):
+            return False
+        for c in line[1:11]:
+            if not c.isdigit():
+                return False
+        if line[11] != '.':
+            return False
+        for c in line[12:18]:
+            if not c.isdigit():
+                return False
+        if line[18] != ')':
+            return False
+        return True
+    except (IndexError):
+        return False
+
+
+# reference implementation, as it was used by correct-ts.py before epoch.py (local time)
+def sync_timestamp(payloadStr):
+    return datetime.datetime((int(payloadStr[0:2], 16) + 2000), int(payloadStr[3:4], 16),
+                             int(payloadStr[4:6], 16), int(payloadStr[6:8], 16),
+                             int(payloadStr[8:10], 16), int(payloadStr[10:12], 16)).timestamp()
+
+
+def gps_timestamp(dataDateStr, dataStr):
+    return datetime.datetime((int(dataDateStr[4:6], 16) * 100) + int(dataDateStr[6:8], 16),
+                             int(dataDateStr[2:4], 16),
+                             int(dataDateStr[0:2], 16), int(dataStr[0:2], 16), int(dataStr[2:4], 16),
+                             int(dataStr[4:6], 16)).timestamp()
+
+
+def report(name, cnt, seconds):
+    print("{:<24s} {:>10d} lines {:>8.3f} s {:>12.0f} lines/s".format(name, cnt, seconds, cnt / seconds))
+
+
+def bench_parser(infile):
+    with open(infile) as f:
+        lines = f.readlines()
+    t = time.perf_counter()
+    for line in lines:
+        if check(line):
+            ts, canDevStr, canIdStr, dataStr, nodeIdStr = getCanData(line)
+            canId = int(canIdStr, 16)
+            parts = (" ".join(line.split()).split())  # the write path split the line a second time
+    report("check+getCanData", len(lines), time.perf_counter() - t)
+
+    with open(infile, "rb") as f:
+        lines = f.readlines()
+    t = time.perf_counter()
+    for line in lines:
+        parse_line(line)
+    report("parse_line", len(lines), time.perf_counter() - t)
+
+
+def bench_epoch(infile):
+    syncs = []
+    gps = []
+    dataDateStr = None
+    with open(infile, "rb") as f:
+        for line in f:
+            canData = parse_line(line)
+            if canData is None:
+                continue
+            _, _, _, canId, payloadStr = canData
+            if canId == SYNC_ID:
+                syncs.append(payloadStr)
+            elif canId == GPS_DATE_ID:
+                dataDateStr = payloadStr[8:]
+            elif canId == GPS_UTC_ID and dataDateStr is not None:
+                gps.append((dataDateStr, payloadStr[8:]))
+
+    for name, convert_sync, convert_gps in ("datetime.timestamp", sync_timestamp, gps_timestamp), \
+                                           ("epoch", sync_epoch, gps_epoch):
+        t = time.perf_counter()
+        for payloadStr in syncs:
+            convert_sync(payloadStr)
+        for dataDateStr, dataStr in gps:
+            convert_gps(dataDateStr, dataStr)
+        report(name, len(syncs) + len(gps), time.perf_counter() - t)
+
+
+def bench_sqlite_range(db, queries, seed):
+    """
+    Read 1 s of frames from random start times with SqliteReader2.
+
+    :return: the number of frames read
+    """
+    import sqlite3
+    from sqlite2 import SqliteReader2, ts_scale
+
+    conn = sqlite3.connect(db)
+    scale = ts_scale(conn.cursor(), "messages")
+    first, last = (ts / scale for ts in conn.execute("SELECT min(ts), max(ts) FROM messages").fetchone())
+    conn.close()
+    rng = random.Random(seed)
+    frames = 0
+    for _ in range(queries):
+        start = rng.uniform(first, max(first, last - 1.0))
+        reader = SqliteReader2(db, "messages", start)
+        for message in reader:
+            if message.timestamp >= start + 1.0:
+                break
+            frames += 1
+        reader.stop()
+    return frames
+
+
+def bench_replay(infile):
+    """
+    Schedule the frames of a log with MessageSync, without waiting (gap and skip 0).
+
+    :return: the number of frames
+    """
+    from can import MessageSync
+    from player2 import LogReader2
+
+    reader = LogReader2(infile, None)
+    frames = 0
+    for _ in MessageSync(reader, timestamps=True, gap=0, skip=0):
+        frames += 1
+    reader.stop()
+    return frames
+
+
+def peak_rss_mb(rusage):
+    # ru_maxrss is in KiB on Linux, in bytes on macOS
+    return rusage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def run_stage(args, cwd, frames=None):
+    """
+    Run a stage in its own process.
+
+    :param int frames: the frames the stage processes, None if the stage prints them as JSON (``{"frames": n}``)
+    :return: the result of the stage as dict
+    """
+    t = time.perf_counter()
+    p = subprocess.Popen([sys.executable] + args, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    out = p.stdout.read()
+    p.stdout.close()
+    _, status, rusage = os.wait4(p.pid, 0)
+    seconds = time.perf_counter() - t
+    p.returncode = os.waitstatus_to_exitcode(status)
+    if p.returncode != 0:
+        raise RuntimeError("{} failed with exit status {:d}".format(" ".join(args), p.returncode))
+    if frames is None:
+        frames = json.loads(out.splitlines()[-1])["frames"]
+    return {"frames": frames, "seconds": round(seconds, 3), "frames_per_s": round(frames / seconds),
+            "peak_rss_mb": round(peak_rss_mb(rusage), 1)}
+
+
+def median_result(runs):
+    """
+    :param list runs: results of :func:`run_stage` for the same stage
+    :return: the result with the median time and peak RSS of the runs
+    """
+    frames = runs[0]["frames"]
+    seconds = statistics.median(run["seconds"] for run in runs)
+    return {"frames": frames, "seconds": round(seconds, 3), "frames_per_s": round(frames / seconds),
+            "peak_rss_mb": round(statistics.median(run["peak_rss_mb"] for run in runs), 1), "repeat": len(runs)}
+
+
+def bench_suite(size, seed, workdir, repeat=REPEAT):
+    """
+    :param int repeat: runs per stage
+    :return: the results as JSON serializable dict
+    """
+    from loggen import LogGenerator
+
+    os.makedirs(os.path.join(workdir, "data"), exist_ok=True)
+    log = os.path.join(workdir, "synthetic.log")
+    clean_log = os.path.join(workdir, "synthetic-clean.log")  # can.CanutilsLogReader stops at malformed lines
+    db = os.path.join(workdir, "synthetic.db")
+    bulk_db = os.path.join(workdir, "synthetic-bulk.db")
+    compact_db = os.path.join(workdir, "synthetic-compact.db")
+    generator = LogGenerator(seed)
+    with open(log, "wb") as f:
+        generator.generate(f, size)
+    clean = LogGenerator(seed, malformed_rate=0)
+    with open(clean_log, "wb") as f:
+        clean.generate(f, size)
+
+    correct_ts = os.path.join(HERE, "correct-ts.py")
+    this = os.path.abspath(__file__)
+    # name, arguments, frames, database written by the stage (removed before each run, the import appends)
+    stages = [
+        ("correct-ts", [correct_ts, "-input", log, "-gps"], generator.lines, None),
+        ("correct-ts-numpy", [correct_ts, "-input", log, "-gps", "-numpy"], generator.lines, None),
+        ("logfile2sqldb2", [os.path.join(HERE, "logfile2sqldb2.py"), clean_log, db], clean.lines, db),
+        ("logfile2sqldb2-bulk", [os.path.join(HERE, "logfile2sqldb2.py"), clean_log, bulk_db, "-bulk"], clean.lines,
+         bulk_db),
+        ("logfile2sqldb2-compact", [os.path.join(HERE, "logfile2sqldb2.py"), clean_log, compact_db, "-compact"],
+         clean.lines, compact_db),
+        ("sqlite-range", [this, "sqlite-range", db, "-seed", str(seed)], None, None),
+        ("sqlite-range-compact", [this, "sqlite-range", compact_db, "-seed", str(seed)], None, None),
+        ("replay", [this, "replay", clean_log], None, None),
+    ]
+    # the stages take turns, so that a slow phase of the machine spreads over all of them
+    runs = {name: [] for name, _, _, _ in stages}
+    for _ in range(repeat):
+        for name, args, frames, output in stages:
+            shutil.rmtree(os.path.join(workdir, "data"))
+            os.makedirs(os.path.join(workdir, "data"))
+            if output is not None and os.path.exists(output):
+                os.remove(output)
+            runs[name].append(run_stage(args, workdir, frames))
+    results = {}
+    for name in runs:
+        results[name] = result = median_result(runs[name])
+        print("{:<22s} {:>10d} frames {:>8.3f} s {:>10d} frames/s {:>8.1f} MB peak RSS".format(
+            name, result["frames"], result["seconds"], result["frames_per_s"], result["peak_rss_mb"]))
+    return {"size": size, "seed": seed, "lines": generator.lines, "python": platform.python_version(),
+            "machine": platform.machine(), "results": results}
+
+
+def compare(baseline, current, tolerance):
+    """
+    Print the change of each stage against the baseline.
+
+    :return: the stages which are slower or need more memory than the tolerance allows
+    """
+    if (baseline["size"], baseline["seed"]) != (current["size"], current["seed"]):
+        print("baseline was taken with -size {} -seed {}, not compared".format(baseline["size"], baseline["seed"]))
+        return []
+    regressions = []
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        speed = result["frames_per_s"] / base["frames_per_s"]
+        memory = result["peak_rss_mb"] / base["peak_rss_mb"]
+        regressed = speed < 1 - tolerance or memory > 1 + tolerance
+        print("{:<22s} {:>+7.1%} frames/s {:>+7.1%} peak RSS{}".format(
+            name, speed - 1, memory - 1, "  REGRESSION" if regressed else ""))
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Throughput benchmarks.')
+    subparsers = parser.add_subparsers(dest='benchmark')
+    p = subparsers.add_parser('parser', help='candump line parser, old check()/getCanData() against parse_line().')
+    p.add_argument('infile', metavar='input-file', type=str, help='candump log file.')
+
+    p = subparsers.add_parser('epoch', help='time sync and GPS time conversion, datetime against epoch.py.')
+    p.add_argument('infile', metavar='input-file', type=str, help='candump log file with time sync/GPS frames.')
+
+    p = subparsers.add_parser('suite', help='frames/s and peak RSS of the tools on a synthetic log, '
+                                            'compared with a baseline.')
+    p.add_argument('-size', type=str, default='20M', help='Size of the synthetic log (default 20M).')
+    p.add_argument('-seed', type=int, default=1, help='Random seed of the synthetic log (default 1).')
+    p.add_argument('-baseline', metavar='file', type=str, default='benchmark-baseline.json',
+                   help='Baseline JSON, written if it does not exist (default benchmark-baseline.json).')
+    p.add_argument('-save', action='store_true', help='Replace the baseline with the results.')
+    p.add_argument('-tolerance', type=float, default=TOLERANCE,
+                   help='Allowed loss of frames/s and growth of peak RSS, fraction (default {}).'.format(TOLERANCE))
+    p.add_argument('-workdir', type=str, default=None, help='Directory for the logs, kept (default a temporary one).')
+    p.add_argument('-repeat', type=int, default=REPEAT,
+                   help='Runs per stage, the median counts (default {:d}).'.format(REPEAT))
+
+    p = subparsers.add_parser('sqlite-range', help='SqliteReader2 reads of 1 s from random start times.')
+    p.add_argument('db', type=str, help='Database written by logfile2sqldb2.py.')
+    p.add_argument('-queries', type=int, default=200, help='Number of reads (default 200).')
+    p.add_argument('-seed', type=int, default=1, help='Random seed of the start times (default 1).')
+
+    p = subparsers.add_parser('replay', help='MessageSync scheduling of a log, without waiting.')
+    p.add_argument('infile', metavar='input-file', type=str, help='Log file, see player2.LogReader2.')
+
+    results = parser.parse_args()
+    if results.benchmark == 'parser':
+        bench_parser(results.infile)
+    elif results.benchmark == 'epoch':
+        bench_epoch(results.infile)
+    elif results.benchmark == 'sqlite-range':
+        print(json.dumps({"frames": bench_sqlite_range(results.db, results.queries, results.seed)}))
+    elif results.benchmark == 'replay':
+        print(json.dumps({"frames": bench_replay(results.infile)}))
+    elif results.benchmark == 'suite':
+        from loggen import parse_size
+
+        workdir = results.workdir or tempfile.mkdtemp(prefix="canlog-benchmark-")
+        try:
+            current = bench_suite(parse_size(results.size), results.seed, workdir, results.repeat)
+        finally:
+            if results.workdir is None:
+                shutil.rmtree(workdir)
+        if results.save or not os.path.exists(results.baseline):
+            with open(results.baseline, "w") as f:
+                json.dump(current, f, indent=1)
+                f.write("\n")
+            print("baseline written to", results.baseline)
+            return
+        with open(results.baseline) as f:
+            baseline = json.load(f)
+        if compare(baseline, current, results.tolerance):
+            sys.exit(1)
+    else:
+        parser.print_help(sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+# coding: utf-8
+
+"""
+Byte level parser for candump log files (``candump -L`` format).
+
+   (1564994147.496590) can0 78A#0A0C1CE5F7990000
+
+The parser works on raw ``bytes`` lines, as returned by iterating over a file opened
+in binary mode or sliced out of an ``mmap``, so no line has to be decoded to ``str``.
+Lines in the standard layout ``(SSSSSSSSSS.UUUUUU) canX ID#DATA`` are handled by a
+fixed offset fast path, everything else falls back to a whitespace splitting path.
+
+Time stamps are carried as integer µs, read from and written to the ``(sec.usec)`` field without
+going through a float, see :func:`format_line`.
+"""
+
+import re
+
+SYNC_ID = 0x1FFFFFF0
+GPS_UTC_ID = 1200
+GPS_DATE_ID = 1206
+
+# (SSSSSSSSSS.UUUUUU) canX III#DATA or (SSSSSSSSSS.UUUUUU) canX IIIIIIII#DATA
+_std_layout = re.compile(rb'\(\d{10}\.\d{6}\) can\d ([0-9A-Fa-f]{3}|[0-9A-Fa-f]{8})#[0-9A-Fa-f]*\s*\Z').match
+# remote frame: R with an optional DLC digit
+_remote = re.compile(rb'R([0-8]?)\Z').match
+
+
+def parse_line(line):
+    """
+    Parse one candump log line.
+
+    :param bytes line: the line, with or without the trailing newline
+    :return: ``(ts, channel, frame, can_id, data)`` or ``None`` if the line is malformed.
+             ``ts`` is the time stamp in µs (int), ``channel`` and ``frame`` are the raw 2nd and 3rd field
+             (e.g. ``b'can0'`` and ``b'78A#0A0C1CE5F7990000'``), ``data`` is the hex encoded payload
+             (``b'0A0C1CE5F7990000'``).
+    """
+    m = _std_layout(line)
+    if m is not None:
+        # fast path, all offsets are fixed except the end of the can id
+        sep = m.end(1)
+        frame = line[25:].rstrip()
+        return int(line[1:11] + line[12:18]), line[20:24], frame, int(line[25:sep], 16), frame[sep - 24:]
+    return _parse_line_general(line)
+
+
+def _parse_line_general(line):
+    parts = line.split()
+    if len(parts) < 3:
+        return None
+    ts_str = parts[0]
+    if len(ts_str) < 10 or ts_str[0] != 40 or ts_str[-1] != 41 or ts_str[-8] != 46 \
+            or not ts_str[1:-8].isdigit() or not ts_str[-7:-1].isdigit():
+        return None
+    frame = parts[2]
+    id_str, sep, data = frame.partition(b'#')
+    if not sep:
+        return None
+    try:
+        can_id = int(id_str, 16)
+    except ValueError:
+        return None
+    if data[:1] == b'#':  # CAN FD: ID##<flags><data>
+        data = data[2:]
+    elif data[:1] == b'R':  # remote frame
+        if remote_dlc(data) is None:
+            return None
+        data = b''
+    return int(ts_str[1:-8] + ts_str[-7:-1]), parts[1], frame, can_id, data
+
+
+def remote_dlc(data):
+    """
+    :param bytes data: the part of a frame after ``#``, e.g. ``b'R3'``
+    :return: the DLC of a remote frame (``R`` or ``R<dlc>``, 0 without DLC), None if data is no remote frame
+    """
+    m = _remote(data)
+    if m is None:
+        return None
+    return int(m.group(1) or b'0')
+
+
+def format_ts(ts):
+    """
+    :param int ts: time stamp in µs, not negative
+    :return: the time stamp field without parentheses, e.g. ``b'1564994147.496590'``
+    """
+    return b"%d.%06d" % (ts // 1000000, ts % 1000000)
+
+
+def format_line(ts, channel, frame):
+    """
+    :param int ts: time stamp in µs, not negative
+    :return: the log line with newline, e.g. ``b'(1564994147.496590) can0 78A#0A0C1CE5F7990000\\n'``
+    """
+    return b"(%d.%06d) %s %s\n" % (ts // 1000000, ts % 1000000, channel, frame)
+
+
+def iter_lines(buf, start=0, end=None):
+    """
+    Yield the lines of a bytes like object or ``mmap`` between the byte offsets start and end.
+
+    :param buf: bytes, bytearray or mmap
+    :param int start: offset of the first line
+    :param int end: offset behind the last byte to look at, default end of buffer
+    """
+    if end is None:
+        end = len(buf)
+    find = buf.find
+    pos = start
+    while pos < end:
+        nl = find(b'\n', pos, end)
+        if nl < 0:
+            yield buf[pos:end]
+            return
+        yield buf[pos:nl + 1]
+        pos = nl + 1
+
+
+class CompleteLines:
+    """
+    Iterates over the complete lines of a file opened in binary mode and counts them. A last line
+    without newline is held back, a logger may still be writing it.
+
+    :ivar int lines: number of lines yielded
+    :ivar int size: number of bytes yielded
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.lines = 0
+        self.size = 0
+
+    def __iter__(self):
+        for line in self.f:
+            if not line.endswith(b'\n'):
+                return
+            self.lines += 1
+            self.size += len(line)
+            yield line
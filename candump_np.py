@@ -0,0 +1,253 @@
+# coding: utf-8
+
+"""
+Vectorized block parser for candump log files, see candump.py for the line format.
+
+A block of complete lines is parsed at once into a NumPy structured array with one
+record per line. Lines in the standard layout are decoded with array operations,
+the few remaining lines go through candump.parse_line.
+"""
+
+import numpy as np
+
+from candump import parse_line, format_line, remote_dlc
+from compressed import open_log
+
+BLOCK_SIZE = 16 * 1024 * 1024
+SHIFT_CHUNK = 1024 * 1024
+
+FLAG_EXTENDED = 0x01
+FLAG_REMOTE = 0x02
+
+# no padding bytes: numpy copies records field by field, padding would be left undefined
+FRAME_DTYPE = np.dtype({
+    'names': ['ts', 'id', 'channel', 'flags', 'dlc', 'reserved', 'data'],
+    'formats': ['<i8', '<u4', 'u1', 'u1', 'u1', 'u1', ('u1', (8,))],
+    'offsets': [0, 8, 12, 13, 14, 15, 16],
+    'itemsize': 24})
+
+_HEX = np.full(256, 255, np.uint8)
+for _i, _c in enumerate(b'0123456789ABCDEF'):
+    _HEX[_c] = _i
+for _i, _c in enumerate(b'abcdef'):
+    _HEX[_c] = _i + 10
+_POW10 = 10 ** np.arange(9, -1, -1, dtype=np.int64)
+_POW16 = 16 ** np.arange(7, -1, -1, dtype=np.int64)
+_SPACE = np.zeros(256, bool)
+_SPACE[list(b' \t\r\x0b\x0c')] = True
+
+
+class Block:
+    """
+    A block of parsed log lines.
+
+    :ivar buf: the raw bytes of the block
+    :ivar frames: structured array of :data:`FRAME_DTYPE`, one record per line
+    :ivar valid: False for malformed lines
+    :ivar start: offset of each line in buf
+    :ivar end: offset behind each line, including the newline
+    :ivar clean: True if the line is exactly ``(SSSSSSSSSS.UUUUUU) canX ID#DATA\\n``
+    :ivar channels: the channel table of the records
+    """
+
+    def __init__(self, buf, frames, valid, start, end, clean, channels=None):
+        self.buf = buf
+        self.frames = frames
+        self.valid = valid
+        self.start = start
+        self.end = end
+        self.clean = clean
+        self.channels = channels
+
+    def __len__(self):
+        return len(self.frames)
+
+    def line(self, row):
+        """:return: the raw line as bytes"""
+        return bytes(self.buf[self.start[row]:self.end[row]])
+
+
+def read_blocks(f, block_size=BLOCK_SIZE, size=None, partial=True):
+    """
+    Read a file opened in binary mode in blocks of complete lines.
+
+    :param int size: read at most size bytes from the current position, default up to the end of the file
+    :param bool partial: also yield a last line without newline
+    :return: iterator of memoryviews, each ending with a newline (except maybe the last one)
+    """
+    read = getattr(f, "read1", f.read)  # read1 does not wait for a full block on pipes
+    rest = b''
+    while True:
+        if size is None:
+            data = read(block_size)
+        else:
+            data = read(min(block_size, size))
+            size -= len(data)
+        if not data:
+            if rest and partial:
+                yield memoryview(rest)
+            return
+        if rest:
+            data = rest + data
+        cut = data.rfind(b'\n') + 1
+        if cut == 0:
+            rest = data
+            continue
+        rest = data[cut:]
+        yield memoryview(data)[:cut]
+
+
+def channel_index(channels, name):
+    """
+    :param list channels: the channel table, new names are appended
+    :param bytes name: channel name, e.g. b'can0'
+    """
+    try:
+        return channels.index(name)
+    except ValueError:
+        channels.append(name)
+        return len(channels) - 1
+
+
+def _gather(a, offsets, width):
+    idx = offsets[:, None] + np.arange(width)
+    np.minimum(idx, len(a) - 1, out=idx)
+    return a[idx]
+
+
+def parse_block(buf, channels):
+    """
+    Parse a block of complete lines.
+
+    :param buf: bytes like object, e.g. from :func:`read_blocks`
+    :param list channels: channel table, maps the channel index of the records to the channel name
+    :rtype: Block
+    """
+    a = np.frombuffer(buf, np.uint8)
+    end = np.flatnonzero(a == 10) + 1
+    if len(a) and a[-1] != 10:
+        end = np.append(end, len(a))
+    start = np.zeros_like(end)
+    start[1:] = end[:-1]
+    n = len(end)
+    frames = np.zeros(n, FRAME_DTYPE)
+    if n == 0:
+        return Block(buf, frames, np.zeros(0, bool), start, end, np.zeros(0, bool), channels)
+
+    # line end without newline and trailing white space
+    e = end - (a[end - 1] == 10)
+    for _ in range(4):
+        ws = (e > start) & _SPACE[a[np.maximum(e - 1, 0)]]
+        if not ws.any():
+            break
+        e[ws] -= 1
+    length = e - start
+    clean = e == end - 1
+
+    h = _gather(a, start, 34)
+    fast = (length >= 29) & (h[:, 0] == 40) & (h[:, 11] == 46) & (h[:, 18] == 41) & (h[:, 19] == 32) \
+        & (h[:, 20] == 99) & (h[:, 21] == 97) & (h[:, 22] == 110) & (h[:, 24] == 32)
+    digits = h[:, 1:18] - 48  # uint8, wraps around for non digits
+    fast &= (digits[:, :10] < 10).all(1) & (digits[:, 11:] < 10).all(1) & (h[:, 23] - 48 < 10)
+
+    std = fast & (h[:, 28] == 35)
+    ext = fast & ~std & (length >= 34) & (h[:, 33] == 35)
+    nib = _HEX[h[:, 25:33]].astype(np.int64)
+    std &= (nib[:, :3] < 16).all(1)
+    ext &= (nib < 16).all(1)
+    fast = std | ext
+    can_id = np.where(std, nib[:, :3] @ _POW16[5:], nib @ _POW16)
+
+    data_start = start + np.where(std, 29, 34)
+    data_len = e - data_start
+    fast &= (data_len >= 0) & (data_len <= 16) & (data_len % 2 == 0)
+    dnib = _HEX[_gather(a, data_start, 16)]
+    used = np.arange(16) < data_len[:, None]
+    fast &= ~((dnib >= 16) & used).any(1)
+    dnib[~used] = 0
+    clean &= fast
+
+    rows = np.flatnonzero(fast)
+    f = frames[rows]
+    f['ts'] = digits[rows, :10].astype(np.int64) @ _POW10 * 1000000 + digits[rows, 11:].astype(np.int64) @ _POW10[4:]
+    f['id'] = can_id[rows]
+    f['flags'] = np.where(ext[rows], FLAG_EXTENDED, 0)
+    f['dlc'] = data_len[rows] // 2
+    f['data'] = dnib[rows, 0::2] * 16 + dnib[rows, 1::2]
+    channel_lut = np.zeros(10, np.uint8)
+    for d in np.unique(h[rows, 23] - 48).tolist():
+        channel_lut[d] = channel_index(channels, b'can%d' % d)
+    f['channel'] = channel_lut[h[rows, 23] - 48]
+    frames[rows] = f
+
+    valid = fast.copy()
+    for row in np.flatnonzero(~fast).tolist():
+        canData = parse_line(bytes(buf[start[row]:end[row]]))
+        if canData is None:
+            continue
+        ts, channel, frame, can_id, payload = canData
+        valid[row] = True
+        r = frames[row]
+        r['ts'] = ts
+        r['id'] = can_id
+        r['channel'] = channel_index(channels, channel)
+        if len(frame.partition(b'#')[0]) > 3:
+            r['flags'] |= FLAG_EXTENDED
+        dlc = remote_dlc(frame.partition(b'#')[2])
+        if dlc is not None:  # as can.CanutilsLogReader: the DLC, no data
+            r['flags'] |= FLAG_REMOTE
+            r['dlc'] = dlc
+            continue
+        try:
+            data = bytes.fromhex(payload[:16].decode())
+        except ValueError:
+            data = b''
+        r['dlc'] = len(data)
+        r['data'][:len(data)] = list(data)
+    return Block(buf, frames, valid, start, end, clean, channels)
+
+
+def shift_timestamps(buf, start, ts, shift):
+    """
+    Shift the time stamps of lines ``(SSSSSSSSSS.UUUUUU) ...`` by -shift µs, in integer arithmetic.
+
+    The new time stamps are exactly what :func:`candump.format_line` gives for ``ts - shift``.
+
+    :param buf: the lines
+    :param numpy.ndarray start: offset of each line in buf
+    :param numpy.ndarray ts: time stamp of each line in µs
+    :param shift: the shift in µs, int or numpy.ndarray with one per line
+    :return: the shifted lines as numpy.ndarray, None if a time stamp before or after the shift
+             has not exactly 10 digits before the decimal point
+    """
+    a = np.frombuffer(buf, np.uint8).copy()
+    for i in range(0, len(ts), SHIFT_CHUNK):
+        t = ts[i:i + SHIFT_CHUNK]
+        s = start[i:i + SHIFT_CHUNK, None]
+        x = t - (shift[i:i + SHIFT_CHUNK] if np.ndim(shift) else shift)
+        if not ((x >= 10 ** 15) & (x < 10 ** 16) & (t >= 10 ** 15) & (t < 10 ** 16)).all():
+            return None
+        sec = x // 1000000
+        usec = x % 1000000
+        a[s + np.arange(1, 11)] = sec[:, None] // _POW10 % 10 + 48
+        a[s + np.arange(12, 18)] = usec[:, None] // _POW10[4:] % 10 + 48
+    return a
+
+
+def shift_file(log_file_name, log_file_name_gps, shift):
+    """
+    Copy a candump log file with the time stamps shifted by -shift µs.
+    """
+    channels = []
+    with open_log(log_file_name_gps, "wb") as lf_gps, open_log(log_file_name, "rb") as lf:
+        for buf in read_blocks(lf):
+            block = parse_block(buf, channels)
+            data = None
+            if block.clean.all():
+                data = shift_timestamps(buf, block.start, block.frames['ts'], shift)
+            if data is not None:
+                lf_gps.write(data)
+                continue
+            for row in range(len(block)):
+                ts, channel, frame, _, _ = parse_line(block.line(row))
+                lf_gps.write(format_line(ts - shift, channel, frame))
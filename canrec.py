@@ -0,0 +1,238 @@
+# coding: utf-8
+
+"""
+Fixed-size record format for CAN frames (.canrec), an alternative to candump text segments.
+
+A file is a 512 byte header followed by one record of :data:`candump_np.FRAME_DTYPE` (24 bytes:
+int64 time stamp in µs, id, channel, flags, dlc, a reserved byte, 8 data bytes) per frame::
+
+    magic b'CANREC\\x00\\x01', header size, record size, number of channels, 0  (uint32 little endian)
+    channel table, 30 names of 16 bytes, NUL padded
+
+The records are read through ``mmap`` (:class:`RecordFile`) as a NumPy view, without parsing.
+:class:`RecordReader` iterates over them as python-can messages, like the can.LogReader readers, from
+a start time found by bisecting the time stamps (the records of a segment are in time order).
+CAN FD payloads are cut to 8 bytes.
+"""
+
+import mmap
+import os
+
+import numpy as np
+
+import writer
+from candump_np import FRAME_DTYPE, FLAG_EXTENDED, FLAG_REMOTE, parse_block, channel_index
+
+RECORD_SUFFIX = ".canrec"
+MAGIC = b'CANREC\x00\x01'
+HEADER_SIZE = 512
+MAX_CHANNELS = 30
+WRITE_BUFFER = 1024 * 1024
+READ_CHUNK = 64 * 1024
+
+HEADER_DTYPE = np.dtype({
+    'names': ['magic', 'header_size', 'record_size', 'channels', 'reserved', 'channel'],
+    'formats': ['S8', '<u4', '<u4', '<u4', '<u4', ('S16', (MAX_CHANNELS,))],
+    'offsets': [0, 8, 12, 16, 20, 24],
+    'itemsize': HEADER_SIZE})
+
+
+def gps_file_name(log_file_name):
+    return log_file_name[:-len(RECORD_SUFFIX)] + "-gps" + RECORD_SUFFIX
+
+
+def pack_header(channels):
+    """
+    :param list channels: channel names as bytes
+    :return: the header as bytes
+    """
+    if len(channels) > MAX_CHANNELS:
+        raise ValueError("more than {:d} channels".format(MAX_CHANNELS))
+    header = np.zeros(1, HEADER_DTYPE)
+    header['magic'] = MAGIC
+    header['header_size'] = HEADER_SIZE
+    header['record_size'] = FRAME_DTYPE.itemsize
+    header['channels'] = len(channels)
+    header['channel'][0, :len(channels)] = channels
+    return header.tobytes()
+
+
+def unpack_header(data, file_name=""):
+    """
+    :return: the channel table
+    """
+    if len(data) < HEADER_SIZE or data[:8] != MAGIC:
+        raise ValueError("{} is not a {} file".format(file_name, RECORD_SUFFIX))
+    header = np.frombuffer(data[:HEADER_SIZE], HEADER_DTYPE)[0]
+    if header['header_size'] != HEADER_SIZE or header['record_size'] != FRAME_DTYPE.itemsize:
+        raise ValueError("{} has an unsupported header or record size".format(file_name))
+    return header['channel'][:header['channels']].tolist()
+
+
+class RecordWriter:
+    """
+    Writes a record file. Takes candump log lines (:meth:`write`) or parsed frames (:meth:`write_frames`).
+    The channel table in the header is written on :meth:`close`.
+    """
+
+    def __init__(self, file_name, mode="wb"):
+        """
+        :param str mode: 'wb', or 'ab' to continue an existing file
+        """
+        self.name = file_name
+        self.pending = bytearray()
+        self.source = None
+        if "a" in mode and os.path.exists(file_name):
+            self.f = open(file_name, "r+b")
+            self.channels = unpack_header(self.f.read(HEADER_SIZE), file_name)
+            self.f.seek(0, os.SEEK_END)
+        else:
+            self.f = open(file_name, "wb")
+            self.channels = []
+            self.f.write(pack_header(self.channels))
+        self.closed = False
+
+    def write(self, lines):
+        """
+        :param lines: complete candump log lines
+        """
+        self.pending += lines
+        if len(self.pending) >= WRITE_BUFFER:
+            self.write_pending()
+
+    def write_pending(self):
+        if self.pending:
+            pending = self.pending
+            self.pending = bytearray()
+            channels = []
+            block = parse_block(pending, channels)
+            self.write_frames(block.frames[block.valid], channels)
+
+    def write_frames(self, frames, channels):
+        """
+        :param numpy.ndarray frames: records of :data:`candump_np.FRAME_DTYPE`
+        :param list channels: the channel table of the frames
+        """
+        self.write_pending()
+        if len(frames) == 0:
+            return
+        if channels is not self.source:
+            self.source = channels
+            self.lut = np.zeros(256, np.uint8)  # channel index of the frames -> index in self.channels
+            self.mapped = np.zeros(256, bool)
+            self.identity = True
+        channel = frames['channel']
+        if not self.mapped[channel].all():
+            # new channels are added to the table in order of appearance, whatever the table of the frames
+            used, first = np.unique(channel, return_index=True)
+            for index in used[np.argsort(first)].tolist():
+                self.lut[index] = channel_index(self.channels, channels[index])
+                self.mapped[index] = True
+            self.identity = (self.lut[self.mapped] == np.flatnonzero(self.mapped)).all()
+        if not self.identity:
+            frames = frames.copy()
+            frames['channel'] = self.lut[channel]
+        self.f.write(frames.tobytes())
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.write_pending()
+            self.f.seek(0)
+            self.f.write(pack_header(self.channels))
+            if writer.fsync_policy != "none":  # see writer.py, the records are written in large pieces anyway
+                self.f.flush()
+                os.fsync(self.f.fileno())
+                writer.count_syscalls({"fsync": 1})
+        finally:
+            self.f.close()
+            self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class RecordFile:
+    """
+    A record file mapped into memory.
+
+    :ivar frames: read-only NumPy view of the records
+    :ivar channels: the channel table, bytes
+    """
+
+    def __init__(self, file_name):
+        self.name = file_name
+        with open(file_name, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.channels = unpack_header(self.mm, file_name)
+        count = (len(self.mm) - HEADER_SIZE) // FRAME_DTYPE.itemsize
+        self.frames = np.frombuffer(self.mm, FRAME_DTYPE, count, HEADER_SIZE)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def close(self):
+        self.frames = None  # release the buffer export, or mmap.close() fails
+        self.mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class RecordReader:
+    """
+    Iterator over the frames of a record file as can.Message, see can.LogReader.
+    """
+
+    def __init__(self, file_name, start_time=None, *args, **kwargs):
+        """
+        :param float start_time: skip the frames before, None for all frames
+        """
+        self.file = RecordFile(file_name)
+        self.start = 0
+        if start_time is not None:
+            self.start = int(np.searchsorted(self.file.frames['ts'], round(start_time * 1000000)))
+
+    def __iter__(self):
+        from can import Message
+
+        frames = self.file.frames[self.start:]
+        channels = [name.decode() for name in self.file.channels]
+        for i in range(0, len(frames), READ_CHUNK):
+            chunk = frames[i:i + READ_CHUNK]
+            for ts, can_id, channel, flags, dlc, data in zip((chunk['ts'] / 1000000).tolist(),
+                                                             chunk['id'].tolist(), chunk['channel'].tolist(),
+                                                             chunk['flags'].tolist(), chunk['dlc'].tolist(),
+                                                             chunk['data'].tolist()):
+                remote = bool(flags & FLAG_REMOTE)
+                yield Message(timestamp=ts, arbitration_id=can_id, is_extended_id=bool(flags & FLAG_EXTENDED),
+                              is_remote_frame=remote, dlc=dlc, data=None if remote else bytearray(data[:dlc]),
+                              channel=channels[channel] if channel < len(channels) else channel)
+
+    def stop(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+def shift_records(log_file_name, log_file_name_gps, diff):
+    """
+    Copy a record file with the time stamps shifted by -diff seconds (rounded to µs).
+    """
+    shift = round(diff * 1000000)
+    with RecordFile(log_file_name) as src, RecordWriter(log_file_name_gps) as dst:
+        for i in range(0, len(src), WRITE_BUFFER):
+            frames = src.frames[i:i + WRITE_BUFFER].copy()
+            frames['ts'] -= shift
+            dst.write_frames(frames, src.channels)
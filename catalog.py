@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Segment index written by correct-ts.py, so tools find the segment covering a time without scanning the files.
+
+Next to each segment file correct-ts writes a sidecar <segment>.idx (JSON) with the first and last time
+stamp of the frames (as written, and GPS corrected with the mean GPS offset), the number of frames, the
+file size, the ids present (a bitmap of the 2048 standard ids, a list of the extended ids) and the GPS
+offset statistics. catalog.jsonl in the output directory collects the entries of all runs, one per line,
+appended as the segments are closed. A later entry of a file replaces the earlier ones (the segment was
+overwritten). :func:`load_catalog` reads it once into a :class:`Catalog`, sorted by start time, on
+which :func:`find_segments` bisects.
+
+   python catalog.py data 1564994150.5
+"""
+
+import argparse
+import bisect
+import itertools
+import json
+import os
+
+import numpy as np
+
+from candump import SYNC_ID
+
+INDEX_SUFFIX = ".idx"
+CATALOG_NAME = "catalog.jsonl"
+STANDARD_IDS = 0x800
+
+
+class SegmentSummary:
+    """
+    Time range and ids of the frames of a segment, updated in bulk.
+    """
+
+    def __init__(self):
+        self.first = None  # µs
+        self.last = None
+        self.standard = np.zeros(STANDARD_IDS, bool)
+        self.extended = set()
+
+    def add(self, ids, ts):
+        """
+        :param numpy.ndarray ids: id of each frame, time sync frames are ignored (they are not written)
+        :param numpy.ndarray ts: time stamp of each frame in µs
+        """
+        written = ids != SYNC_ID
+        ids = ids[written]
+        if len(ids) == 0:
+            return
+        ts = ts[written]
+        self.add_range(int(ts.min()), int(ts.max()))
+        self.add_ids(ids)
+
+    def add_range(self, first, last):
+        """
+        :param int first: earliest time stamp in µs
+        :param int last: latest time stamp in µs
+        """
+        self.first = first if self.first is None else min(self.first, first)
+        self.last = last if self.last is None else max(self.last, last)
+
+    def add_ids(self, ids):
+        """
+        :param numpy.ndarray ids: ids of written frames
+        """
+        standard = ids < STANDARD_IDS
+        self.standard[ids[standard]] = True
+        if not standard.all():
+            self.extended.update(np.unique(ids[~standard]).tolist())
+
+    def entry(self, file_name, frames, gps=None):
+        """
+        :param str file_name: the segment file
+        :param int frames: number of frames in the segment
+        :param onlinestats.RunningStats gps: the GPS offsets of the segment
+        :return: the index entry as dict
+        """
+        start = end = None
+        if self.first is not None:
+            start, end = self.first / 1000000, self.last / 1000000
+        entry = {
+            "file": os.path.basename(file_name),
+            "start_ts": start,
+            "end_ts": end,
+            "gps_start_ts": None,
+            "gps_end_ts": None,
+            "frames": frames,
+            "bytes": os.path.getsize(file_name),
+            "standard_ids": np.packbits(self.standard).tobytes().hex(),
+            "extended_ids": sorted(self.extended),
+            "gps_offset": None,
+        }
+        if gps is not None and len(gps):
+            if start is not None:
+                entry["gps_start_ts"] = start - gps.mean
+                entry["gps_end_ts"] = end - gps.mean
+            entry["gps_offset"] = {
+                "count": len(gps), "mean": gps.mean, "stdev": gps.stdev() if len(gps) > 1 else None,
+                "min": gps.min, "max": gps.max,
+                "p50": gps.quantile(0.5), "p95": gps.quantile(0.95), "p99": gps.quantile(0.99)}
+        return entry
+
+    def state(self):
+        return {"first": self.first, "last": self.last, "standard": np.flatnonzero(self.standard).tolist(),
+                "extended": sorted(self.extended)}
+
+    def restore(self, state):
+        self.first = state["first"]
+        self.last = state["last"]
+        self.standard[:] = False
+        self.standard[state["standard"]] = True
+        self.extended = set(state["extended"])
+
+
+def has_id(entry, can_id):
+    """
+    :return: True if the segment of the index entry has frames with can_id
+    """
+    if can_id < STANDARD_IDS:
+        return bool(bytes.fromhex(entry["standard_ids"])[can_id >> 3] & (0x80 >> (can_id & 7)))
+    return can_id in entry["extended_ids"]
+
+
+def write_index(entry, file_name):
+    """
+    Write the sidecar index of the segment file_name, see also :func:`update_catalog`.
+    """
+    with open(file_name + INDEX_SUFFIX, "w") as f:
+        json.dump(entry, f)
+        f.write("\n")
+
+
+class Catalog:
+    """
+    The catalog entries sorted by start time, with the lookup lists of :func:`find_segments` built once.
+    """
+
+    def __init__(self, entries):
+        self.entries = sorted(entries, key=sort_key)
+        self.lookup = {gps: self._lookup(gps) for gps in (False, True)}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def _lookup(self, gps):
+        """
+        :return: the entries with frames sorted by (GPS) start time, their start times and the latest end of
+                 the entries up to each one (segments of different runs may overlap)
+        """
+        start, end = ("gps_start_ts", "gps_end_ts") if gps else ("start_ts", "end_ts")
+        entries = sorted((entry for entry in self.entries if entry[start] is not None), key=lambda entry: entry[start])
+        starts = [entry[start] for entry in entries]
+        reach = list(itertools.accumulate((entry[end] for entry in entries), max))
+        return entries, starts, reach
+
+
+def load_catalog(directory):
+    """
+    :return: the :class:`Catalog` of the directory, empty if there is no catalog
+    """
+    entries = {}
+    try:
+        with open(os.path.join(directory, CATALOG_NAME)) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:  # empty, or torn by a crash while appending
+                    continue
+                entries[entry["file"]] = entry
+    except FileNotFoundError:
+        pass
+    return Catalog(entries.values())
+
+
+def update_catalog(directory, entries):
+    """
+    Append index entries to the catalog. They replace the entries of the same file (the segment was
+    overwritten) when the catalog is loaded.
+    """
+    data = "".join(json.dumps(entry) + "\n" for entry in entries).encode()
+    with open(os.path.join(directory, CATALOG_NAME), "ab+") as f:
+        size = f.seek(0, os.SEEK_END)
+        if size:
+            f.seek(size - 1)
+            if f.read(1) != b"\n":  # a line torn by a crash, do not continue it
+                data = b"\n" + data
+        f.write(data)
+
+
+def sort_key(entry):
+    # segments without frames first
+    return (entry["start_ts"] is not None, entry["start_ts"] or 0, entry["file"])
+
+
+def find_segments(catalog, ts, gps=False):
+    """
+    Bisect the start times, then walk back while the latest end of the earlier entries reaches ts.
+
+    :param Catalog catalog: see :func:`load_catalog`
+    :param float ts: the time in s
+    :param bool gps: ts is GPS time, compare with the GPS corrected time stamps
+    :return: the entries whose time range covers ts
+    """
+    entries, starts, reach = catalog.lookup[gps]
+    end = "gps_end_ts" if gps else "end_ts"
+    found = []
+    i = bisect.bisect_right(starts, ts) - 1
+    while i >= 0 and reach[i] >= ts:
+        if entries[i][end] >= ts:
+            found.append(entries[i])
+        i -= 1
+    return found[::-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Find the segments covering a time in the catalog of correct-ts.')
+    parser.add_argument('directory', type=str, help='Output directory of correct-ts.')
+    parser.add_argument('ts', type=float, help='Time in s since the epoch.')
+    parser.add_argument('-gps', action='store_true', help='ts is GPS time (UTC).')
+    args = parser.parse_args()
+    for entry in find_segments(load_catalog(args.directory), args.ts, args.gps):
+        print(os.path.join(args.directory, entry["file"]))
+
+
+if __name__ == "__main__":
+    main()
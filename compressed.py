@@ -0,0 +1,168 @@
+# coding: utf-8
+
+"""
+Transparent access to compressed log files (.gz, .xz, .bz2).
+
+The (de)compression runs on a background thread which exchanges large buffers with
+the reading or writing thread. zlib, lzma and bz2 release the GIL while they work,
+so parsing and (de)compression overlap. Files are written through writer.ChunkWriter.
+"""
+
+import bz2
+import gzip
+import io
+import lzma
+import os
+import queue
+import threading
+
+from writer import ChunkWriter
+
+CHUNK_SIZE = 4 * 1024 * 1024
+QUEUE_DEPTH = 4
+
+COMPRESSED = {
+    '.gz': lambda file_name, mode: gzip.open(file_name, mode, compresslevel=6),
+    '.xz': lzma.open,
+    '.bz2': bz2.open,
+}
+
+
+def compression(file_name):
+    """
+    :return: the compression suffix of file_name (e.g. '.gz') or None for an uncompressed file
+    """
+    suffix = os.path.splitext(file_name)[1]
+    return suffix if suffix in COMPRESSED else None
+
+
+def open_log(file_name, mode="rb"):
+    """
+    Open a log file in binary mode, compressed files are (de)compressed on a background thread.
+
+    :param str file_name: the file, compression is selected by the suffix
+    :param str mode: 'rb', 'wb' or 'ab'
+    """
+    suffix = compression(file_name)
+    if "r" not in mode:
+        f = ChunkWriter(file_name, mode)
+        if suffix is None:
+            return f
+        return io.BufferedWriter(BackgroundWriter(COMPRESSED[suffix](f, mode), file_name, f), CHUNK_SIZE)
+    if suffix is None:
+        return open(file_name, mode)
+    return io.BufferedReader(BackgroundReader(COMPRESSED[suffix](file_name, "rb"), file_name), CHUNK_SIZE)
+
+
+class BackgroundReader(io.RawIOBase):
+    """
+    Reads a file object on a background thread, up to QUEUE_DEPTH chunks ahead of the consumer.
+    """
+
+    def __init__(self, f, name=None, chunk_size=CHUNK_SIZE, depth=QUEUE_DEPTH):
+        super().__init__()
+        self.f = f
+        self.name = name
+        self.chunk_size = chunk_size
+        self.queue = queue.Queue(depth)
+        self.chunk = memoryview(b'')
+        self.pos = 0
+        self.eof = False
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            while not self.stopped.is_set():
+                data = self.f.read(self.chunk_size)
+                self.queue.put(data)
+                if not data:
+                    return
+        except BaseException as e:
+            self.queue.put(e)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self.pos >= len(self.chunk):
+            if self.eof:
+                return 0
+            data = self.queue.get()
+            if isinstance(data, BaseException):
+                raise data
+            if not data:
+                self.eof = True
+                return 0
+            self.chunk = memoryview(data)
+            self.pos = 0
+        n = min(len(b), len(self.chunk) - self.pos)
+        b[:n] = self.chunk[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            self.stopped.set()
+            while self.thread.is_alive():
+                try:
+                    self.queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            self.f.close()
+        super().close()
+
+
+class BackgroundWriter(io.RawIOBase):
+    """
+    Writes to a file object on a background thread. Use it behind an io.BufferedWriter,
+    so the thread gets large buffers.
+    """
+
+    def __init__(self, f, name=None, raw=None, depth=QUEUE_DEPTH):
+        """
+        :param raw: file object under f, closed after f
+        """
+        super().__init__()
+        self.f = f
+        self.raw = raw
+        self.name = name
+        self.queue = queue.Queue(depth)
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                return
+            if self.error is None:
+                try:
+                    self.f.write(data)
+                except BaseException as e:
+                    self.error = e
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        if self.error is not None:
+            raise self.error
+        data = bytes(b)
+        self.queue.put(data)
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.queue.put(None)
+            self.thread.join()
+            try:
+                self.f.close()
+            finally:
+                if self.raw is not None:
+                    self.raw.close()
+        super().close()
+        if self.error is not None:
+            raise self.error
@@ -1,7 +1,17 @@
 import argparse
-import datetime
+import io
 import os
-from statistics import mean, variance, stdev
+import sys
+import time
+from contextlib import redirect_stdout
+
+import correction
+from batch import InputResult, REPORT_NAME, is_batch, find_inputs, output_dirs, process_batch
+from candump import CompleteLines
+from compressed import open_log, compression
+from correction import LogCorrector, StatsCorrector, StreamCorrector, StreamWriter, load_checkpoint, save_checkpoint
+from profiling import StageProfiler, profiled, DUMP_SUFFIXES
+from writer import FSYNC_POLICIES, SYSCALLS, set_fsync_policy
 
 '''
    Adjust timestamps of a CAN dump file according to GPS time (UTC).
@@ -11,170 +21,265 @@ from statistics import mean, variance, stdev
 
 ## todo -- user rather Log Reader then our  complicated parsing code !!!
 
-parser = argparse.ArgumentParser(
-    description='Correct time stamps according to the logger time sync (canId 0x1FFFFFF0) and optional GPS time (UTC).'
-                'Only useful for CANaerospace format!')
-parser.add_argument('-input', metavar='input', type=str, help='Input logfile.')
-parser.add_argument('-gps', action='store_true', help='Sync with GPS time (canIDs 1200 and 1206.')
 
-args = parser.parse_args()
+def correct(corrector, inf, numpy, cnt=0, partial=True, profiler=None):
+    """
+    :param int cnt: line number of the first line
+    :param bool partial: also process a last line without newline
+    :param StageProfiler profiler: time reading and parsing
+    :return: (line number, number of bytes) behind the processed lines, None in text mode with partial
+    """
+    if numpy:
+        from candump_np import read_blocks, parse_block
+        channels = []
+        size = 0
+        blocks = read_blocks(inf, partial=partial)
+        if profiler is not None:
+            blocks = profiler.iterate("read", blocks, len, "bytes")
+            parse_block = profiler.wrap("parse", parse_block, lambda call, block: len(block), "lines")
+        for buf in blocks:
+            block = parse_block(buf, channels)
+            corrector.process_block(block, cnt)
+            cnt = cnt + len(block)
+            size = size + len(buf)
+        return cnt, size
+    lines = inf if partial else CompleteLines(inf)
+    corrector.process(lines if profiler is None else profiler.iterate("read", lines, unit="lines"), cnt)
+    if partial:
+        return None
+    return cnt + lines.lines, lines.size
 
-inputFile = args.input
-syncwithgps = args.gps
 
+def instrument(profiler, corrector, numpy):
+    """
+    Time the stages of the correction, see profiling.py.
+    """
+    frames = "frames"
+    nothing = lambda call, result: 0  # counted by the other function of the stage
+    profiler.patch(correction, "parse_line", "parse", unit="lines")
+    if numpy:
+        profiler.patch(corrector, "process_block", "process", lambda call, result: len(call[0]), "lines")
+        profiler.patch(corrector, "write_rows", "write", lambda call, result: call[2] - call[1], frames)
+        profiler.patch(correction, "block_statistics", "statistics", lambda call, result: len(call[2]), "lines")
+        profiler.patch(corrector, "flush_statistics", "statistics", nothing)
+        profiler.patch(corrector, "summarize", "index", lambda call, result: call[2] - call[1], "lines")
+        profiler.patch(corrector, "write_index", "index", nothing)
+    else:
+        # the lines are written one by one
+        profiler.patch(corrector, "process", "process")
+        open_segment_file = corrector.open_segment_file
+        corrector.open_segment_file = lambda *call: profiler.writer("write", open_segment_file(*call))
+        profiler.patch(corrector, "flush_statistics", "statistics", unit="runs")
+        profiler.patch(corrector, "write_index", "index", unit="segments")
+    profiler.patch(corrector, "special_frame", "time sync", unit=frames)
+    profiler.patch(corrector, "close_logfile", "segment close", unit="segments")
+    profiler.patch(corrector, "write_gps_copy", "gps copy", unit="segments")
 
-# (1564994147.496590) can0 78A#0A0C1CE5F7990000
-def getCanData(line):
-    parts = (" ".join(line.split()).split())
-    ts = float(parts[0][1:18])
-    canDevStr = parts[1]
-    parts2 = parts[2].split("#")
 
-    canIdStr = parts2[0]
-    nodeIdStr = parts2[1][0:2]
-    dataStr = parts2[1][8:40]
-    return ts, canDevStr, canIdStr, dataStr, nodeIdStr
+def main():
+    parser = argparse.ArgumentParser(
+        description='Correct time stamps according to the logger time sync (canId 0x1FFFFFF0) and optional GPS time (UTC).'
+                    'Only useful for CANaerospace format!')
+    parser.add_argument('-input', metavar='input', type=str, required=True,
+                        help='Input logfile (may be compressed: .gz, .xz, .bz2), - for stdin. A directory (its .log '
+                             'files) or a glob pattern (quoted) corrects each file into its own directory in the '
+                             'output directory, see batch.py.')
+    parser.add_argument('-output', metavar='output', type=str, default='data',
+                        help='Directory for the segment files (default data), - to stream all frames to stdout.')
+    parser.add_argument('-compress', choices=['gz', 'xz', 'bz2'], default=None,
+                        help='Compress the segment files.')
+    parser.add_argument('-binary', action='store_true',
+                        help='Write the segments as fixed-size records (.canrec, see canrec.py) instead of candump '
+                             'text.')
+    parser.add_argument('-gps', action='store_true', help='Sync with GPS time (canIDs 1200 and 1206.')
+    parser.add_argument('-drift', action='store_true',
+                        help='Write the GPS time corrected copy of each segment along with it, every frame corrected '
+                             'by a streaming fit of the GPS time offset and the clock drift (see drift.py), instead '
+                             'of shifting the segment by the mean offset afterwards. Implies -gps.')
+    parser.add_argument('-numpy', action='store_true',
+                        help='Parse the input in large blocks with NumPy (see candump_np.py).')
+    parser.add_argument('-jobs', metavar='N', type=int, default=0,
+                        help='Split the input into N shards processed by N worker processes (implies -numpy). '
+                             'With a directory or glob pattern as input: correct N files at once (default one per '
+                             'CPU), each by one process.')
+    parser.add_argument('-fsync', choices=FSYNC_POLICIES, default='none',
+                        help='Sync the segment files to disk: none (default, left to the OS), close (each finished '
+                             'file) or chunk (every 4 MiB written, see writer.py).')
+    parser.add_argument('-flush-lines', metavar='N', type=int, default=1000,
+                        help='With -output -: flush stdout after N lines (default 1000).')
+    parser.add_argument('-flush-interval', metavar='S', type=float, default=1.0,
+                        help='With -output -: flush stdout at least every S seconds (default 1.0).')
+    parser.add_argument('-stats', metavar='file', type=str, default=None,
+                        help='Write the canId/nodeId statistics to this file (.csv or .json) instead of printing them '
+                             'as CSV.')
+    parser.add_argument('-stats-only', '--stats-only', action='store_true',
+                        help='Analysis only: print the segments with their GPS offset statistics and the canId/nodeId '
+                             'statistics, without writing any file to the output directory (implies -numpy).')
+    parser.add_argument('-checkpoint', metavar='file', type=str, default=None,
+                        help='Resume from this checkpoint file if it exists and update it at the end: only the lines '
+                             'appended since the last run are processed, the last segment stays open.')
+    parser.add_argument('-final', action='store_true',
+                        help='With -checkpoint: the log is complete, close the last segment and remove the checkpoint.')
+    parser.add_argument('-profile', metavar='file', type=str, default=None,
+                        help='Time the stages (read, parse, time sync, write, statistics, GPS copy, ...), print them '
+                             'to stderr at the end and write them to this JSON file.')
+    parser.add_argument('-profile-dump', choices=sorted(DUMP_SUFFIXES), default=None,
+                        help='With -profile: also write a cProfile (.prof) or tracemalloc (.tracemalloc) dump next '
+                             'to the JSON file.')
 
+    args = parser.parse_args()
 
-def statistics(ids, id):
-    if id not in ids:
-        ids[id] = 1
-    ids[id] = ids[id] + 1
+    inputFile = args.input
+    syncwithgps = args.gps or args.drift
+    batch = is_batch(inputFile)
+    sharded = args.jobs and not batch
+    if args.output == '-' and (syncwithgps or batch):
+        parser.error('-gps and a directory or glob pattern as input need segment files, not possible with -output -')
+    if sharded and (inputFile == '-' or compression(inputFile) or args.compress):
+        parser.error('-jobs needs an uncompressed input file and uncompressed output')
+    if args.binary and (args.output == '-' or args.compress or sharded):
+        parser.error('-binary needs uncompressed segment files, not possible with -jobs')
+    if args.drift and (args.binary or sharded):
+        parser.error('-drift needs text segment files, not possible with -binary or -jobs')
+    if args.checkpoint and (inputFile == '-' or compression(inputFile) or args.output == '-' or args.jobs or batch):
+        parser.error('-checkpoint needs an uncompressed input file and segment files, not possible with -jobs '
+                     'or a directory or glob pattern as input')
+    if args.stats_only and (args.output == '-' or args.checkpoint or args.drift):
+        parser.error('-stats-only writes no files, not possible with -output -, -checkpoint or -drift')
+    if args.profile_dump and not args.profile:
+        parser.error('-profile-dump needs -profile')
+    if batch and args.profile:
+        parser.error('-profile times one process, not possible with a directory or glob pattern as input')
+    set_fsync_policy(args.fsync)
+    if batch:
+        run_batch(parser, args)
+        return
+    profiler = StageProfiler() if args.profile else None
+    with profiled(profiler, args.profile, args.profile_dump, "correct-ts", counters={"syscalls": SYSCALLS}):
+        run(parser, args, profiler)
 
 
-## "(1564994154.769054) can0 40C#0A032A3A1BC27A49"
-## "(1569437515.1000000) can0 141#0A0200A942E1CBEA" --> ERROR
-def check(line):
-    try:
-        if not line.startswith("("):
-            return False
-        for c in line[1:11]:
-            if not c.isdigit():
-                return False
-        if line[11] != '.':
-            return False
-        for c in line[12:18]:
-            if not c.isdigit():
-                return False
-        if line[18] != ')':
-            return False
-        return True
-    except (IndexError):
-        return False
-
-def close_logfile(ts_log):
-    global new_log, new_log_file_name
+def correct_input(job):
+    """
+    Correct one file of the batch mode, in a worker process. What a single run prints goes to REPORT_NAME
+    in its output directory, with -stats-only to the result.
+
+    :param job: (input file, output directory, parsed arguments)
+    :rtype: batch.InputResult
+    """
+    inputFile, output, args = job
+    set_fsync_policy(args.fsync)
+    suffix = "." + args.compress if args.compress else ""
+    wall = time.perf_counter()
     try:
-        new_log.close()
-        new_log_file_name = "data/candump-{}.log". \
-            format(datetime.datetime.fromtimestamp(int(ts_log))).replace(" ", "_").replace(":", "")
-        os.rename(new_log.name, new_log_file_name)
-    except IOError:
-        pass
-
-
-def print_gps_diff_statistics():
-    global mmm
-    m = mean(mmm)
-    print(new_log_file_name, " cnt=", new_cnt, "mean=", m, "variance=", variance(mmm, m), "stdev=", stdev(mmm, m),
-          "max=", max(mmm), "min=", min(mmm))
-
-
-def sync_with_gps(log_file_name: str, diff):
-    log_file_name_gps = log_file_name.replace(".log", "-gps.log")
-    with open(log_file_name_gps, "w") as lf_gps, open(log_file_name) as lf:
-        for _, line in enumerate(lf):
-            ts, channel, frame = line.strip().split()
-            ts = float(ts[1:-1])
-            lf_gps.write("({:f}) {} {}\n".format(ts - diff, channel, frame))
-
-
-with open(inputFile) as inf:
-    canIds = {}
-    nodeIds = {}
-    dataUtcStr = None
-    dataDateStr = None
-    ts_log_last = None
-    ts_log_first = None
-    log_file_nr = 0
-    new_log = None
-    new_log_file_name = None
-    diff = None
-    ts_log_diff = None
-    mmm = []
-    new_cnt = 0
-    ts_first = None
-    ts_gps_first = None
-
-
-    for cnt, line in enumerate(inf):
-        if new_log is None:
-            log_file_nr = log_file_nr + 1
-            new_log = open("data/newlog_{}.log".format(log_file_nr), "w+")
-        if not check(line):
-            print("ERROR, line={:d} >>>{:s}<<< \n".format(cnt, line))
+        if args.stats_only:
+            corrector = StatsCorrector(output, suffix, args.binary)
+            report = io.StringIO()
         else:
-            ts, canDevStr, canIdStr, dataStr, nodeIdStr = getCanData(line)
-            diff = 0.0
-            canId = int(canIdStr, 16)
-            if ts_first is None:
-                ts_first = ts
-
-            if canId == 0x1FFFFFF0:  # Time sync
-                ts_log = datetime.datetime((int(line[34:36], 16) + 2000), int(line[37:38], 16),
-                                           int(line[38:40], 16), int(line[40:42], 16),
-                                           int(line[42:44], 16), int(line[44:46], 16)).timestamp()
-                diff = ts_log - ts
-                if ts_log_last is None:
-                    ts_log_last = ts_log
-                ts_log_diff = ts_log - ts_log_last
-                ts_log_last = ts_log
-                if ts_log_first is None:
-                    ts_log_first = ts_log
-                line = None
-
-            elif canId == 1200:  # UTC
-                if not dataDateStr is None:
-                    ts_gps = datetime.datetime((int(dataDateStr[4:6], 16) * 100) + int(dataDateStr[6:8], 16),
-                                               int(dataDateStr[2:4], 16),
-                                               int(dataDateStr[0:2], 16), int(dataStr[0:2], 16), int(dataStr[2:4], 16),
-                                               int(dataStr[4:6], 16)).timestamp()
-                    if ts_gps_first is None:
-                        ts_gps_first = ts_gps
-                    mmm.append((ts + diff) - ts_gps)
-                dataUtcStr = dataStr
-
-            elif canId == 1206: # Date
-                dataDateStr = dataStr
-
-            if line is not None:
-                parts = (" ".join(line.split()).split())
-                new_log.write("({:f}) {} {}\n".format(ts + diff, parts[1], parts[2]))
-                new_cnt = new_cnt + 1
-
-            if ts_log_first is not None and ts_log_diff > 1.0:
-                close_logfile(ts_log_first)
-                print_gps_diff_statistics()
-                if syncwithgps:
-                    sync_with_gps(new_log_file_name, mean(mmm))
-                mmm = []
-                new_log = None
-                ts_log_first = None
-
-            statistics(canIds, canId)
-            statistics(nodeIds, int(nodeIdStr, 16))
-
-    if ts_log_first is None:
-        ts_log_first = ts_gps_first
-
-    close_logfile(ts_log_first)
-    print_gps_diff_statistics()
-    if syncwithgps:
-        sync_with_gps(new_log_file_name, mean(mmm))
-
-print("canId statistics")
-print(sorted(canIds.items(), key=lambda kv: kv[0], reverse=True))
-print(sorted(canIds.items(), key=lambda kv: kv[1], reverse=True))
-print("nodeId statistics")
-print(sorted(nodeIds.items(), key=lambda kv: kv[0], reverse=True))
-print(sorted(nodeIds.items(), key=lambda kv: kv[1], reverse=True))
+            os.makedirs(output, exist_ok=True)
+            corrector = LogCorrector(args.gps or args.drift, args.numpy, output, suffix, args.binary, args.drift)
+            report = open(os.path.join(output, REPORT_NAME), "w")
+        with report, redirect_stdout(report):
+            with open_log(inputFile) as inf:
+                correct(corrector, inf, args.numpy or args.stats_only)
+            corrector.finish()
+            corrector.print_statistics()
+            text = report.getvalue() if args.stats_only else None
+    except Exception as e:
+        return InputResult(inputFile, output, wall=time.perf_counter() - wall, error=repr(e))
+    return InputResult(inputFile, output, corrector, time.perf_counter() - wall, report=text)
+
+
+def run_batch(parser, args):
+    inputs = find_inputs(args.input)
+    if not inputs:
+        parser.error('no log files in {}'.format(args.input))
+    try:
+        dirs = output_dirs(inputs, args.output)
+    except ValueError as e:
+        parser.error(str(e))
+    report = process_batch(inputs, dirs, correct_input, args.jobs or os.cpu_count(), args)
+    report.print_statistics(args.stats)
+    if report.failed:
+        sys.exit(1)
+
+
+def run(parser, args, profiler):
+    inputFile = args.input
+    syncwithgps = args.gps or args.drift
+    suffix = "." + args.compress if args.compress else ""
+
+    if args.jobs:
+        import sharding
+        from sharding import ShardReplay, process_sharded
+        corrector = ShardReplay(syncwithgps, args.output)
+        if profiler is not None:
+            # the shards are scanned and written by the workers, their time is in children_cpu_s
+            profiler.patch(corrector, "replay", "replay", lambda call, result: call[0][1], "lines")
+            profiler.patch(corrector, "targets", "targets", unit="runs")
+            profiler.patch(sharding, "sync_with_gps", "gps copy", unit="segments")
+            profiler.patch(corrector, "write_indexes", "index", unit="runs")
+        process_sharded(corrector, inputFile, args.jobs, write=not args.stats_only)
+        corrector.print_statistics(args.stats)
+        return
+
+    if args.stats_only:
+        writer = None
+        corrector = StatsCorrector(args.output, suffix, args.binary)
+        args.numpy = True
+        report = sys.stdout
+    elif args.output == '-':
+        writer = StreamWriter(sys.stdout.buffer, args.flush_lines, args.flush_interval)
+        stream = writer
+        if profiler is not None and not args.numpy:
+            stream = profiler.writer("write", writer)
+        corrector = StreamCorrector(stream, args.numpy)
+        report = sys.stderr  # stdout carries the frames
+    else:
+        writer = None
+        corrector = LogCorrector(syncwithgps, args.numpy, args.output, suffix, args.binary, args.drift)
+        report = sys.stdout
+    if profiler is not None:
+        instrument(profiler, corrector, args.numpy)
+
+    checkpoint = load_checkpoint(args.checkpoint) if args.checkpoint else None
+    offset, cnt = 0, 0
+    if checkpoint is not None:
+        if checkpoint["input"] != inputFile:
+            parser.error('checkpoint {} is for input {}'.format(args.checkpoint, checkpoint["input"]))
+        offset, cnt = checkpoint["offset"], checkpoint["lines"]
+        if os.path.getsize(inputFile) < offset:
+            parser.error('{} is shorter than at the checkpoint, rotated?'.format(inputFile))
+        corrector.restore(checkpoint["corrector"])
+    resumable = args.checkpoint and not args.final
+
+    with redirect_stdout(report):
+        inf = sys.stdin.buffer if inputFile == '-' else open_log(inputFile)
+        try:
+            if offset:
+                inf.seek(offset)
+            processed = correct(corrector, inf, args.numpy, cnt, partial=not resumable, profiler=profiler)
+            if resumable:
+                cnt, size = processed
+                corrector.suspend()
+                save_checkpoint(args.checkpoint, {"input": inputFile, "offset": offset + size, "lines": cnt,
+                                                  "corrector": corrector.state()})
+            else:
+                corrector.finish()
+                if checkpoint is not None:
+                    os.remove(args.checkpoint)
+        except KeyboardInterrupt:
+            if writer is None:
+                raise
+            corrector.finish()
+        finally:
+            if inf is not sys.stdin.buffer:
+                inf.close()
+            if writer is not None:
+                writer.close()
+
+        corrector.print_statistics(args.stats)
+
+
+if __name__ == "__main__":
+    main()
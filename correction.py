@@ -0,0 +1,755 @@
+# coding: utf-8
+
+"""
+Time stamp correction of CANaerospace candump logs, used by correct-ts.py. All times are UTC.
+
+The log is split into segments wherever two logger time sync frames (canId 0x1FFFFFF0)
+are more than 1 s apart. Each segment is written to data/candump-<date>.log or .canrec (or all of them
+to one stream, see :class:`StreamCorrector`), with the
+offset statistics of the GPS time (canIds 1200 and 1206) printed when it is closed. The GPS corrected
+copy of a segment is shifted by the mean offset once the segment is closed, or written along with the
+segment by the drift model (see :class:`DriftCopy`). Next to each segment file an index entry is written
+and added to the catalog of the output directory (see catalog.py).
+
+The carried state can be saved to a checkpoint and restored, to continue a log the logger is still
+appending to (correct-ts.py -checkpoint).
+
+NumPy is needed in both modes: the canId/nodeId statistics (idstats.py) are kept in arrays. -numpy
+only selects the block parser of candump_np.py.
+"""
+
+import datetime
+import json
+import os
+import threading
+from array import array
+
+import numpy as np
+
+from candump import parse_line, format_ts, format_line, SYNC_ID, GPS_UTC_ID, GPS_DATE_ID
+from catalog import SegmentSummary, write_index, update_catalog
+from compressed import open_log
+from drift import DriftModel
+from epoch import sync_epoch, gps_epoch
+from idstats import FrameStatistics, write_statistics
+from onlinestats import RunningStats
+
+SPECIAL_IDS = (SYNC_ID, GPS_UTC_ID, GPS_DATE_ID)
+
+GPS_BUFFER_SIZE = 256 * 1024 * 1024
+PENDING_SUFFIX = ".pending"
+DRIFT_BATCH_SIZE = 4 * 1024 * 1024
+STATS_BATCH = 64 * 1024
+
+
+def sync_with_gps(log_file_name: str, diff, vectorized=False):
+    log_file_name_gps = log_file_name.replace(".log", "-gps.log")
+    shift = round(diff * 1000000)
+    if vectorized:
+        from candump_np import shift_file
+        shift_file(log_file_name, log_file_name_gps, shift)
+        return
+    with open_log(log_file_name_gps, "wb") as lf_gps, open_log(log_file_name, "rb") as lf:
+        for line in lf:
+            ts, channel, frame, _, _ = parse_line(line)
+            lf_gps.write(format_line(ts - shift, channel, frame))
+
+
+def block_statistics(canIds, nodeIds, block):
+    """
+    Add the frames of a block to the statistics.
+
+    :param FrameStatistics canIds: per canId
+    :param FrameStatistics nodeIds: per nodeId (first data byte)
+    :param candump_np.Block block: the parsed lines
+    """
+    from candump_np import FLAG_REMOTE
+
+    frames = block.frames[block.valid]
+    canIds.update(frames['id'], frames['ts'])
+    data = (frames['dlc'] > 0) & (frames['flags'] & FLAG_REMOTE == 0)
+    nodeIds.update(frames['data'][data, 0], frames['ts'][data])
+
+
+def save_checkpoint(file_name, checkpoint):
+    """
+    Write a checkpoint (JSON) atomically: after a crash the previous checkpoint is still there.
+    """
+    tmp_name = file_name + ".tmp"
+    with open(tmp_name, "w") as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_name, file_name)
+
+
+def load_checkpoint(file_name):
+    """
+    :return: the checkpoint written by :func:`save_checkpoint`, None if there is none
+    """
+    try:
+        with open(file_name) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+class GpsBuffer:
+    """
+    Copy of the lines of the open segment, kept until the mean GPS offset of the segment is known,
+    so the GPS corrected copy is written without reading the segment file again.
+
+    Segments larger than max_size bytes are not buffered, their GPS corrected copy is made
+    from the segment file with :func:`sync_with_gps`.
+    """
+
+    def __init__(self, max_size=GPS_BUFFER_SIZE):
+        self.max_size = max_size
+        self.clear()
+
+    def clear(self):
+        self.lines = bytearray()
+        self.ends = array('q')
+        self.ts = array('q')
+        self.overflow = False
+
+    def append(self, ts, line):
+        """
+        :param int ts: time stamp of the line in µs
+        :param bytes line: the line as written to the segment
+        """
+        if self.overflow:
+            return
+        self.lines += line
+        self.ends.append(len(self.lines))
+        self.ts.append(ts)
+        if len(self.lines) > self.max_size:
+            self.overflow_()
+
+    def extend(self, ts, lines, ends):
+        """
+        :param numpy.ndarray ts: time stamps of the lines in µs
+        :param lines: the lines as written to the segment
+        :param numpy.ndarray ends: offset behind each line, relative to lines
+        """
+        if self.overflow:
+            return
+        base = len(self.lines)
+        self.lines += lines
+        self.ends.frombytes((ends + base).astype('=i8').tobytes())
+        self.ts.frombytes(ts.astype('=i8').tobytes())
+        if len(self.lines) > self.max_size:
+            self.overflow_()
+
+    def overflow_(self):
+        self.clear()
+        self.overflow = True
+
+    def write(self, log_file_name_gps, diff, vectorized=False):
+        """
+        Write the buffered lines with time stamps shifted by -diff seconds, rounded to µs.
+        """
+        shift = round(diff * 1000000)
+        with open_log(log_file_name_gps, "wb") as lf_gps:
+            if vectorized and len(self.ts) > 0:
+                from candump_np import shift_timestamps
+                ends = np.frombuffer(self.ends, np.int64)
+                starts = np.zeros_like(ends)
+                starts[1:] = ends[:-1]
+                data = shift_timestamps(self.lines, starts, np.frombuffer(self.ts, np.int64), shift)
+                if data is not None:
+                    lf_gps.write(data)
+                    return
+            lines = self.lines
+            start = 0
+            for ts, end in zip(self.ts, self.ends):
+                lf_gps.write(b"(%s)%s" % (format_ts(ts - shift), lines[lines.index(b")", start) + 1:end]))
+                start = end
+
+
+class DriftCopy:
+    """
+    GPS corrected copy of the open segment, written along with it: each line is shifted by the GPS time
+    offset that the :class:`drift.DriftModel` of the segment predicts for its time stamp from the GPS
+    times before. The lines are collected until the next GPS time and shifted together. The lines
+    before the first GPS time of the segment wait in a pending file next to the copy.
+
+    Takes the lines like :class:`GpsBuffer`.
+    """
+
+    def __init__(self, open_file):
+        """
+        :param open_file: function (file name, mode) opening the copy, as for the segment files
+        """
+        self.open_file = open_file
+        self.model = DriftModel()
+        self.batch = GpsBuffer()
+        self.f = None
+        self.pending = None
+
+    def open(self, file_name):
+        self.f = self.open_file(file_name, "wb")
+
+    def observe(self, ts, offset):
+        """
+        Add a GPS time to the model.
+
+        :param float ts: time stamp of the GPS time frame in s
+        :param float offset: ts - GPS time
+        """
+        self.flush()
+        self.model.add(ts, offset)
+        if self.pending is not None:
+            self.flush_pending()
+
+    def append(self, ts, line):
+        """
+        :param int ts: time stamp of the line in µs
+        :param bytes line: the line as written to the segment
+        """
+        self.batch.append(ts, line)
+        if len(self.batch.lines) >= DRIFT_BATCH_SIZE:
+            self.flush()
+
+    def extend(self, ts, lines, ends):
+        """
+        :param numpy.ndarray ts: time stamps of the lines in µs
+        :param lines: the lines as written to the segment
+        :param numpy.ndarray ends: offset behind each line, relative to lines
+        """
+        self.batch.extend(ts, lines, ends)
+        if len(self.batch.lines) >= DRIFT_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        batch = self.batch
+        if not len(batch.ts):
+            return
+        if not len(self.model):
+            if self.pending is None:
+                self.pending = open(self.f.name + PENDING_SUFFIX, "w+b")
+            self.pending.write(batch.lines)
+        else:
+            ends = np.frombuffer(batch.ends, np.int64)
+            starts = np.zeros_like(ends)
+            starts[1:] = ends[:-1]
+            self.write_shifted(batch.lines, starts, ends, np.frombuffer(batch.ts, np.int64))
+        batch.clear()
+
+    def write_shifted(self, lines, starts, ends, ts):
+        from candump_np import shift_timestamps
+        shift = np.rint(self.model.offset(ts / 1000000) * 1000000).astype(np.int64)
+        data = shift_timestamps(lines, starts, ts, shift)
+        if data is not None:
+            self.f.write(data)
+            return
+        for start, end, t in zip(starts.tolist(), ends.tolist(), (ts - shift).tolist()):
+            self.f.write(b"(%s)%s" % (format_ts(t), lines[lines.index(b")", start) + 1:end]))
+
+    def flush_pending(self):
+        from candump_np import read_blocks, parse_block
+        pending = self.pending
+        pending.seek(0)
+        channels = []
+        for buf in read_blocks(pending):
+            block = parse_block(buf, channels)
+            self.write_shifted(block.buf, block.start, block.end, block.frames['ts'])
+        pending.close()
+        os.remove(pending.name)
+        self.pending = None
+
+    def close(self, file_name):
+        """
+        Finish the copy of the segment as file_name, then start over with a new model.
+        """
+        self.flush()
+        if self.pending is not None:
+            self.discard()
+            return
+        if self.f is not None:
+            self.f.close()
+            os.rename(self.f.name, file_name)
+            self.f = None
+        self.model = DriftModel()
+
+    def discard(self):
+        """
+        Remove the copy of a segment without GPS time.
+        """
+        self.batch.clear()
+        for f in self.f, self.pending:
+            if f is not None:
+                f.close()
+                os.remove(f.name)
+        self.f = self.pending = None
+        self.model = DriftModel()
+
+    def suspend(self):
+        self.flush()
+        for f in self.f, self.pending:
+            if f is not None:
+                f.close()
+
+    def state(self):
+        files = {}
+        for key, f in ("copy", self.f), ("pending", self.pending):
+            files[key] = {"name": f.name, "size": os.path.getsize(f.name)} if f is not None else None
+        return dict(model=self.model.state(), **files)
+
+    def restore(self, state):
+        """
+        Continue the copy and pending file, cut back to their size at the :meth:`state`.
+        """
+        if state is None:
+            raise IOError("the checkpoint is of a run without drift model")
+        self.model.restore(state["model"])
+        for key in "copy", "pending":
+            file = state[key]
+            if file is None:
+                continue
+            name, size = file["name"], file["size"]
+            if not os.path.exists(name) or os.path.getsize(name) < size:
+                raise IOError("GPS copy {} is missing or shorter than at the checkpoint".format(name))
+            os.truncate(name, size)
+            if key == "copy":
+                self.f = self.open_file(name, "ab")
+            else:
+                self.pending = open(name, "a+b")
+
+
+class LogCorrector:
+    """
+    Carries the correction state from one frame to the next.
+
+    Feed the input with :meth:`process` (lines) or :meth:`process_block` (see candump_np),
+    then call :meth:`finish`.
+    """
+
+    def __init__(self, syncwithgps=False, vectorized=False, output_dir="data", compression="", binary=False,
+                 drift=False):
+        """
+        :param bool syncwithgps: also write a GPS time corrected copy of each segment
+        :param bool vectorized: use NumPy for the GPS corrected copy
+        :param str output_dir: directory for the segment files
+        :param str compression: compress the segment files, '.gz', '.xz' or '.bz2'
+        :param bool binary: write the segments as record files (see canrec.py), not compressed
+        :param bool drift: with syncwithgps, write the GPS corrected copy along with the segment, corrected
+                           by the drift model (see :class:`DriftCopy`), not by the mean offset afterwards
+        """
+        self.syncwithgps = syncwithgps
+        self.drift = syncwithgps and drift
+        self.vectorized = vectorized
+        self.output_dir = output_dir
+        self.compression = compression
+        self.binary = binary
+        self.suffix = ".log"
+        if binary:
+            from canrec import RECORD_SUFFIX
+            self.suffix = RECORD_SUFFIX
+        self.gps_buffer = GpsBuffer() if syncwithgps and not binary else None
+        if self.drift:
+            self.gps_buffer = DriftCopy(self.open_segment_file)
+        self.canIds = FrameStatistics()
+        self.nodeIds = FrameStatistics()
+        self.stats_batch = (array('q'), array('q'), array('q'), array('q'))  # frames of the text engine
+        self.dataDateStr = None
+        self.diff = None  # offset of the logger clock at the last time sync frame, not applied to the frames
+        self.ts_log_last = None
+        self.ts_log_first = None
+        self.ts_log_diff = None
+        self.ts_gps_first = None
+        self.log_file_nr = 0
+        self.new_log = None
+        self.new_log_file_name = None
+        self.mmm = RunningStats()  # GPS time offsets of the open segment
+        self.summary = SegmentSummary()  # time range and ids of the open segment
+        self.new_cnt = 0
+        self.segment_cnt = 0  # new_cnt at the start of the open segment
+
+    def open_logfile(self):
+        self.log_file_nr = self.log_file_nr + 1
+        self.new_log = self.open_segment_file(os.path.join(self.output_dir, "newlog_{}{}{}".format(
+            self.log_file_nr, self.suffix, self.compression)), "wb")
+        if self.drift:
+            self.gps_buffer.open(os.path.join(self.output_dir, "newlog_{}-gps{}{}".format(
+                self.log_file_nr, self.suffix, self.compression)))
+
+    def open_segment_file(self, file_name, mode):
+        if self.binary:
+            from canrec import RecordWriter
+            return RecordWriter(file_name, mode)
+        return open_log(file_name, mode)
+
+    def segment_file_name(self, ts_log):
+        return os.path.join(self.output_dir, "candump-{}{}".format(
+            datetime.datetime.fromtimestamp(int(ts_log), datetime.timezone.utc).strftime("%Y-%m-%d_%H%M%S"),
+            self.suffix) + self.compression)
+
+    def close_logfile(self, ts_log):
+        try:
+            self.new_log.close()
+            self.new_log_file_name = self.segment_file_name(ts_log)
+            os.rename(self.new_log.name, self.new_log_file_name)
+        except IOError:
+            pass
+
+    def print_gps_diff_statistics(self):
+        mmm = self.mmm
+        if len(mmm) < 2:  # no GPS time in this segment
+            print(self.new_log_file_name, " cnt=", self.new_cnt)
+            return
+        print(self.new_log_file_name, " cnt=", self.new_cnt, "mean=", mmm.mean, "variance=", mmm.variance(),
+              "stdev=", mmm.stdev(), "max=", mmm.max, "min=", mmm.min,
+              "p50=", mmm.quantile(0.5), "p95=", mmm.quantile(0.95), "p99=", mmm.quantile(0.99),
+              *(("drift=", self.gps_buffer.model.b) if self.drift else ()))
+
+    def close_segment(self, ts_log):
+        self.flush_statistics()  # the frames of the text engine so far belong to this segment
+        self.close_logfile(ts_log)
+        self.print_gps_diff_statistics()
+        if self.syncwithgps and len(self.mmm):
+            self.write_gps_copy(self.mmm.mean)
+        elif self.drift:
+            self.gps_buffer.discard()
+        self.write_index()
+        self.mmm = RunningStats()
+        self.summary = SegmentSummary()
+        self.segment_cnt = self.new_cnt
+        self.new_log = None
+        self.ts_log_first = None
+
+    def write_gps_copy(self, diff):
+        if self.drift:
+            self.gps_buffer.close(self.new_log_file_name.replace(".log", "-gps.log"))
+            return
+        if self.binary:
+            from canrec import shift_records, gps_file_name
+            shift_records(self.new_log_file_name, gps_file_name(self.new_log_file_name), diff)
+            return
+        if self.gps_buffer.overflow:
+            sync_with_gps(self.new_log_file_name, diff, self.vectorized)
+        else:
+            self.gps_buffer.write(self.new_log_file_name.replace(".log", "-gps.log"), diff, self.vectorized)
+        self.gps_buffer.clear()
+
+    def write_index(self):
+        if self.new_log_file_name is None or not os.path.exists(self.new_log_file_name):
+            return
+        entry = self.summary.entry(self.new_log_file_name, self.new_cnt - self.segment_cnt, self.mmm)
+        write_index(entry, self.new_log_file_name)
+        update_catalog(self.output_dir, [entry])
+
+    def special_frame(self, ts, canId, payloadStr):
+        """
+        Handle a time sync or GPS frame.
+
+        :param int ts: time stamp of the frame in µs
+        :return: True if the frame goes to the segment, False for time sync frames
+        """
+        ts = ts / 1000000  # the offsets are in s, as the epoch times of the payloads
+        if canId == SYNC_ID:  # Time sync
+            ts_log = sync_epoch(payloadStr)
+            self.diff = ts_log - ts
+            if self.ts_log_last is None:
+                self.ts_log_last = ts_log
+            self.ts_log_diff = ts_log - self.ts_log_last
+            self.ts_log_last = ts_log
+            if self.ts_log_first is None:
+                self.ts_log_first = ts_log
+            if self.ts_log_diff > 1.0:
+                self.close_segment(self.ts_log_first)
+            return False
+
+        dataStr = payloadStr[8:]
+        if canId == GPS_UTC_ID:  # UTC
+            dataDateStr = self.dataDateStr
+            if dataDateStr is not None:
+                ts_gps = gps_epoch(dataDateStr, dataStr)
+                if self.ts_gps_first is None:
+                    self.ts_gps_first = ts_gps
+                self.mmm.add(ts - ts_gps)
+                if self.drift:
+                    self.gps_buffer.observe(ts, ts - ts_gps)
+
+        elif canId == GPS_DATE_ID:  # Date
+            self.dataDateStr = dataStr
+        return True
+
+    def process(self, lines, cnt=0):
+        """
+        :param lines: iterable of candump log lines as bytes
+        :param int cnt: line number of the first line
+        """
+        ids, ts_ids, nodes, ts_nodes = self.stats_batch
+        gps_buffer = self.gps_buffer
+        for cnt, line in enumerate(lines, cnt):
+            if self.new_log is None:
+                self.open_logfile()
+            canData = parse_line(line)
+            if canData is None:
+                print("ERROR, line={:d} >>>{:s}<<< \n".format(cnt, line.decode(errors="replace")))
+                continue
+            ts, canDevStr, frameStr, canId, payloadStr = canData
+            if canId not in SPECIAL_IDS or self.special_frame(ts, canId, payloadStr):
+                line = format_line(ts, canDevStr, frameStr)
+                self.new_log.write(line)
+                if gps_buffer is not None:
+                    gps_buffer.append(ts, line)
+                self.new_cnt = self.new_cnt + 1
+
+            ids.append(canId)
+            ts_ids.append(ts)
+            if payloadStr and not len(payloadStr[:16]) & 1:
+                try:
+                    node = int(payloadStr[0:2], 16)
+                except ValueError:  # not hex, no data bytes as in candump_np.parse_block
+                    pass
+                else:
+                    nodes.append(node)
+                    ts_nodes.append(ts)
+            if len(ids) >= STATS_BATCH:
+                self.flush_statistics()
+        self.flush_statistics()
+
+    def flush_statistics(self):
+        """
+        Add the frames collected by :meth:`process` to the statistics.
+        """
+        ids, ts_ids, nodes, ts_nodes = self.stats_batch
+        if len(ids):
+            frames = (np.array(ids, np.int64), np.array(ts_ids, np.int64))
+            self.canIds.update(*frames)
+            self.summary.add(*frames)
+        self.nodeIds.update(np.frombuffer(nodes, np.int64), np.frombuffer(ts_nodes, np.int64))
+        for a in self.stats_batch:
+            del a[:]
+
+    def process_block(self, block, cnt=0):
+        """
+        Vectorized variant of :meth:`process`: only malformed lines, time sync and GPS frames are
+        handled one by one, the runs of ordinary frames in between are written and counted in bulk.
+
+        :param candump_np.Block block: the parsed lines
+        :param int cnt: line number of the first line of the block
+        """
+        frames = block.frames
+        valid = block.valid
+        ids = frames['id']
+        special = np.flatnonzero(~valid | (ids == SYNC_ID) | (ids == GPS_UTC_ID) | (ids == GPS_DATE_ID)).tolist()
+        pos = 0
+        summarized = 0  # rows before are in the summary of their segment
+        for row in special + [len(frames)]:
+            if pos < row:
+                if self.new_log is None:
+                    self.open_logfile()
+                self.write_rows(block, pos, row)
+            if row == len(frames):
+                break
+            if self.new_log is None:
+                self.open_logfile()
+            line = block.line(row)
+            if not valid[row]:
+                print("ERROR, line={:d} >>>{:s}<<< \n".format(cnt + row, line.decode(errors="replace")))
+            else:
+                ts, _, _, canId, payloadStr = parse_line(line)
+                if canId == SYNC_ID:  # may close the segment
+                    self.summarize(block, summarized, row)
+                    summarized = row
+                if self.special_frame(ts, canId, payloadStr):
+                    self.write_rows(block, row, row + 1)
+            pos = row + 1
+
+        self.summarize(block, summarized, len(frames))
+        block_statistics(self.canIds, self.nodeIds, block)
+
+    def summarize(self, block, first, last):
+        frames = block.frames[first:last][block.valid[first:last]]
+        self.summary.add(frames['id'], frames['ts'])
+
+    def write_rows(self, block, first, last):
+        gps_buffer = self.gps_buffer
+        clean = block.clean[first:last]
+        if self.binary:
+            self.new_log.write_frames(block.frames[first:last], block.channels)
+        elif clean.all():
+            # unchanged time stamps, the lines are copied as they are
+            start = block.start[first]
+            lines = block.buf[start:block.end[last - 1]]
+            self.new_log.write(lines)
+            if gps_buffer is not None:
+                gps_buffer.extend(block.frames['ts'][first:last], lines, block.end[first:last] - start)
+        else:
+            for row in range(first, last):
+                ts, canDevStr, frameStr, _, _ = parse_line(block.line(row))
+                line = format_line(ts, canDevStr, frameStr)
+                self.new_log.write(line)
+                if gps_buffer is not None:
+                    gps_buffer.append(ts, line)
+        self.new_cnt = self.new_cnt + last - first
+
+    def finish(self):
+        if self.ts_log_first is None:
+            self.ts_log_first = self.ts_gps_first
+        self.close_segment(self.ts_log_first)
+
+    def suspend(self):
+        """
+        Close the open segment file without finishing the segment, before taking the :meth:`state`.
+        """
+        if self.new_log is not None:
+            self.new_log.close()
+        if self.drift:
+            self.gps_buffer.suspend()
+
+    def state(self):
+        """
+        :return: the carried state as JSON serializable dict, see :meth:`restore`
+        """
+        segment = None
+        if self.new_log is not None:
+            segment = {"name": self.new_log.name, "size": os.path.getsize(self.new_log.name)}
+        return {
+            "canIds": self.canIds.state(),
+            "nodeIds": self.nodeIds.state(),
+            "dataDateStr": self.dataDateStr.decode() if self.dataDateStr is not None else None,
+            "diff": self.diff,
+            "ts_log_last": self.ts_log_last,
+            "ts_log_first": self.ts_log_first,
+            "ts_log_diff": self.ts_log_diff,
+            "ts_gps_first": self.ts_gps_first,
+            "log_file_nr": self.log_file_nr,
+            "segment": segment,
+            "mmm": self.mmm.state(),
+            "summary": self.summary.state(),
+            "new_cnt": self.new_cnt,
+            "segment_cnt": self.segment_cnt,
+            "drift": self.gps_buffer.state() if self.drift else None,
+        }
+
+    def restore(self, state):
+        """
+        Continue where :meth:`state` was taken. The open segment file is cut back to its size at that
+        point (a crashed run may have written more) and appended to.
+        """
+        self.canIds.restore(state["canIds"])
+        self.nodeIds.restore(state["nodeIds"])
+        dataDateStr = state["dataDateStr"]
+        self.dataDateStr = dataDateStr.encode() if dataDateStr is not None else None
+        self.diff = state["diff"]
+        self.ts_log_last = state["ts_log_last"]
+        self.ts_log_first = state["ts_log_first"]
+        self.ts_log_diff = state["ts_log_diff"]
+        self.ts_gps_first = state["ts_gps_first"]
+        self.log_file_nr = state["log_file_nr"]
+        self.mmm.restore(state["mmm"])
+        self.summary.restore(state["summary"])
+        self.new_cnt = state["new_cnt"]
+        self.segment_cnt = state["segment_cnt"]
+        segment = state["segment"]
+        if segment is not None:
+            name, size = segment["name"], segment["size"]
+            if not os.path.exists(name) or os.path.getsize(name) < size:
+                raise IOError("segment file {} is missing or shorter than at the checkpoint".format(name))
+            os.truncate(name, size)
+            self.new_log = self.open_segment_file(name, "ab")
+            if self.drift:
+                self.gps_buffer.restore(state["drift"])
+            elif self.gps_buffer is not None:
+                self.gps_buffer.overflow_()  # the lines before the checkpoint are only in the segment file
+
+    def print_statistics(self, file_name=None):
+        """
+        Print the canId and nodeId statistics as CSV, or write them to file_name (.csv or .json).
+        """
+        self.flush_statistics()  # after an interrupted process()
+        write_statistics([("canId", self.canIds), ("nodeId", self.nodeIds)], file_name)
+
+
+class StreamWriter:
+    """
+    Writes to a stream, e.g. stdout of a pipeline, and flushes it after every flush_lines lines
+    and at least every flush_interval seconds.
+    """
+
+    def __init__(self, stream, flush_lines=1000, flush_interval=1.0):
+        self.stream = stream
+        self.flush_lines = flush_lines
+        self.lines = 0
+        self.lock = threading.Lock()
+        self.closed = threading.Event()
+        self.flusher = threading.Thread(target=self.flush_periodically, args=(flush_interval,), daemon=True)
+        self.flusher.start()
+
+    def write(self, data):
+        with self.lock:
+            self.stream.write(data)
+            self.lines += bytes(data).count(b"\n")
+            if self.lines >= self.flush_lines:
+                self.stream.flush()
+                self.lines = 0
+
+    def flush(self):
+        with self.lock:
+            if self.lines:
+                self.stream.flush()
+                self.lines = 0
+
+    def flush_periodically(self, interval):
+        while not self.closed.wait(interval):
+            self.flush()
+
+    def close(self):
+        self.closed.set()
+        self.flusher.join()
+        self.flush()
+
+
+class StreamCorrector(LogCorrector):
+    """
+    Writes all segments to one stream, e.g. ``candump -L can0 | python correct-ts.py -input - -output -``.
+    Segment breaks only show up in the statistics. No GPS corrected copy, it would need the whole segment.
+    """
+
+    def __init__(self, stream, vectorized=False):
+        """
+        :param stream: a :class:`StreamWriter`
+        """
+        super().__init__(False, vectorized, "")
+        self.stream = stream
+
+    def open_logfile(self):
+        self.log_file_nr = self.log_file_nr + 1
+        self.new_log = self.stream
+
+    def close_logfile(self, ts_log):
+        self.new_log_file_name = self.segment_file_name(ts_log) if ts_log is not None else "-"
+
+    def write_index(self):
+        pass
+
+
+class StatsCorrector(LogCorrector):
+    """
+    Analysis only (correct-ts.py -stats-only): the segments, their GPS offset statistics and the canId/nodeId
+    statistics as of a normal run, without writing or formatting any line. The segments are printed with
+    the names a normal run would give their files. Takes blocks only (:meth:`process_block`).
+    """
+
+    def __init__(self, output_dir="data", compression="", binary=False):
+        super().__init__(False, True, output_dir, compression, binary)
+
+    def open_logfile(self):
+        self.log_file_nr = self.log_file_nr + 1
+        self.new_log = True  # no file, marks the open segment
+
+    def close_logfile(self, ts_log):
+        self.new_log_file_name = self.segment_file_name(ts_log)
+
+    def write_rows(self, block, first, last):
+        self.new_cnt = self.new_cnt + last - first
+
+    def summarize(self, block, first, last):
+        pass  # for the index only
+
+    def write_index(self):
+        pass
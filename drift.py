@@ -0,0 +1,82 @@
+# coding: utf-8
+
+"""
+Streaming model of the offset between the capture clock (the candump time stamps) and GPS time.
+
+:class:`DriftModel` fits offset = a + b * (ts - t0), the offset at the first GPS time t0 of the
+segment and the drift of the capture clock, by recursive least squares with exponential forgetting.
+Each GPS time frame costs a few float operations and the model predicts the offset of any frame
+from the GPS times seen so far, so the GPS corrected copy of a segment is written along with it
+(correct-ts.py -drift) instead of shifting the whole segment by the mean offset afterwards.
+
+GPS time has whole seconds and its frame comes at a varying point of the second (0.2 to 0.3 s after
+it in loggen.py), so the offsets scatter by about NOISE_STD around the line. The model takes the
+offsets against the sub-second time stamps of the GPS time frames; the constant part of the delay
+goes into the offset a. The prior on the drift keeps the first fits of a segment from extrapolating
+the scatter.
+"""
+
+FORGETTING = 1 - 1 / 3600  # per GPS time frame, about an hour at one frame per second
+DRIFT_STD = 100e-6  # prior standard deviation of the drift, s/s
+NOISE_STD = 0.03  # standard deviation of an offset, s, scatter of the GPS time frames in their second
+OFFSET_VARIANCE = 1e6  # prior variance of the offset, relative to NOISE_STD**2: unknown
+
+
+class DriftModel:
+    """
+    Recursive least squares fit of the GPS time offset against the capture time.
+    """
+
+    def __init__(self, forgetting=FORGETTING, drift_std=DRIFT_STD, noise_std=NOISE_STD):
+        self.forgetting = forgetting
+        self.t0 = None
+        self.a = 0.0  # offset at t0, s
+        self.b = 0.0  # drift, s/s
+        # covariance of (a, b) relative to the noise variance, symmetric
+        self.p00 = OFFSET_VARIANCE
+        self.p01 = 0.0
+        self.p11 = (drift_std / noise_std) ** 2
+        self.n = 0
+
+    def __len__(self):
+        return self.n
+
+    def add(self, ts, offset):
+        """
+        :param float ts: capture time stamp of a GPS time frame
+        :param float offset: ts - GPS time
+        """
+        if self.t0 is None:
+            self.t0 = ts
+        dt = ts - self.t0
+        px0 = self.p00 + self.p01 * dt
+        px1 = self.p01 + self.p11 * dt
+        denominator = self.forgetting + px0 + px1 * dt
+        k0 = px0 / denominator
+        k1 = px1 / denominator
+        error = offset - (self.a + self.b * dt)
+        self.a += k0 * error
+        self.b += k1 * error
+        self.p00 = (self.p00 - k0 * px0) / self.forgetting
+        self.p01 = (self.p01 - k0 * px1) / self.forgetting
+        self.p11 = (self.p11 - k1 * px1) / self.forgetting
+        self.n += 1
+
+    def offset(self, ts):
+        """
+        :param ts: capture time stamp(s), float or numpy.ndarray
+        :return: the predicted ts - GPS time, 0 before the first GPS time
+        """
+        if self.t0 is None:
+            return 0.0 * ts
+        return self.a + self.b * (ts - self.t0)
+
+    def state(self):
+        return {"t0": self.t0, "a": self.a, "b": self.b, "p": [self.p00, self.p01, self.p11], "n": self.n}
+
+    def restore(self, state):
+        self.t0 = state["t0"]
+        self.a = state["a"]
+        self.b = state["b"]
+        self.p00, self.p01, self.p11 = state["p"]
+        self.n = state["n"]
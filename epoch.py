@@ -0,0 +1,73 @@
+# coding: utf-8
+
+"""
+Epoch seconds (UTC) of the logger time sync (canId 0x1FFFFFF0) and GPS time (canIds 1200 and 1206) frames.
+
+The time of day is added to the epoch of the day in integer arithmetic. The epoch of each day is
+computed once and cached, so a conversion costs a few slices and int() calls instead of building a
+datetime and resolving the local time zone. Invalid dates and times raise ValueError, as datetime does.
+"""
+
+import datetime
+
+MAX_CACHED_DAYS = 1024
+
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+_sync_days = {}
+_gps_days = {}
+
+
+def day_epoch(year, month, day):
+    """
+    :return: epoch seconds of 00:00:00 UTC of the day
+    """
+    return (datetime.date(year, month, day).toordinal() - _EPOCH_ORDINAL) * 86400
+
+
+def _seconds(hhmmss):
+    """
+    :param bytes hhmmss: hex encoded hour, minute and second
+    """
+    if len(hhmmss) != 6:
+        raise ValueError("malformed time {!r}".format(hhmmss))
+    t = int(hhmmss, 16)
+    hour, minute, second = t >> 16, t >> 8 & 0xFF, t & 0xFF
+    if t < 0 or hour > 23 or minute > 59 or second > 59:
+        raise ValueError("time out of range {:d}:{:d}:{:d}".format(hour, minute, second))
+    return hour * 3600 + minute * 60 + second
+
+
+def _cached_day(days, key, decode):
+    base = days.get(key)
+    if base is None:
+        if len(days) >= MAX_CACHED_DAYS:
+            days.clear()
+        base = days[key] = day_epoch(*decode(key))
+    return base
+
+
+def _sync_date(key):
+    return int(key[0:2], 16) + 2000, int(key[3:4], 16), int(key[4:6], 16)
+
+
+def _gps_date(key):
+    return int(key[4:6], 16) * 100 + int(key[6:8], 16), int(key[2:4], 16), int(key[0:2], 16)
+
+
+def sync_epoch(payloadStr):
+    """
+    :param bytes payloadStr: hex payload of a time sync frame, YY?M DD hh mm ss (the month is one nibble)
+    :return: epoch seconds of the logger time
+    """
+    return _cached_day(_sync_days, payloadStr[0:6], _sync_date) \
+        + _seconds(payloadStr[6:12])
+
+
+def gps_epoch(dataDateStr, dataStr):
+    """
+    :param bytes dataDateStr: hex data of the last GPS date frame (1206), DD MM YY YY
+    :param bytes dataStr: hex data of a GPS time frame (1200), hh mm ss
+    :return: epoch seconds of the GPS time
+    """
+    return _cached_day(_gps_days, dataDateStr[0:8], _gps_date) \
+        + _seconds(dataStr[0:6])
@@ -0,0 +1,265 @@
+# coding: utf-8
+
+"""
+Per canId / nodeId frame statistics, kept in NumPy arrays and updated in bulk.
+
+For every id: the number of frames, the time stamps of the first and last frame, the mean and the
+jitter (standard deviation) of the time between frames, and the number of dropouts. A dropout is an
+inter-arrival time more than DROPOUT_FACTOR times the previous one, e.g. a periodic frame that misses
+one or more periods.
+
+:meth:`FrameStatistics.update` takes a batch of frames, :meth:`FrameStatistics.merge` adds the
+statistics of the frames that follow, e.g. of the next shard (see sharding.py). The result does not
+depend on how the frames are batched. :meth:`FrameStatistics.combine` adds the statistics of another log
+which may cover the same time, e.g. of another logger in a batch (see batch.py): the intervals of
+each log are kept, no interval between the logs is added.
+"""
+
+import csv
+import json
+import sys
+
+import numpy as np
+
+DROPOUT_FACTOR = 1.5
+
+FIELDS = ("id", "count", "first_ts", "last_ts", "mean_interval", "jitter", "dropouts")
+
+_ARRAYS = ("ids", "count", "first", "last", "first_interval", "last_interval", "mean", "m2", "dropouts")
+
+
+def _combine(n_a, mean_a, m2_a, n_b, mean_b, m2_b):
+    """
+    Mean and sum of squared deviations of two sets of values (Chan et al.), element wise.
+    """
+    n = n_a + n_b
+    safe_n = np.maximum(n, 1)
+    delta = mean_b - mean_a
+    mean = mean_a + delta * n_b / safe_n
+    m2 = m2_a + m2_b + delta * delta * n_a * n_b / safe_n
+    return mean, m2
+
+
+class FrameStatistics:
+    """
+    Statistics per id, the ids in order of their first frame.
+    """
+
+    def __init__(self):
+        self.slots = {}  # id -> index into the arrays
+        self.ids = np.zeros(0, np.int64)
+        self.count = np.zeros(0, np.int64)
+        self.first = np.zeros(0, np.int64)  # µs
+        self.last = np.zeros(0, np.int64)
+        self.first_interval = np.zeros(0, np.int64)  # -1 if less than two frames
+        self.last_interval = np.zeros(0, np.int64)
+        self.mean = np.zeros(0, np.float64)  # of the intervals, µs
+        self.m2 = np.zeros(0, np.float64)
+        self.dropouts = np.zeros(0, np.int64)
+        self.known = self.ids  # sorted
+        self.intervals = None  # number of intervals per id after combine, else count - 1
+
+    def __len__(self):
+        return len(self.slots)
+
+    @classmethod
+    def from_frames(cls, ids, ts, known=None):
+        """
+        :param numpy.ndarray ids: id of each frame
+        :param numpy.ndarray ts: time stamp of each frame in µs, frames in input order
+        :param numpy.ndarray known: sorted ids seen before, makes the grouping faster if they cover all ids
+        """
+        stats = cls()
+        if len(ids) == 0:
+            return stats
+        ids = np.asarray(ids, np.int64)
+        ts = np.asarray(ts, np.int64)
+        order = None
+        if known is not None and 0 < len(known) <= 0x10000:
+            codes = np.minimum(np.searchsorted(known, ids), len(known) - 1)
+            if (known[codes] == ids).all():
+                order = np.argsort(codes.astype(np.uint16), kind='stable')  # radix sort
+        if order is None:
+            order = np.argsort(ids, kind='stable')  # grouped by id, input order within a group
+        sid = ids[order]
+        sts = ts[order]
+        start = np.flatnonzero(np.r_[True, sid[1:] != sid[:-1]])
+        end = np.r_[start[1:], len(sid)]
+        n = end - start
+
+        # intervals, d[k] from frame k to k + 1, 0 where k + 1 belongs to the next id
+        d = np.append(np.diff(sts), 0)
+        same = np.append(sid[1:] == sid[:-1], False)
+        d[~same] = 0
+        mean = np.add.reduceat(d, start) / np.maximum(n - 1, 1)
+        dev = np.where(same, d - np.repeat(mean, n), 0.0)
+        m2 = np.add.reduceat(dev * dev, start)
+        drop = np.zeros(len(sid), np.int64)
+        drop[2:] = same[1:-1] & same[:-2] & (d[1:-1] > DROPOUT_FACTOR * d[:-2])
+        dropouts = np.add.reduceat(drop, start)
+
+        first_interval = np.full(len(start), -1, np.int64)
+        last_interval = np.full(len(start), -1, np.int64)
+        two = n > 1
+        first_interval[two] = d[start[two]]
+        last_interval[two] = d[end[two] - 2]
+
+        # slots in order of the first frame of each id
+        appearance = np.argsort(order[start], kind='stable')
+        stats.ids = sid[start][appearance]
+        stats.count = n[appearance]
+        stats.first = sts[start][appearance]
+        stats.last = sts[end - 1][appearance]
+        stats.first_interval = first_interval[appearance]
+        stats.last_interval = last_interval[appearance]
+        stats.mean = mean[appearance].astype(np.float64)
+        stats.m2 = m2[appearance].astype(np.float64)
+        stats.dropouts = dropouts[appearance]
+        stats.slots = {id: slot for slot, id in enumerate(stats.ids.tolist())}
+        stats.known = np.sort(stats.ids)
+        return stats
+
+    def update(self, ids, ts):
+        """
+        Add a batch of frames, later than the frames so far.
+        """
+        if len(ids):
+            self.merge(FrameStatistics.from_frames(ids, ts, self.known))
+
+    def _slots(self, other):
+        """
+        Add the ids of other which are new.
+
+        :return: the indices of the new ids in other, the slots of the known ids and their indices in other
+        """
+        slots = self.slots
+        new = [i for i, id in enumerate(other.ids.tolist()) if id not in slots]
+        for i in new:
+            slots[int(other.ids[i])] = len(slots)
+        old = np.ones(len(other), bool)
+        old[new] = False
+        b = np.flatnonzero(old)
+        a = np.array([slots[id] for id in other.ids[b].tolist()], np.int64)
+        return new, a, b
+
+    def merge(self, other):
+        """
+        Add the statistics of the frames following the frames so far, not after :meth:`combine`.
+        """
+        if len(other) == 0:
+            return
+        new, a, b = self._slots(other)
+
+        if len(a):
+            boundary = other.first[b] - self.last[a]
+            last_iv = self.last_interval[a]
+            first_iv = other.first_interval[b]
+            self.dropouts[a] += other.dropouts[b] + ((last_iv >= 0) & (boundary > DROPOUT_FACTOR * last_iv)) \
+                + ((first_iv >= 0) & (first_iv > DROPOUT_FACTOR * boundary))
+            n_a = self.count[a] - 1
+            mean, m2 = _combine(n_a, self.mean[a], self.m2[a], 1, boundary.astype(np.float64), 0.0)
+            mean, m2 = _combine(n_a + 1, mean, m2, other.count[b] - 1, other.mean[b], other.m2[b])
+            self.mean[a] = mean
+            self.m2[a] = m2
+            self.first_interval[a] = np.where(self.first_interval[a] >= 0, self.first_interval[a], boundary)
+            self.last_interval[a] = np.where(first_iv >= 0, other.last_interval[b], boundary)
+            self.last[a] = other.last[b]
+            self.count[a] += other.count[b]
+
+        if new:
+            for name in _ARRAYS:
+                setattr(self, name, np.concatenate((getattr(self, name), getattr(other, name)[new])))
+            self.known = np.sort(self.ids)
+
+    def combine(self, other):
+        """
+        Add the statistics of another log, which may overlap the frames so far in time. The counts and
+        dropouts are summed, first and last are the earliest and latest frame of both, the interval
+        statistics of both are combined (Chan et al.) without an interval from one log to the other.
+        """
+        if self.intervals is None:
+            self.intervals = np.maximum(self.count - 1, 0)
+        intervals = np.maximum(other.count - 1, 0) if other.intervals is None else other.intervals
+        if len(other) == 0:
+            return
+        new, a, b = self._slots(other)
+
+        if len(a):
+            self.mean[a], self.m2[a] = _combine(self.intervals[a], self.mean[a], self.m2[a],
+                                                intervals[b], other.mean[b], other.m2[b])
+            self.intervals[a] += intervals[b]
+            self.first[a] = np.minimum(self.first[a], other.first[b])
+            self.last[a] = np.maximum(self.last[a], other.last[b])
+            self.count[a] += other.count[b]
+            self.dropouts[a] += other.dropouts[b]
+
+        if new:
+            for name in _ARRAYS:
+                setattr(self, name, np.concatenate((getattr(self, name), getattr(other, name)[new])))
+            self.intervals = np.concatenate((self.intervals, intervals[new]))
+            self.known = np.sort(self.ids)
+
+    def rows(self):
+        """
+        :return: one tuple of :data:`FIELDS` per id, sorted by id. Times in s, None if undefined,
+                 the jitter rounded to ns.
+        """
+        rows = []
+        for slot in np.argsort(self.ids, kind='stable').tolist():
+            count = int(self.count[slot])
+            mean = jitter = None
+            if self.intervals is None:
+                intervals = count - 1
+                if intervals > 0:
+                    mean = (int(self.last[slot]) - int(self.first[slot])) / intervals / 1000000
+            else:
+                intervals = int(self.intervals[slot])
+                if intervals > 0:
+                    mean = float(self.mean[slot]) / 1000000
+            if intervals > 1:
+                jitter = round(float(np.sqrt(self.m2[slot] / (intervals - 1))) / 1000000, 9)
+            rows.append((int(self.ids[slot]), count, int(self.first[slot]) / 1000000,
+                         int(self.last[slot]) / 1000000, mean, jitter, int(self.dropouts[slot])))
+        return rows
+
+    def state(self):
+        """
+        :return: JSON serializable state, see :meth:`restore`
+        """
+        return {name: getattr(self, name).tolist() for name in _ARRAYS}
+
+    def restore(self, state):
+        for name, value in state.items():
+            setattr(self, name, np.array(value, np.float64 if name in ("mean", "m2") else np.int64))
+        self.slots = {id: slot for slot, id in enumerate(self.ids.tolist())}
+        self.known = np.sort(self.ids)
+
+
+def write_csv(f, statistics):
+    """
+    :param f: text stream
+    :param statistics: (kind, :class:`FrameStatistics`) pairs, e.g. ("canId", ...)
+    """
+    writer = csv.writer(f, lineterminator="\n")
+    writer.writerow(("kind",) + FIELDS)
+    for kind, stats in statistics:
+        for row in stats.rows():
+            writer.writerow((kind,) + tuple("" if value is None else value for value in row))
+
+
+def write_json(f, statistics):
+    json.dump({kind: [dict(zip(FIELDS, row)) for row in stats.rows()] for kind, stats in statistics}, f, indent=1)
+    f.write("\n")
+
+
+def write_statistics(statistics, file_name=None):
+    """
+    Print the statistics as CSV, or write them to file_name (.csv or .json).
+
+    :param statistics: (kind, :class:`FrameStatistics`) pairs
+    """
+    if file_name is None:
+        write_csv(sys.stdout, statistics)
+        return
+    with open(file_name, "w", newline="") as f:
+        (write_json if file_name.endswith(".json") else write_csv)(f, statistics)
@@ -0,0 +1,182 @@
+# coding: utf-8
+
+"""
+Bulk ingestion of log files for offline tools (logfile2sqldb2.py, lostmessagesdemo.py).
+
+:class:`BatchReader` yields the frames of a log file in file order, in batches of plain row tuples
+``(ts, arbitration_id, extended, remote, error, dlc, data)`` with ts in µs, as the messages table of
+logfile2sqldb2.py takes them with executemany, with compact=True as rows
+``(ts, seq, arbitration_id, flags, dlc, data)`` of the compact schema (sqlite2.COMPACT_SCHEMA), seq
+counting the frames. Nothing is scheduled: can.MessageSync sleeps for its gap after every message even
+with timestamps=False, 100 s per million frames.
+
+candump logs (.log, also compressed) are parsed in blocks with candump_np and record files (.canrec) are
+read in chunks, without a can.Message per frame. The other formats of player2.LogReader2 go through
+can.Message. Error frames are stored as can.CanutilsLogReader reads them: id 0, no data. Malformed
+lines of a candump log are skipped and counted, where CanutilsLogReader stops.
+"""
+
+import numpy as np
+
+from candump_np import BLOCK_SIZE, FLAG_EXTENDED, FLAG_REMOTE, read_blocks, parse_block
+from canrec import RECORD_SUFFIX, READ_CHUNK, RecordFile
+from compressed import compression, open_log
+from sqlite2 import TS_US, FLAG_ERROR, pack_data
+
+BATCH_SIZE = 100_000
+LINE_SIZE = 48  # bytes of a typical candump -L line, the blocks of a candump log hold about a batch
+
+CAN_ERR_FLAG = 0x20000000
+CAN_ERR_BUSERROR = 0x00000080
+
+
+def message_row(msg):
+    """
+    :param can.Message msg: the frame
+    :return: the row tuple of the frame
+    """
+    return (round(msg.timestamp * TS_US),
+            msg.arbitration_id,
+            msg.is_extended_id,
+            msg.is_remote_frame,
+            msg.is_error_frame,
+            msg.dlc,
+            memoryview(msg.data))
+
+
+def compact_message_row(msg, seq):
+    """
+    :param can.Message msg: the frame
+    :param int seq: number of the frame
+    :return: the row tuple of the frame in the compact schema
+    """
+    return (round(msg.timestamp * TS_US),
+            seq,
+            msg.arbitration_id,
+            msg.is_extended_id * FLAG_EXTENDED | msg.is_remote_frame * FLAG_REMOTE | msg.is_error_frame * FLAG_ERROR,
+            msg.dlc,
+            0 if msg.is_remote_frame else pack_data(msg.data))
+
+
+def frame_columns(frames):
+    """
+    :param numpy.ndarray frames: records of candump_np.FRAME_DTYPE
+    :return: arbitration id, error, remote and extended flag, dlc and payload length as arrays, the
+             error frames as can.CanutilsLogReader reads them
+    """
+    ids = frames['id']
+    error = (ids & CAN_ERR_FLAG != 0) & (ids & CAN_ERR_BUSERROR != 0)
+    remote = (frames['flags'] & FLAG_REMOTE != 0) & ~error
+    extended = (frames['flags'] & FLAG_EXTENDED != 0) | error  # as can.Message(is_error_frame=True)
+    dlc = np.where(error, 0, frames['dlc'])
+    return np.where(error, 0, ids & 0x1FFFFFFF), error, remote, extended, dlc, np.where(remote, 0, dlc)
+
+
+def frame_rows(frames):
+    """
+    :param numpy.ndarray frames: records of candump_np.FRAME_DTYPE
+    :return: the row tuples of the frames as list
+    """
+    ids, error, remote, extended, dlc, length = frame_columns(frames)
+    raw = np.ascontiguousarray(frames['data']).tobytes()
+    data = [raw[8 * i:8 * i + n] for i, n in enumerate(length.tolist())]
+    return list(zip(frames['ts'].tolist(), ids.tolist(), extended.astype(np.int64).tolist(),
+                    remote.astype(np.int64).tolist(), error.astype(np.int64).tolist(), dlc.tolist(), data))
+
+
+def compact_rows(frames, seq):
+    """
+    :param numpy.ndarray frames: records of candump_np.FRAME_DTYPE
+    :param int seq: number of the first frame
+    :return: the row tuples of the frames in the compact schema as list
+    """
+    ids, error, remote, extended, dlc, length = frame_columns(frames)
+    flags = extended * FLAG_EXTENDED | remote * FLAG_REMOTE | error * FLAG_ERROR
+    # the payload bytes as little endian int64, the bytes after the payload cleared, as pack_data
+    length = np.minimum(length, 8).astype(np.int64)
+    mask = np.where(length == 8, -1, (np.int64(1) << 8 * np.minimum(length, 7)) - 1)
+    data = np.ascontiguousarray(frames['data']).view('<i8').ravel() & mask
+    return list(zip(frames['ts'].tolist(), range(seq, seq + len(frames)), ids.tolist(), flags.tolist(),
+                    dlc.tolist(), data.tolist()))
+
+
+class BatchReader:
+    """
+    Iterates over the frames of a log file in batches of batch_size row tuples (the last one smaller).
+
+    :ivar int frames: number of rows yielded
+    :ivar int skipped: malformed lines of a candump log, left out
+    """
+
+    def __init__(self, file_name, batch_size=BATCH_SIZE, compact=False, seq=0):
+        """
+        :param bool compact: yield rows of the compact schema
+        :param int seq: with compact, seq of the first frame
+        """
+        self.file_name = file_name
+        self.batch_size = batch_size
+        self.compact = compact
+        self.seq = seq
+        self.frames = 0
+        self.skipped = 0
+
+    def __iter__(self):
+        file_name = self.file_name
+        suffix = compression(file_name)
+        if (file_name[:-len(suffix)] if suffix else file_name).endswith(".log"):
+            chunks = self.candump_chunks()
+        elif file_name.endswith(RECORD_SUFFIX):
+            chunks = self.record_chunks()
+        else:
+            chunks = self.message_chunks()
+        rows = []
+        for chunk in chunks:
+            rows.extend(chunk)
+            while len(rows) >= self.batch_size:
+                batch, rows = rows[:self.batch_size], rows[self.batch_size:]
+                self.frames += len(batch)
+                yield batch
+        if rows:
+            self.frames += len(rows)
+            yield rows
+
+    def candump_chunks(self):
+        channels = []
+        with open_log(self.file_name) as f:
+            for buf in read_blocks(f, min(BLOCK_SIZE, self.batch_size * LINE_SIZE)):
+                block = parse_block(buf, channels)
+                self.skipped += int(np.count_nonzero(~block.valid))
+                frames = block.frames[block.valid]
+                for i in range(0, len(frames), self.batch_size):
+                    yield self.rows(frames[i:i + self.batch_size])
+
+    def record_chunks(self):
+        with RecordFile(self.file_name) as f:
+            for i in range(0, len(f), READ_CHUNK):
+                yield self.rows(f.frames[i:i + READ_CHUNK])
+
+    def rows(self, frames):
+        if not self.compact:
+            return frame_rows(frames)
+        rows = compact_rows(frames, self.seq)
+        self.seq += len(rows)
+        return rows
+
+    def message_chunks(self):
+        from player2 import LogReader2
+
+        reader = LogReader2(self.file_name, None)
+        try:
+            rows = []
+            for msg in reader:
+                if self.compact:
+                    rows.append(compact_message_row(msg, self.seq))
+                    self.seq += 1
+                else:
+                    rows.append(message_row(msg))
+                if len(rows) >= self.batch_size:
+                    yield rows
+                    rows = []
+            yield rows
+        finally:
+            reader.stop()
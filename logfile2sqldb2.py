@@ -2,24 +2,227 @@
 # coding: utf-8
 
 """
-Import a can-bus logfile into sqlite3 db.
-Note: don't forget to add an index to ts field:
-   sqlite3 -line log-data.db 'CREATE unique INDEX ts_idx ON messages (ts);'
+Import a can-bus logfile into sqlite3 db. The time stamps are stored as integer µs (ts INTEGER),
+sqlite2.SqliteReader2 reads them back as seconds. The frames are read in batches of -commit-rows with
+ingest.BatchReader, as fast as they can be inserted. A writer thread (:class:`BatchWriter`) inserts and
+commits them, up to -queue-depth batches behind the reader, so parsing overlaps the inserts and the fsync
+of the commits. At the end the frames/s of both sides, the time each waited for the other and the queue
+depth are printed: the side that waited less is the bottleneck.
+
+Once the rows are loaded the indexes of INDEXES (or -index) are built and ANALYZE is run, so the
+start time and per-id queries of SqliteReader2 use them. The ts index is not unique: frames may share a
+time stamp.
+
+With -compact a new messages table gets the compact schema of sqlite2.COMPACT_SCHEMA: WITHOUT ROWID,
+clustered on (ts, seq), so the rows of a time range are stored together and found without an index,
+flags in one column and the payload as INTEGER. seq continues after the frames already in the table. An
+index which is a prefix of the primary key, like ts, is not built.
+
+With -bulk the import runs with BULK_PRAGMAS: no rollback journal, no fsync, a large page cache and
+the database locked for the whole import. A crash during the import leaves a corrupt database, import
+again. The durable settings (RESTORED_PRAGMAS) are set back to their previous values at the end, the
+larger page size of a new database stays.
 """
 
 from __future__ import absolute_import, print_function
 
+import queue
 import sqlite3
 import sys
+import threading
+import time
 import argparse
+from collections import Counter
 from datetime import datetime
 
 import can
-from can import LogReader, MessageSync
+
+from ingest import BatchReader
+from sqlite2 import TS_US, COMPACT_SCHEMA, ts_scale, is_compact
+from profiling import StageProfiler, profiled, DUMP_SUFFIXES
+
+COMMIT_ROWS = 100_000
+COLUMNS = ("ts", "arbitration_id", "extended", "remote", "error", "dlc", "data")
+COMPACT_COLUMNS = ("ts", "seq", "arbitration_id", "flags", "dlc", "data")
+COMPACT_KEY = ("ts", "seq")
+INDEXES = ("ts", "arbitration_id,ts")  # columns of each index
+QUEUE_DEPTH = 2  # row batches between the reader and the writer thread, a batch of COMMIT_ROWS takes ~20 MB
+QUEUE_DEPTHS = Counter()  # batches queued when the reader puts the next one, of all closed BatchWriters
+
+# in this order: page_size only takes effect before the first table is created
+BULK_PRAGMAS = (
+    ("page_size", "65536"),
+    ("journal_mode", "OFF"),
+    ("synchronous", "OFF"),
+    ("cache_size", "-1048576"),  # KiB, 1 GiB
+    ("temp_store", "MEMORY"),
+    ("locking_mode", "EXCLUSIVE"),
+)
+RESTORED_PRAGMAS = ("journal_mode", "synchronous", "cache_size", "temp_store", "locking_mode")
 
 
 def my_logger(conn, messages):
-    conn.executemany("INSERT INTO messages VALUES (?, ?, ?, ?, ?, ?, ?)", messages)
+    conn.executemany("INSERT INTO messages VALUES ({})".format(", ".join("?" * len(messages[0]))), messages)
+    conn.commit()
+
+
+class BatchWriter:
+    """
+    Inserts and commits row batches on a writer thread, up to depth batches behind the reader. From the
+    first put until close the connection is used by the writer thread only.
+
+    :ivar int rows: rows inserted
+    :ivar float busy: wall time of the inserts and commits
+    :ivar float get_wait: wall time the writer thread waited for a batch
+    :ivar float put_wait: wall time the reader waited for a free place in the queue
+    :ivar collections.Counter depths: number of batches queued when the reader put the next one
+    """
+
+    def __init__(self, conn, logger=my_logger, depth=QUEUE_DEPTH):
+        """
+        :param sqlite3.Connection conn: opened with check_same_thread=False
+        :param logger: function of (conn, rows) inserting and committing the rows, e.g. :func:`my_logger`
+        """
+        self.conn = conn
+        self.logger = logger
+        self.depth = depth
+        self.queue = queue.Queue(depth)
+        self.rows = 0
+        self.busy = self.get_wait = self.put_wait = 0.0
+        self.depths = Counter()
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            wait = time.perf_counter()
+            messages = self.queue.get()
+            start = time.perf_counter()
+            self.get_wait += start - wait
+            if messages is None:
+                return
+            if self.error is not None:
+                continue  # drop the rest, the reader raises the error at its next put
+            try:
+                self.logger(self.conn, messages)
+            except BaseException as e:
+                self.error = e
+                continue
+            self.rows += len(messages)
+            self.busy += time.perf_counter() - start
+            print('Commits', self.rows)
+
+    def put(self, messages):
+        """
+        Queue a batch of rows, waits while depth batches are queued.
+
+        :raise: the error of an insert of the writer thread
+        """
+        if self.error is not None:
+            raise self.error
+        self.depths[self.queue.qsize()] += 1
+        wait = time.perf_counter()
+        self.queue.put(messages)
+        self.put_wait += time.perf_counter() - wait
+
+    def close(self):
+        """
+        Wait until the queued batches are inserted, the error of an insert stays in :attr:`error`.
+        """
+        self.queue.put(None)
+        self.thread.join()
+        QUEUE_DEPTHS.update(self.depths)
+
+    def print_report(self, frames, wall):
+        """
+        :param int frames: rows read
+        :param float wall: wall time from the first read to :meth:`close`
+        """
+        read = wall - self.put_wait
+        puts = sum(self.depths.values())
+        print("Read {:d} frames, {:.0f} frames/s, waited {:.2f} s for the writer".format(
+            frames, frames / read if read > 0 else 0, self.put_wait))
+        print("Inserted {:d} frames, {:.0f} frames/s, waited {:.2f} s for the reader".format(
+            self.rows, self.rows / self.busy if self.busy > 0 else 0, self.get_wait))
+        print("Queue depth mean {:.2f} max {:d} of {:d}".format(
+            sum(depth * n for depth, n in self.depths.items()) / puts if puts else 0,
+            max(self.depths, default=0), self.depth))
+
+
+def create_table(conn, compact=False):
+    """
+    Create the messages table if there is none, with the compact schema if compact is True.
+    """
+    if compact:
+        conn.cursor().execute(COMPACT_SCHEMA.format("messages"))
+        conn.commit()
+        return
+    conn.cursor().execute("""
+        CREATE TABLE IF NOT EXISTS messages
+        (
+          ts INTEGER,
+          arbitration_id INTEGER,
+          extended INTEGER,
+          remote INTEGER,
+          error INTEGER,
+          dlc INTEGER,
+          data BLOB
+        )""")
+    conn.commit()
+
+
+def bulk_load(conn):
+    """
+    Apply BULK_PRAGMAS to the connection.
+
+    :return: the previous values of RESTORED_PRAGMAS, for :func:`restore_pragmas`
+    """
+    previous = [(name, conn.execute("PRAGMA {}".format(name)).fetchone()[0]) for name in RESTORED_PRAGMAS]
+    for name, value in BULK_PRAGMAS:
+        conn.execute("PRAGMA {} = {}".format(name, value))
+    return previous
+
+
+def restore_pragmas(conn, previous):
+    """
+    Set the pragmas back after the import, outside of a transaction.
+    """
+    conn.commit()
+    for name, value in previous:
+        conn.execute("PRAGMA {} = {}".format(name, value))
+
+
+def index_columns(columns, known=COLUMNS):
+    """
+    :param str columns: comma separated columns of the messages table, e.g. 'arbitration_id,ts'
+    :param known: the columns of the table, COLUMNS or COMPACT_COLUMNS
+    :return: the columns as list
+    :raise ValueError: for an unknown column
+    """
+    names = [name.strip() for name in columns.split(",")]
+    unknown = [name for name in names if name not in known]
+    if unknown:
+        raise ValueError("unknown column {} in index {}".format(unknown[0], columns))
+    return names
+
+
+def create_indexes(conn, indexes, compact=False):
+    """
+    Build the indexes of the messages table after the load, then ANALYZE it for the query planner.
+
+    :param indexes: the columns of each index, see :func:`index_columns`
+    :param bool compact: the table has the compact schema, whose primary key serves the prefixes of COMPACT_KEY
+    """
+    for columns in indexes:
+        names = index_columns(columns, COMPACT_COLUMNS if compact else COLUMNS)
+        if compact and tuple(names) == COMPACT_KEY[:len(names)]:
+            print('Index', ", ".join(names), 'is the primary key')
+            continue
+        conn.execute("CREATE INDEX IF NOT EXISTS messages_{}_idx ON messages ({})".format(
+            "_".join(names), ", ".join(names)))
+        print('Index', ", ".join(names))
+    conn.execute("ANALYZE messages")
     conn.commit()
 
 
@@ -29,7 +232,8 @@ def main():
         description="Import can-bus logfile into sqlite3 db.")
 
     parser.add_argument('infile', metavar='input-file', type=str,
-                        help='The file to read. For supported types see can.LogReader.')
+                        help='The file to read. For supported types see can.LogReader, '
+                             'may be compressed (.gz, .xz, .bz2) or a record file (.canrec).')
 
     parser.add_argument('outfile', metavar='output-file', type=str,
                         help='The file to write. For supported types see can.LogReader.')
@@ -38,6 +242,36 @@ def main():
                         help='''How much information do you want to see at the command line?
                         You can add several of these e.g., -vv is DEBUG''', default=2)
 
+    parser.add_argument('-compact', action='store_true',
+                        help='Create the messages table with the compact schema (WITHOUT ROWID, clustered on ts, '
+                             'flags in one column, payload as INTEGER), see sqlite2.py.')
+
+    parser.add_argument('-bulk', action='store_true',
+                        help='Import with the bulk-load pragmas (no journal, no fsync, large cache, exclusive lock), '
+                             'set back at the end. A crash during the import leaves a corrupt database.')
+
+    parser.add_argument('-commit-rows', metavar='N', type=int, default=COMMIT_ROWS,
+                        help='Insert and commit the rows in batches of N (default {:d}).'.format(COMMIT_ROWS))
+
+    parser.add_argument('-queue-depth', metavar='N', type=int, default=QUEUE_DEPTH,
+                        help='Insert on a writer thread, up to N batches behind the reader (default {:d}), '
+                             '0 inserts on the reading thread.'.format(QUEUE_DEPTH))
+
+    parser.add_argument('-index', metavar='columns', type=str, action='append', default=None,
+                        help='Build an index on these comma separated columns after the load, may be repeated '
+                             '(default: {}).'.format(" and ".join(INDEXES)))
+
+    parser.add_argument('-no-index', action='store_true',
+                        help='Build no index and do not ANALYZE.')
+
+    parser.add_argument('-profile', metavar='file', type=str, default=None,
+                        help='Time the stages (read, queue or with -queue-depth 0 insert, index), print them to '
+                             'stderr at the end and write them to this JSON file.')
+
+    parser.add_argument('-profile-dump', choices=sorted(DUMP_SUFFIXES), default=None,
+                        help='With -profile: also write a cProfile (.prof) or tracemalloc (.tracemalloc) dump next '
+                             'to the JSON file.')
+
     # print help message when no arguments were given
     if len(sys.argv) < 2:
         parser.print_help(sys.stderr)
@@ -45,57 +279,96 @@ def main():
         raise SystemExit(errno.EINVAL)
 
     results = parser.parse_args()
+    if results.profile_dump and not results.profile:
+        parser.error('-profile-dump needs -profile')
+    if results.queue_depth < 0:
+        parser.error('-queue-depth must not be negative')
+    if results.index and results.no_index:
+        parser.error('-index and -no-index exclude each other')
+    indexes = results.index or INDEXES
+    for columns in indexes:
+        try:
+            index_columns(columns, COMPACT_COLUMNS if results.compact else COLUMNS)
+        except ValueError as e:
+            parser.error(str(e))
+    results.index = [] if results.no_index else indexes
 
     verbosity = results.verbosity
 
     logging_level_name = ['critical', 'error', 'warning', 'info', 'debug', 'subdebug'][min(5, verbosity)]
     can.set_logging_level(logging_level_name)
 
-    reader = LogReader(results.infile)
-    in_nosync = MessageSync(reader, timestamps=False, skip=3600)
+    profiler = StageProfiler() if results.profile else None
+    with profiled(profiler, results.profile, results.profile_dump, "logfile2sqldb2",
+                  counters={"queue depth": QUEUE_DEPTHS}):
+        run(results, profiler)
+
+
+def run(results, profiler):
+    verbosity = results.verbosity
+    logger, index = my_logger, create_indexes
+    if profiler is not None:
+        if not results.queue_depth:  # the stages run in the main thread
+            logger = profiler.wrap("insert", my_logger, lambda call, result: len(call[1]), "frames")
+        index = profiler.wrap("index", create_indexes, lambda call, result: len(call[1]), "indexes")
     print('Can LogReader (Started on {})'.format(datetime.now()))
 
-    conn = sqlite3.connect(results.outfile)
-    conn.cursor().execute("""
-        CREATE TABLE IF NOT EXISTS messages
-        (
-          ts REAL,
-          arbitration_id INTEGER,
-          extended INTEGER,
-          remote INTEGER,
-          error INTEGER,
-          dlc INTEGER,
-          data BLOB
-        )""")
-    conn.commit()
+    conn = sqlite3.connect(results.outfile, check_same_thread=False)
+    previous = bulk_load(conn) if results.bulk else None
+    create_table(conn, results.compact)
+    error = None
+    if ts_scale(conn.cursor(), "messages") != TS_US:
+        error = "{} has time stamps in s (ts REAL), import into a new file".format(results.outfile)
+    elif is_compact(conn.cursor(), "messages") != results.compact:
+        error = "{} has the {} schema, import {} -compact".format(
+            results.outfile, *(("plain", "without") if results.compact else ("compact", "with")))
+    if error is not None:
+        if previous is not None:
+            restore_pragmas(conn, previous)
+        conn.close()
+        raise SystemExit(error)
+
+    seq = conn.execute("SELECT max(seq) + 1 FROM messages").fetchone()[0] or 0 if results.compact else 0
+    reader = BatchReader(results.infile, results.commit_rows, results.compact, seq)
+    batches = iter(reader)
+    if profiler is not None:
+        batches = profiler.iterate("read", batches, len, "frames")
 
-    messages = []
+    writer = None
+    if results.queue_depth:
+        writer = BatchWriter(conn, logger, results.queue_depth)
+        put = writer.put
+        if profiler is not None:
+            put = profiler.wrap("queue", writer.put, lambda call, result: len(call[0]), "frames")
     m = 0
+    wall = time.perf_counter()
     try:
-        for msg in in_nosync:
+        for messages in batches:
             if verbosity >= 3:
-                print(msg)
-            messages.append((
-                msg.timestamp,
-                msg.arbitration_id,
-                msg.is_extended_id,
-                msg.is_remote_frame,
-                msg.is_error_frame,
-                msg.dlc,
-                memoryview(msg.data)))
-            if len(messages) >= 100_000:
-                my_logger(conn, messages)
-                m += len(messages)
-                print('Commits', m)
-                messages = []
+                for row in messages:
+                    print(row)
+            if writer is not None:
+                put(messages)
+                continue
+            logger(conn, messages)
+            m += len(messages)
+            print('Commits', m)
 
     except KeyboardInterrupt:
         pass
     finally:
-        reader.stop()
-        if len(messages) > 0:
-            my_logger(conn, messages)
+        if writer is not None:
+            writer.close()
+            writer.print_report(reader.frames, time.perf_counter() - wall)
+        if reader.skipped:
+            print('Malformed lines skipped', reader.skipped)
+        if results.index:
+            index(conn, results.index, results.compact)
+        if previous is not None:
+            restore_pragmas(conn, previous)
         conn.close()
+    if writer is not None and writer.error is not None:
+        raise writer.error
 
 
 if __name__ == "__main__":
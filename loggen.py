@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Deterministic synthetic CANaerospace candump logs, for benchmarks and tests of correct-ts.py.
+
+   python loggen.py -output data/synthetic.log -size 100M -seed 1
+
+The bus carries periodic normal operation data (canIds 300-1799) of a number of nodes, with the
+CANaerospace header (node id, data type, service code, message code counting up per canId) and
+4 data bytes, with jitter and dropouts. Every second the logger sends a time sync frame (canId 0x1FFFFFF0)
+and the GPS receiver its date (1206) and time (1200). Now and then the logger clock jumps ahead,
+which starts a new segment in correct-ts, and some lines are malformed. The capture clock (the time
+stamps) may drift against GPS time.
+
+The same seed and options give the same log, a smaller size a prefix of it.
+"""
+
+import argparse
+import datetime
+import sys
+
+import numpy as np
+
+from candump import SYNC_ID, GPS_UTC_ID, GPS_DATE_ID
+from compressed import open_log
+
+CHANNEL = b"can0"
+START = "2019-08-05 08:35:47"
+SIGNALS = 48
+NODES = 12
+PERIODS = (0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0)  # s
+PERIOD_WEIGHTS = (0.1, 0.2, 0.2, 0.2, 0.1, 0.1, 0.1)
+DATA_TYPES = (0x02, 0x03, 0x06, 0x09)
+JITTER = 0.02  # standard deviation, fraction of the period
+DROPOUT_RATE = 0.001  # per frame
+JUMP_RATE = 0.002  # logger clock jumps per second
+MALFORMED_RATE = 0.0001  # per line
+CLOCK_DRIFT = 0.0  # capture clock against GPS time, s/s
+GPS_NODE = 0x0A
+
+_HEX_DIGITS = np.frombuffer(b"0123456789ABCDEF", np.uint8)
+_HEX = np.frombuffer(b"".join(b"%02X" % i for i in range(256)), np.uint8).reshape(256, 2)
+_POW10 = 10 ** np.arange(9, -1, -1, dtype=np.int64)
+
+
+def parse_size(text):
+    """
+    :param str text: number of bytes, with an optional suffix k, M or G (powers of 1024)
+    """
+    units = {"k": 1 << 10, "m": 1 << 20, "g": 1 << 30}
+    unit = units.get(text[-1:].lower())
+    if unit is None:
+        return int(text)
+    return int(float(text[:-1]) * unit)
+
+
+class LogGenerator:
+    """
+    Generates the log one second at a time, see :meth:`window`.
+    """
+
+    def __init__(self, seed=1, start=START, channel=CHANNEL, signals=SIGNALS, nodes=NODES,
+                 jump_rate=JUMP_RATE, malformed_rate=MALFORMED_RATE, dropout_rate=DROPOUT_RATE,
+                 clock_drift=CLOCK_DRIFT):
+        """
+        :param str start: UTC time of the first second, YYYY-MM-DD hh:mm:ss
+        :param float clock_drift: the time stamps run fast by this fraction, e.g. 50e-6
+        """
+        rng = self.rng = np.random.default_rng(seed)
+        self.channel = channel
+        self.jump_rate = jump_rate
+        self.malformed_rate = malformed_rate
+        self.dropout_rate = dropout_rate
+        self.clock_drift = clock_drift
+
+        candidates = np.setdiff1d(np.arange(300, 1800), (GPS_UTC_ID, GPS_DATE_ID))
+        self.ids = rng.choice(candidates, signals, replace=False)
+        self.node = rng.choice(np.arange(1, 128), nodes, replace=False)[rng.integers(0, nodes, signals)]
+        self.data_type = rng.choice(DATA_TYPES, signals)
+        self.period = np.rint(rng.choice(PERIODS, signals, p=PERIOD_WEIGHTS) * 1000000).astype(np.int64)  # µs
+        self.phase = rng.integers(0, self.period)
+        self.code = rng.integers(0, 256, signals)  # message code of the next frame
+        self.count = 1000000 // self.period  # frames per second
+        self.sig = np.repeat(np.arange(signals), self.count)
+        self.k = np.concatenate([np.arange(c) for c in self.count])
+
+        self.second = int(datetime.datetime.strptime(start, "%Y-%m-%d %H:%M:%S").replace(
+            tzinfo=datetime.timezone.utc).timestamp())
+        self.start = self.second * 1000000
+        self.clock_offset = 0  # logger clock - GPS time, s
+        self.lines = 0
+        self.malformed = 0
+        self.jumps = 0
+
+        # "(SSSSSSSSSS.UUUUUU) <channel> III#DDDDDDDDDDDDDDDD\n"
+        template = b"(0000000000.000000) " + channel + b" 000#0000000000000000\n"
+        self.template = np.frombuffer(template, np.uint8)
+        self.id_col = 21 + len(channel)
+        self.data_col = self.id_col + 4
+
+    def window(self):
+        """
+        :return: the lines of the next second as bytes
+        """
+        rng = self.rng
+        sig, k = self.sig, self.k
+        period = self.period[sig]
+        jitter = np.rint(rng.normal(0, JITTER, len(sig)) * period).astype(np.int64)
+        offset = (self.phase[sig] + k * period + jitter) % 1000000
+        codes = (self.code[sig] + k) % 256
+        self.code = (self.code + self.count) % 256  # dropped frames are missing in the message codes
+        keep = np.flatnonzero(rng.random(len(sig)) >= self.dropout_rate)
+        keep = keep[np.argsort(offset[keep], kind='stable')]
+        sig, offset, codes = sig[keep], offset[keep], codes[keep]
+        n = len(sig)
+
+        payload = np.empty((n, 8), np.uint8)
+        payload[:, 0] = self.node[sig]
+        payload[:, 1] = self.data_type[sig]
+        payload[:, 2] = 0
+        payload[:, 3] = codes
+        payload[:, 4:] = rng.integers(0, 256, (n, 4), np.uint8)
+        ts = self.capture(self.second * 1000000 + offset)
+        rows = self.format_frames(ts, self.ids[sig], payload)
+
+        # (time stamp, line), in order of the time stamps
+        if rng.random() < self.jump_rate:
+            self.clock_offset += int(rng.integers(2, 120))
+            self.jumps += 1
+        base = self.second * 1000000
+        sync_ts = base + int(rng.integers(0, 1000))
+        date_ts = base + int(rng.integers(200000, 300000))
+        time_ts = self.capture(date_ts + int(rng.integers(1000, 2000)))
+        sync_ts, date_ts = self.capture(sync_ts), self.capture(date_ts)
+        specials = [(sync_ts, self.sync_line(sync_ts, self.second + self.clock_offset)),
+                    (date_ts, self.gps_date_line(date_ts, self.second)),
+                    (time_ts, self.gps_time_line(time_ts, self.second))]
+        malformed = rng.binomial(n + len(specials), self.malformed_rate)
+        for row in rng.integers(0, n, malformed).tolist():
+            specials.append((int(ts[row]), self.malformed_line(rows[row].tobytes())))
+        specials.sort(key=lambda special: special[0])
+        self.malformed += malformed
+        self.lines += n + len(specials)
+        self.second += 1
+
+        pieces = []
+        pos = 0
+        for row, (_, line) in zip(np.searchsorted(ts, [t for t, _ in specials], side='right').tolist(), specials):
+            pieces.append(rows[pos:row].tobytes())
+            pieces.append(line)
+            pos = row
+        pieces.append(rows[pos:].tobytes())
+        return b"".join(pieces)
+
+    def capture(self, ts):
+        """
+        :param ts: GPS time in µs, int or numpy.ndarray
+        :return: the time stamp of the capture clock
+        """
+        if not self.clock_drift:
+            return ts
+        drift = (ts - self.start) * self.clock_drift
+        return ts + (np.rint(drift).astype(np.int64) if isinstance(drift, np.ndarray) else round(drift))
+
+    def format_frames(self, ts, ids, payload):
+        """
+        :return: the lines as uint8 matrix, one row per line
+        """
+        rows = np.tile(self.template, (len(ts), 1))
+        sec = ts // 1000000
+        usec = ts % 1000000
+        rows[:, 1:11] = sec[:, None] // _POW10 % 10 + 48
+        rows[:, 12:18] = usec[:, None] // _POW10[4:] % 10 + 48
+        col = self.id_col
+        rows[:, col] = _HEX_DIGITS[ids >> 8 & 15]
+        rows[:, col + 1] = _HEX_DIGITS[ids >> 4 & 15]
+        rows[:, col + 2] = _HEX_DIGITS[ids & 15]
+        rows[:, self.data_col:self.data_col + 16] = _HEX[payload].reshape(len(ts), 16)
+        return rows
+
+    def sync_line(self, ts, logger_second):
+        """
+        :param int ts: time stamp in µs
+        :param int logger_second: logger time, epoch seconds
+        """
+        t = datetime.datetime.fromtimestamp(logger_second, datetime.timezone.utc)
+        return b"(%d.%06d) %s %08X#%02X%02X%02X%02X%02X%02X0000\n" % (
+            ts // 1000000, ts % 1000000, self.channel, SYNC_ID,
+            t.year - 2000, t.month, t.day, t.hour, t.minute, t.second)
+
+    def gps_date_line(self, ts, gps_second):
+        t = datetime.datetime.fromtimestamp(gps_second, datetime.timezone.utc)
+        return b"(%d.%06d) %s %03X#%02X0A0000%02X%02X%02X%02X\n" % (
+            ts // 1000000, ts % 1000000, self.channel, GPS_DATE_ID, GPS_NODE,
+            t.day, t.month, t.year // 100, t.year % 100)
+
+    def gps_time_line(self, ts, gps_second):
+        t = datetime.datetime.fromtimestamp(gps_second, datetime.timezone.utc)
+        return b"(%d.%06d) %s %03X#%02X0A0000%02X%02X%02X00\n" % (
+            ts // 1000000, ts % 1000000, self.channel, GPS_UTC_ID, GPS_NODE,
+            t.hour, t.minute, t.second)
+
+    def malformed_line(self, line):
+        kind = int(self.rng.integers(0, 3))
+        if kind == 0:  # cut off
+            return line[:int(self.rng.integers(1, len(line) - 1))] + b"\n"
+        if kind == 1:  # not hex
+            return line.replace(b"#", b"#XY", 1)
+        return b"garbage\n"
+
+    def generate(self, f, size):
+        """
+        Write whole seconds until at least size bytes are written.
+
+        :return: the number of bytes written
+        """
+        written = 0
+        while written < size:
+            data = self.window()
+            f.write(data)
+            written += len(data)
+        return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic CANaerospace candump log.')
+    parser.add_argument('-output', metavar='file', type=str, default='-',
+                        help='Output file, may be compressed (.gz, .xz, .bz2), - for stdout (default).')
+    parser.add_argument('-size', metavar='bytes', type=str, required=True,
+                        help='Size of the log, e.g. 500k, 100M, 20G (of the uncompressed log).')
+    parser.add_argument('-seed', type=int, default=1, help='Random seed (default 1).')
+    parser.add_argument('-start', type=str, default=START, help='UTC start time (default {}).'.format(START))
+    parser.add_argument('-signals', type=int, default=SIGNALS, help='Number of periodic canIds.')
+    parser.add_argument('-jump-rate', type=float, default=JUMP_RATE, help='Logger clock jumps per second.')
+    parser.add_argument('-malformed-rate', type=float, default=MALFORMED_RATE, help='Malformed lines per line.')
+    parser.add_argument('-clock-drift', type=float, default=CLOCK_DRIFT,
+                        help='Drift of the capture clock against GPS time, s/s, e.g. 50e-6.')
+    args = parser.parse_args()
+
+    generator = LogGenerator(args.seed, args.start, signals=args.signals, jump_rate=args.jump_rate,
+                             malformed_rate=args.malformed_rate, clock_drift=args.clock_drift)
+    if args.output == '-':
+        written = generator.generate(sys.stdout.buffer, parse_size(args.size))
+    else:
+        with open_log(args.output, "wb") as f:
+            written = generator.generate(f, parse_size(args.size))
+    print("lines=", generator.lines, "bytes=", written, "malformed=", generator.malformed,
+          "clock jumps=", generator.jumps, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
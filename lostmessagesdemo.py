@@ -1,21 +1,23 @@
 """
 Import can log file into sqlite3 db.
 """
-from can import LogReader, MessageSync, Logger
+import sqlite3
+
+from ingest import BatchReader
+from logfile2sqldb2 import create_table, my_logger
 
 def main():
-    reader = LogReader('data/test-log.log')
-    in_nosync = MessageSync(reader, timestamps=False)
-    logger = Logger('data/test-log.db')
+    reader = BatchReader('data/test-log.log')
+    conn = sqlite3.connect('data/test-log.db')
+    create_table(conn)
 
     try:
-        for msg in in_nosync:
-            logger(msg)
+        for messages in reader:
+            my_logger(conn, messages)
     except KeyboardInterrupt:
         pass
     finally:
-        reader.stop()
-        logger.stop()
+        conn.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,144 @@
+# coding: utf-8
+
+"""
+Constant memory statistics of a stream of values, e.g. the GPS time offsets of a segment.
+
+:class:`RunningStats` updates count, mean and variance with Welford's method, min and max,
+and estimates quantiles with the P² algorithm (Jain and Chlamtac, 1985), which keeps five
+markers per quantile instead of the values.
+"""
+
+import math
+from bisect import bisect_right, insort
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class P2Quantile:
+    """
+    Streaming estimate of the p-quantile. Exact for up to five values.
+    """
+
+    def __init__(self, p):
+        self.p = p
+        self.q = []  # marker heights, the first five values until there are five
+        self.n = [0, 1, 2, 3, 4]  # marker positions
+        self.np = [0, 2 * p, 4 * p, 2 + 2 * p, 4]  # desired marker positions
+        self.dn = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x):
+        q = self.q
+        if len(q) < 5:
+            insort(q, x)
+            return
+        n = self.n
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = bisect_right(q, x) - 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        np = self.np
+        for i in range(5):
+            np[i] += self.dn[i]
+        for i in range(1, 4):
+            d = np[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                qp = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                if not q[i - 1] < qp < q[i + 1]:
+                    qp = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = qp
+                n[i] += d
+
+    def value(self):
+        """
+        :return: the estimated quantile, None without values
+        """
+        q = self.q
+        if not q:
+            return None
+        if len(q) < 5 or self.n[4] == 4:
+            pos = self.p * (len(q) - 1)
+            i = int(pos)
+            return q[i] if i + 1 == len(q) else q[i] + (pos - i) * (q[i + 1] - q[i])
+        return q[2]
+
+    def state(self):
+        return {"q": self.q, "n": self.n, "np": self.np}
+
+    def restore(self, state):
+        self.q = list(state["q"])
+        self.n = list(state["n"])
+        self.np = list(state["np"])
+
+
+class RunningStats:
+    """
+    Count, mean, variance, min, max and quantiles of a stream of values.
+    """
+
+    def __init__(self, quantiles=QUANTILES):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # sum of squared differences from the mean
+        self.min = None
+        self.max = None
+        self.quantiles = [P2Quantile(p) for p in quantiles]
+
+    def __len__(self):
+        return self.count
+
+    def add(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        if self.min is None or x < self.min:
+            self.min = x
+        if self.max is None or x > self.max:
+            self.max = x
+        for quantile in self.quantiles:
+            quantile.add(x)
+
+    def variance(self):
+        """
+        :return: the sample variance, as statistics.variance
+        """
+        if self.count < 2:
+            raise ValueError("variance requires at least two values")
+        return self.m2 / (self.count - 1)
+
+    def stdev(self):
+        return math.sqrt(self.variance())
+
+    def quantile(self, p):
+        for quantile in self.quantiles:
+            if quantile.p == p:
+                return quantile.value()
+        raise KeyError(p)
+
+    def state(self):
+        """
+        :return: JSON serializable state, see :meth:`restore`
+        """
+        return {"count": self.count, "mean": self.mean, "m2": self.m2, "min": self.min, "max": self.max,
+                "quantiles": [[quantile.p, quantile.state()] for quantile in self.quantiles]}
+
+    def restore(self, state):
+        self.count = state["count"]
+        self.mean = state["mean"]
+        self.m2 = state["m2"]
+        self.min = state["min"]
+        self.max = state["max"]
+        self.quantiles = []
+        for p, quantile_state in state["quantiles"]:
+            quantile = P2Quantile(p)
+            quantile.restore(quantile_state)
+            self.quantiles.append(quantile)
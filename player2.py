@@ -6,17 +6,50 @@ well as :class:`MessageSync` which plays back messages
 in the recorded order an time intervals.
 """
 
-from can import LogReader
+import io
+import os
+
+from can import LogReader, CanutilsLogReader, ASCReader, CSVReader, BLFReader
+
+from canrec import RECORD_SUFFIX, RecordReader
+from compressed import compression, open_log
 from sqlite2 import SqliteReader2
+from timeindex import IndexedLogReader
+
+# readers for the file inside a compressed file, True for text files
+COMPRESSED_READERS = {
+    ".log": (CanutilsLogReader, True),
+    ".asc": (ASCReader, True),
+    ".csv": (CSVReader, True),
+    ".blf": (BLFReader, False),
+}
+
 
 class LogReader2(LogReader):
 
     @staticmethod
     def __new__(cls, filename, start_time, *args, **kwargs):
         """
-        :param str filename: the filename/path the file to read from
+        :param str filename: the filename/path the file to read from, may be compressed (.gz, .xz, .bz2)
+        :param float start_time: skip the frames before, found through the index for .db and .log files and by
+                                 bisecting the records of .canrec files, None for all frames
+        :raise ValueError: for a start_time with another format, or an unknown format in a compressed file
         """
-        if filename.endswith(".db") and start_time is not None:
+        if filename.endswith(".db"):  # ts in s or µs, plain or compact schema, see sqlite2
             return SqliteReader2(filename, "messages", start_time, *args, **kwargs)
+        elif filename.endswith(".log") and start_time is not None:
+            return IndexedLogReader(filename, start_time)
+        elif filename.endswith(RECORD_SUFFIX):
+            return RecordReader(filename, start_time, *args, **kwargs)
+        elif start_time is not None:
+            raise ValueError("{}: a start time needs a .db, uncompressed .log or {} file".format(filename, RECORD_SUFFIX))
+        elif compression(filename) is not None:
+            suffix = os.path.splitext(os.path.splitext(filename)[0])[1]
+            if suffix not in COMPRESSED_READERS:
+                raise ValueError("{}: unknown format {} in a compressed file, supported are {}".format(
+                    filename, suffix or "(no suffix)", ", ".join(sorted(COMPRESSED_READERS))))
+            reader, text = COMPRESSED_READERS[suffix]
+            f = open_log(filename)
+            return reader(io.TextIOWrapper(f) if text else f, *args, **kwargs)
         else:
             return super().__new__(cls, filename, *args, **kwargs)
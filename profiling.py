@@ -0,0 +1,302 @@
+# coding: utf-8
+
+"""
+Per-stage profiling of the command line tools (correct-ts.py -profile, logfile2sqldb2.py -profile,
+CanPlayer.py --profile).
+
+:class:`StageProfiler` counts calls and items (lines, frames, bytes, ...) per stage and samples which
+stage runs: every INTERVAL of wall time (SIGALRM) and of CPU time (SIGPROF) the time since the last
+signal goes to the innermost running stage, so the time of a stage called from another stage counts
+for the inner one only. Timing each call would take longer than many of the stages called per line.
+The stages are functions wrapped with :meth:`StageProfiler.wrap` or iterators wrapped with
+:meth:`StageProfiler.iterate`, only when profiling is asked for, so a normal run pays nothing. The
+cost of the counting, measured once at the start (:meth:`StageProfiler.calibrate`), is taken out of
+the calling stages and reported as "profiling".
+
+The signals are handled by the main thread, so the stages have to run in it. POSIX only, like the
+resource module used for the peak RSS.
+
+:func:`profiled` prints the stages at the end of the run and writes them as JSON summary, optionally
+with a cProfile or tracemalloc dump next to it.
+"""
+
+import json
+import os
+import resource
+import signal
+import sys
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+DUMP_SUFFIXES = {"cprofile": ".prof", "tracemalloc": ".tracemalloc"}
+TOP = 15
+INTERVAL = 0.001  # s between samples
+
+
+class Stage:
+    def __init__(self, unit):
+        self.unit = unit
+        self.calls = 0
+        self.items = 0
+        self.callers = Counter()  # calls per calling stage, None at the top
+
+
+class StageProfiler:
+    """
+    Wall and CPU time, calls and items per stage, of the main thread.
+    """
+
+    def __init__(self, interval=INTERVAL):
+        self.interval = interval
+        self.stages = {}  # in order of the first wrap
+        self.stack = [None]  # names of the running stages
+        self.times = [defaultdict(float), defaultdict(float)]  # wall, CPU per stage, None outside all stages
+        self.cost = (0.0, 0.0)  # wall, CPU per counted call
+        self.handlers = None
+        self.calibrate()
+
+    def calibrate(self, n=20000):
+        """
+        Measure the cost of counting a call.
+        """
+        def noop():
+            pass
+
+        def loop(func):
+            wall, cpu = time.perf_counter(), time.thread_time()
+            for _ in range(n):
+                func()
+            return (time.perf_counter() - wall) / n, (time.thread_time() - cpu) / n
+
+        bare = loop(noop)
+        counted = loop(self.wrap("calibrate", noop))
+        del self.stages["calibrate"]
+        self.cost = tuple(max(0.0, c - b) for c, b in zip(counted, bare))
+
+    def start(self):
+        """
+        Start sampling, in the main thread.
+        """
+        wall, cpu = self.times
+        stack = self.stack
+        last = [time.perf_counter(), time.process_time()]
+
+        # signals coming during a long call of C code are handled once after it, with the time since the
+        # last handled signal
+        def sample_wall(signum, frame):
+            now = time.perf_counter()
+            wall[stack[-1]] += now - last[0]
+            last[0] = now
+
+        def sample_cpu(signum, frame):
+            now = time.process_time()
+            cpu[stack[-1]] += now - last[1]
+            last[1] = now
+
+        self.handlers = signal.signal(signal.SIGALRM, sample_wall), signal.signal(signal.SIGPROF, sample_cpu)
+        signal.setitimer(signal.ITIMER_REAL, self.interval, self.interval)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        if self.handlers is None:
+            return
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGALRM, self.handlers[0])
+        signal.signal(signal.SIGPROF, self.handlers[1])
+        self.handlers = None
+
+    def stage(self, name, unit):
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = Stage(unit)
+        return stage
+
+    def wrap(self, name, func, items=None, unit="calls"):
+        """
+        :param items: function of (args, result) returning the number of items of a call, default 1
+        :return: func, timed as stage name
+        """
+        stage = self.stage(name, unit)
+        stack = self.stack
+        callers = stage.callers
+
+        def counted(*args, **kwargs):
+            callers[stack[-1]] += 1
+            stack.append(name)
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                stack.pop()
+            stage.calls += 1
+            stage.items += 1 if items is None else items(args, result)
+            return result
+        return counted
+
+    def patch(self, owner, attribute, name, items=None, unit="calls"):
+        """
+        Replace a function of a module or a method of an object by its timed variant.
+        """
+        setattr(owner, attribute, self.wrap(name, getattr(owner, attribute), items, unit))
+
+    def iterate(self, name, iterable, size=None, unit="items"):
+        """
+        :param size: function returning the number of items of an element, default 1
+        :return: iterator over iterable, the steps timed as stage name
+        """
+        step = self.wrap(name, iter(iterable).__next__,
+                         None if size is None else lambda args, element: size(element), unit)
+        while True:
+            try:
+                element = step()
+            except StopIteration:
+                return
+            yield element
+
+    def writer(self, name, f, unit="bytes"):
+        """
+        :return: a proxy of the stream f with write timed as stage name
+        """
+        return TimedWriter(f, self.wrap(name, f.write, lambda args, result: len(args[0]), unit))
+
+    def summary(self):
+        """
+        :return: the stages as JSON serializable dict, the wall and CPU time of the counting
+        """
+        times = {name: [self.times[i][name] for i in (0, 1)] for name in self.stages}
+        times[None] = [self.times[i][None] for i in (0, 1)]
+        overhead = [0.0, 0.0]
+        for stage in self.stages.values():
+            for caller, calls in stage.callers.items():
+                for i in 0, 1:
+                    overhead[i] += calls * self.cost[i]
+                    times[caller][i] -= calls * self.cost[i]
+        stages = {}
+        for name, stage in self.stages.items():
+            if not stage.calls:
+                continue
+            wall, cpu = (max(0.0, t) for t in times[name])  # the counting cost is an estimate
+            stages[name] = {"wall_s": round(wall, 6), "cpu_s": round(cpu, 6), "calls": stage.calls,
+                            "items": stage.items, "unit": stage.unit,
+                            "items_per_s": round(stage.items / wall) if wall > 0 else None}
+        return stages, overhead
+
+
+class TimedWriter:
+    """
+    Passes everything on to the wrapped stream, except write.
+    """
+
+    def __init__(self, f, write):
+        self.f = f
+        self.write = write
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+
+def print_report(summary, file):
+    print("{:<16s} {:>10s} {:>10s} {:>10s} {:>14s} {:>14s}".format(
+        "stage", "wall s", "CPU s", "calls", "items", "items/s"), file=file)
+    for name, stage in summary["stages"].items():
+        print("{:<16s} {:>10.3f} {:>10.3f} {:>10d} {:>14s} {:>14s}".format(
+            name, stage["wall_s"], stage["cpu_s"], stage["calls"], "{:d} {}".format(stage["items"], stage["unit"]),
+            "" if stage["items_per_s"] is None else "{:d}".format(stage["items_per_s"])), file=file)
+    for name in "profiling", "other":
+        print("{:<16s} {:>10.3f} {:>10.3f}".format(name, summary[name]["wall_s"], summary[name]["cpu_s"]), file=file)
+    print("{:<16s} {:>10.3f} {:>10.3f}   peak RSS {:.1f} MB".format(
+        "total", summary["wall_s"], summary["cpu_s"], summary["peak_rss_mb"]), file=file)
+    for name, counts in summary["counters"].items():
+        print("{:<16s} {}".format(name, " ".join("{}={:d}".format(*count) for count in sorted(counts.items()))),
+              file=file)
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux, in bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def cprofile_top(profile):
+    import pstats
+
+    stats = pstats.Stats(profile).stats
+    top = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:TOP]
+    return [{"function": "{}:{:d}({})".format(*function), "calls": nc, "tottime_s": round(tt, 6),
+             "cumtime_s": round(ct, 6)} for function, (cc, nc, tt, ct, callers) in top]
+
+
+def tracemalloc_top(snapshot):
+    return [{"location": "{}:{:d}".format(stat.traceback[0].filename, stat.traceback[0].lineno),
+             "size_kb": round(stat.size / 1024, 1), "count": stat.count}
+            for stat in snapshot.statistics("lineno")[:TOP]]
+
+
+@contextmanager
+def profiled(profiler, summary_file, dump=None, tool=None, report=sys.stderr, counters=None):
+    """
+    Profile the enclosed code, then print the stages to report and write the JSON summary.
+
+    :param StageProfiler profiler: collects the stages, None to profile nothing
+    :param str summary_file: the JSON summary, e.g. profile.json
+    :param str dump: None, 'cprofile' or 'tracemalloc', written to the summary file name with
+                     .prof or .tracemalloc instead of .json
+    :param dict counters: name -> dict of counts taken at the end, e.g. writer.SYSCALLS
+    """
+    if profiler is None:
+        yield
+        return
+    dump_file = None
+    if dump is not None:
+        dump_file = os.path.splitext(summary_file)[0] + DUMP_SUFFIXES[dump]
+    profile = None
+    if dump == "cprofile":
+        import cProfile
+        profile = cProfile.Profile()
+    elif dump == "tracemalloc":
+        import tracemalloc
+        tracemalloc.start()
+
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    profiler.start()
+    if profile is not None:
+        profile.enable()
+    try:
+        yield
+    finally:
+        if profile is not None:
+            profile.disable()
+        profiler.stop()
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+        stages, (overhead_wall, overhead_cpu) = profiler.summary()
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        summary = {
+            "tool": tool,
+            "argv": sys.argv,
+            "wall_s": round(wall, 6),
+            "cpu_s": round(cpu, 6),
+            "children_cpu_s": round(children.ru_utime + children.ru_stime, 6),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "stages": stages,
+            "profiling": {"wall_s": round(overhead_wall, 6), "cpu_s": round(overhead_cpu, 6)},
+            # not negative: on short runs the estimated counting cost may exceed what it actually took
+            "other": {"wall_s": round(max(0.0, wall - overhead_wall - sum(s["wall_s"] for s in stages.values())), 6),
+                      "cpu_s": round(max(0.0, cpu - overhead_cpu - sum(s["cpu_s"] for s in stages.values())), 6)},
+            "counters": {name: dict(counts) for name, counts in (counters or {}).items()},
+        }
+        if profile is not None:
+            profile.dump_stats(dump_file)
+            summary["cprofile"] = {"file": dump_file, "top": cprofile_top(profile)}
+        elif dump == "tracemalloc":
+            current, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            snapshot.dump(dump_file)
+            summary["tracemalloc"] = {"file": dump_file, "current_mb": round(current / (1024 * 1024), 1),
+                                      "peak_mb": round(peak / (1024 * 1024), 1), "top": tracemalloc_top(snapshot)}
+        print_report(summary, report)
+        with open(summary_file, "w") as f:
+            json.dump(summary, f, indent=1)
+            f.write("\n")
@@ -0,0 +1,360 @@
+# coding: utf-8
+
+"""
+Sharded processing of one log file in several worker processes, see correct-ts.py -jobs.
+
+The input is split into byte ranges (shards) at line boundaries and processed in two parallel passes:
+
+1. :func:`scan_shard` parses a shard and reports what the correction state depends on: the time sync
+   and GPS frames, malformed lines, the number and size of the lines written in between, and the
+   canId/nodeId statistics.
+2. :class:`ShardReplay` replays these events in input order through the LogCorrector state machine,
+   so the segment breaks, the pending 1206 date, the GPS offsets and the printed statistics are
+   exactly those of a serial run. This yields the segment file and offset for every written line.
+3. :func:`write_shard` parses a shard again and writes its lines into the segment files (and their
+   GPS corrected copies) at these offsets. It reports the ids written to each segment for the index
+   entries (see catalog.py).
+
+Only frames are replayed one by one that are rare in CANaerospace logs, so step 2 is cheap.
+"""
+
+import os
+from multiprocessing import Pool
+
+import numpy as np
+
+from candump import parse_line, format_line, SYNC_ID
+from candump_np import read_blocks, parse_block, shift_timestamps
+from catalog import SegmentSummary, write_index, update_catalog
+from correction import LogCorrector, SPECIAL_IDS, block_statistics, sync_with_gps
+from idstats import FrameStatistics
+
+WRITE_CHUNK = 4 * 1024 * 1024
+
+
+def split_shards(file_name, n):
+    """
+    :return: list of (start, end) byte ranges, each starting at the beginning of a line
+    """
+    size = os.path.getsize(file_name)
+    bounds = [0]
+    with open(file_name, "rb") as f:
+        for k in range(1, n):
+            pos = max(size * k // n, bounds[-1])
+            if pos > 0:
+                f.seek(pos - 1)
+                f.readline()
+                pos = f.tell()
+            bounds.append(pos)
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if start < end]
+
+
+def iter_shard_blocks(file_name, start, end):
+    channels = []
+    with open(file_name, "rb") as f:
+        f.seek(start)
+        for buf in read_blocks(f, size=end - start):
+            yield buf, parse_block(buf, channels)
+
+
+def scan_shard(shard):
+    """
+    Pass 1, runs in a worker process.
+
+    :param shard: (file_name, start, end)
+    :return: (events, line count, canId statistics, nodeId statistics). Events are
+             ``('w', lines, bytes, ts_min, ts_max)`` for a run of written ordinary frames (time stamps in µs),
+             ``('e', line, text)`` for a malformed line and ``('s', ts, canId, payloadStr, bytes)`` for a
+             time sync or GPS frame.
+    """
+    file_name, start, end = shard
+    events = []
+    canIds = FrameStatistics()
+    nodeIds = FrameStatistics()
+    cnt = 0
+
+    def run(block, first, last):
+        if first == last:
+            return
+        rows = np.arange(first, last)
+        clean = block.clean[rows]
+        size = int((block.end[rows] - block.start[rows])[clean].sum())
+        for row in rows[~clean].tolist():
+            size += len(reformat_line(block.line(row)))
+        ts = block.frames['ts'][first:last]
+        ts_min, ts_max = int(ts.min()), int(ts.max())
+        if events and events[-1][0] == 'w':
+            _, lines, size_, ts_min_, ts_max_ = events[-1]
+            events[-1] = ('w', lines + last - first, size_ + size, min(ts_min, ts_min_), max(ts_max, ts_max_))
+        else:
+            events.append(('w', last - first, size, ts_min, ts_max))
+
+    for buf, block in iter_shard_blocks(file_name, start, end):
+        ids = block.frames['id']
+        special = np.flatnonzero(~block.valid | np.isin(ids, SPECIAL_IDS)).tolist()
+        pos = 0
+        for row in special:
+            run(block, pos, row)
+            line = block.line(row)
+            if not block.valid[row]:
+                events.append(('e', cnt + row, line.decode(errors="replace")))
+            else:
+                ts, _, _, canId, payloadStr = parse_line(line)
+                events.append(('s', ts, canId, payloadStr, len(reformat_line(line))))
+            pos = row + 1
+        run(block, pos, len(block))
+        block_statistics(canIds, nodeIds, block)
+        cnt += len(block)
+    return events, cnt, canIds, nodeIds
+
+
+def reformat_line(line):
+    ts, canDevStr, frameStr, _, _ = parse_line(line)
+    return format_line(ts, canDevStr, frameStr)
+
+
+class Segment:
+    def __init__(self):
+        self.name = None
+        self.size = 0
+        self.ts_min = None
+        self.ts_max = None
+        self.diff = None  # GPS offset, None without GPS corrected copy
+        self.write = True  # False if a later segment gets the same name
+        self.frames = 0
+        self.gps = None  # GPS offset statistics
+        self.summary = SegmentSummary()
+
+    def add(self, size, ts_min, ts_max):
+        self.size += size
+        self.ts_min = ts_min if self.ts_min is None else min(self.ts_min, ts_min)
+        self.ts_max = ts_max if self.ts_max is None else max(self.ts_max, ts_max)
+
+    def gps_in_place(self):
+        """
+        :return: True if the GPS corrected lines have the same length as the lines, i.e. the time stamps
+                 before and after the shift have 10 digits before the decimal point
+        """
+        if self.ts_min is None:
+            return True
+        shift = round(self.diff * 1000000)
+        return 10 ** 15 <= min(self.ts_min, self.ts_min - shift) and max(self.ts_max, self.ts_max - shift) < 10 ** 16
+
+
+class ShardReplay(LogCorrector):
+    """
+    Replays the events of :func:`scan_shard` through the LogCorrector state machine. Instead of writing
+    the frames it records the segments and where each written line of a shard goes.
+    """
+
+    def __init__(self, syncwithgps=False, output_dir="data"):
+        super().__init__(syncwithgps, True, output_dir)
+        self.gps_buffer = None
+        self.segments = []
+        self.switches = []
+        self.written = 0
+        self.cnt = 0
+
+    def open_logfile(self):
+        self.log_file_nr = self.log_file_nr + 1
+        self.new_log = Segment()
+        self.segments.append(self.new_log)
+        self.switches[-1].append((self.written, len(self.segments) - 1, 0))
+
+    def close_logfile(self, ts_log):
+        self.new_log_file_name = self.segment_file_name(ts_log)
+        self.new_log.name = self.new_log_file_name
+
+    def write_gps_copy(self, diff):
+        self.new_log.diff = diff
+
+    def write_index(self):
+        # written by write_indexes when the segment files are complete
+        self.new_log.frames = self.new_cnt - self.segment_cnt
+        self.new_log.gps = self.mmm
+
+    def replay(self, result):
+        """
+        :param result: the result of :func:`scan_shard` for the next shard
+        """
+        events, cnt, canIds, nodeIds = result
+        self.written = 0
+        self.switches.append([])
+        if self.new_log is not None:
+            self.switches[-1].append((0, len(self.segments) - 1, self.new_log.size))
+        for event in events:
+            if self.new_log is None:
+                self.open_logfile()
+            if event[0] == 'w':
+                _, lines, size, ts_min, ts_max = event
+                self.new_log.add(size, ts_min, ts_max)
+                self.written += lines
+                self.new_cnt = self.new_cnt + lines
+            elif event[0] == 'e':
+                _, line, text = event
+                print("ERROR, line={:d} >>>{:s}<<< \n".format(self.cnt + line, text))
+            else:
+                _, ts, canId, payloadStr, size = event
+                if self.special_frame(ts, canId, payloadStr):
+                    self.new_log.add(size, ts, ts)
+                    self.written += 1
+                    self.new_cnt = self.new_cnt + 1
+        self.cnt += cnt
+        self.canIds.merge(canIds)
+        self.nodeIds.merge(nodeIds)
+
+    def targets(self):
+        """
+        Mark the segments which are overwritten by a later segment of the same name (as os.rename does)
+        and create the segment files.
+
+        :return: for each shard the list of (written line, segment file, GPS file, GPS offset, file offset)
+        """
+        names = {}
+        for segment in self.segments:
+            if segment.name in names:
+                names[segment.name].write = False
+            names[segment.name] = segment
+        for segment in self.segments:
+            if segment.write:
+                open(segment.name, "wb").close()
+                if segment.diff is not None and segment.gps_in_place():
+                    open(gps_file_name(segment.name), "wb").close()
+        targets = []
+        for switches in self.switches:
+            shard_targets = []
+            for written, index, offset in switches:
+                segment = self.segments[index]
+                name = segment.name if segment.write else None
+                gps_name = None
+                if name and segment.diff is not None and segment.gps_in_place():
+                    gps_name = gps_file_name(name)
+                shard_targets.append((written, name, gps_name, segment.diff, offset))
+            targets.append(shard_targets)
+        return targets
+
+    def write_indexes(self, shard_ids):
+        """
+        Write the index entries of the segments and add them to the catalog.
+
+        :param shard_ids: for each shard the ids written to each of its targets, as returned by :func:`write_shard`
+        """
+        for switches, target_ids in zip(self.switches, shard_ids):
+            for (_, index, _), ids in zip(switches, target_ids):
+                self.segments[index].summary.add_ids(np.array(ids, np.int64))
+        entries = []
+        for segment in self.segments:
+            if segment.write:
+                if segment.ts_min is not None:
+                    segment.summary.add_range(segment.ts_min, segment.ts_max)
+                entry = segment.summary.entry(segment.name, segment.frames, segment.gps)
+                write_index(entry, segment.name)
+                entries.append(entry)
+        update_catalog(self.output_dir, entries)
+
+    def gps_rewrites(self):
+        """
+        :return: segment files whose GPS corrected copy can't be written in place, with the GPS offset
+        """
+        return [(segment.name, segment.diff) for segment in self.segments
+                if segment.diff is not None and segment.write and not segment.gps_in_place()]
+
+
+def gps_file_name(log_file_name):
+    return log_file_name.replace(".log", "-gps.log")
+
+
+def write_shard(args):
+    """
+    Pass 2, runs in a worker process: write the lines of a shard into the segment files.
+
+    :param args: (file_name, start, end, targets), targets as returned by :meth:`ShardReplay.targets`
+    :return: for each target the sorted ids written to it
+    """
+    file_name, start, end, targets = args
+    fds = {}
+
+    def fd(name):
+        if name not in fds:
+            fds[name] = os.open(name, os.O_WRONLY)
+        return fds[name]
+
+    offsets = [offset for _, _, _, _, offset in targets]
+    gps_offsets = list(offsets)
+    present = [np.zeros(0, np.int64) for _ in targets]
+    written = 0
+    try:
+        for buf, block in iter_shard_blocks(file_name, start, end):
+            rows = np.flatnonzero(block.valid & (block.frames['id'] != SYNC_ID))
+            if len(rows) == 0:
+                continue
+            sizes = block.end[rows] - block.start[rows]
+            clean = block.clean[rows]
+            if clean.all():
+                mask = np.zeros(len(block), bool)
+                mask[rows] = True
+                out = np.frombuffer(buf, np.uint8)[np.repeat(mask, block.end - block.start)]
+            else:
+                lines = []
+                for i, row in enumerate(rows.tolist()):
+                    line = block.line(row) if clean[i] else reformat_line(block.line(row))
+                    sizes[i] = len(line)
+                    lines.append(line)
+                out = np.frombuffer(b''.join(lines), np.uint8)
+            ends = np.cumsum(sizes)
+            starts = ends - sizes
+            ts = block.frames['ts'][rows]
+            ids = block.frames['id'][rows]
+
+            for t, (first, name, gps_name, diff, _) in enumerate(targets):
+                last = targets[t + 1][0] if t + 1 < len(targets) else None
+                i0 = max(first - written, 0)
+                i1 = len(rows) if last is None else min(last - written, len(rows))
+                if i0 >= i1:
+                    continue
+                present[t] = np.union1d(present[t], ids[i0:i1])
+                data = out[starts[i0]:ends[i1 - 1]]
+                if name is not None:
+                    offsets[t] = pwrite_all(fd(name), data, offsets[t])
+                if gps_name is not None:
+                    gps_data = shift_timestamps(data, starts[i0:i1] - starts[i0], ts[i0:i1], round(diff * 1000000))
+                    gps_offsets[t] = pwrite_all(fd(gps_name), gps_data, gps_offsets[t])
+            written += len(rows)
+    finally:
+        for f in fds.values():
+            os.close(f)
+    return [ids.tolist() for ids in present]
+
+
+def pwrite_all(fd, data, offset):
+    """
+    :return: the offset behind the written data
+    """
+    view = memoryview(data)
+    while len(view):
+        n = os.pwrite(fd, view[:WRITE_CHUNK], offset)
+        view = view[n:]
+        offset += n
+    return offset
+
+
+def process_sharded(corrector, file_name, jobs, write=True):
+    """
+    Process file_name with jobs worker processes.
+
+    :param ShardReplay corrector: collects the segments and statistics
+    :param bool write: False to stop after the replay, with the statistics but no files (correct-ts.py -stats-only)
+    """
+    shards = [(file_name, start, end) for start, end in split_shards(file_name, jobs)]
+    with Pool(jobs) as pool:
+        for result in pool.imap(scan_shard, shards):
+            corrector.replay(result)
+        corrector.finish()
+        if not write:
+            return
+        targets = corrector.targets()
+        shard_ids = pool.map(write_shard, [shard + (shard_targets,) for shard, shard_targets in zip(shards, targets)])
+    for log_file_name, diff in corrector.gps_rewrites():
+        sync_with_gps(log_file_name, diff, True)
+    corrector.write_indexes(shard_ids)
@@ -3,25 +3,130 @@
 """
 Implements an SQL database writer and reader for storing CAN messages.
 
-.. note:: The database schema is given in the documentation of the loggers.
+.. note:: The database schema is given in the documentation of the loggers. logfile2sqldb2.py
+          stores the time stamps as integer µs (ts INTEGER), can.SqliteWriter as seconds (ts REAL).
+
+logfile2sqldb2.py -compact writes the compact schema (:data:`COMPACT_SCHEMA`): a WITHOUT ROWID table
+clustered on (ts, seq), seq numbering the frames in file order, with the extended, remote and error
+flags in one column and the payload as little endian INTEGER, which SQLite stores in as few bytes as
+its value needs. :class:`SqliteReader2` detects the schema (:func:`is_compact`).
 """
 
-from can import SqliteReader
+from can import Message, SqliteReader
+
+from candump_np import FLAG_EXTENDED, FLAG_REMOTE
+
+TS_US = 1000000  # ts per second of an INTEGER ts column
+FLAG_ERROR = 0x04  # flags column of the compact schema, with candump_np.FLAG_EXTENDED and FLAG_REMOTE
+
+COMPACT_SCHEMA = """
+        CREATE TABLE IF NOT EXISTS {}
+        (
+          ts INTEGER NOT NULL,
+          seq INTEGER NOT NULL,
+          arbitration_id INTEGER NOT NULL,
+          flags INTEGER NOT NULL,
+          dlc INTEGER NOT NULL,
+          data INTEGER NOT NULL,
+          PRIMARY KEY (ts, seq)
+        ) WITHOUT ROWID"""
+
+
+def ts_scale(cursor, table_name):
+    """
+    :return: the ts units per second, TS_US if the ts column is declared INTEGER, else 1 (seconds)
+    """
+    for _, name, declared, *_ in cursor.execute("PRAGMA table_info({})".format(table_name)):
+        if name == "ts":
+            return TS_US if declared.upper() == "INTEGER" else 1
+    return 1
+
+
+def is_compact(cursor, table_name):
+    """
+    :return: True if the table has the compact schema (:data:`COMPACT_SCHEMA`)
+    """
+    return any(name == "flags" for _, name, *_ in cursor.execute("PRAGMA table_info({})".format(table_name)))
+
+
+def pack_data(data):
+    """
+    :param data: payload of up to 8 bytes
+    :return: the payload as INTEGER of the compact schema
+    """
+    return int.from_bytes(bytes(data).ljust(8, b'\0'), "little", signed=True)
+
+
+def unpack_data(value, dlc):
+    """
+    :return: the first dlc bytes of a payload packed by :func:`pack_data`
+    """
+    return value.to_bytes(8, "little", signed=True)[:dlc]
 
 
 class SqliteReader2(SqliteReader):
 
-    def __init__(self, file, table_name, start_time):
+    def __init__(self, file, table_name="messages", start_time=None, can_ids=None):
         """
         :param file: a `str` or since Python 3.7 a path like object that points
                      to the database file to use
         :param str table_name: the name of the table to look for the messages
-        :param real start_time: time where to start reading
+        :param real start_time: time where to start reading, None for all messages
+        :param can_ids: read only the messages with these arbitration ids, in time stamp order
         """
         super().__init__(file, table_name)
         self.start_time = start_time
+        self.can_ids = None if can_ids is None else sorted(can_ids)
+        self.scale = ts_scale(self._cursor, table_name)
+        self.compact = is_compact(self._cursor, table_name)
+
+    def _query(self):
+        # served by the ts and (arbitration_id, ts) indexes of logfile2sqldb2.py, the primary key of the
+        # compact schema
+        where = []
+        parameters = []
+        if self.start_time is not None:
+            where.append("ts >= ?")
+            parameters.append(self.start_time * self.scale)
+        if self.can_ids is not None:
+            where.append("arbitration_id IN ({})".format(", ".join("?" * len(self.can_ids))))
+            parameters.extend(self.can_ids)
+        columns = "ts, arbitration_id, flags, dlc, data" if self.compact else "*"
+        query = "SELECT {} FROM {}".format(columns, self.table_name)
+        if where:
+            query += " where " + " and ".join(where)
+        if self.compact:
+            query += " ORDER BY ts, seq"
+        elif self.can_ids is not None:
+            query += " ORDER BY ts"
+        return self._cursor.execute(query, parameters)
 
     def __iter__(self):
-        for frame_data in self._cursor.execute(
-                "SELECT * FROM {} where ts >= {:f}".format(self.table_name, self.start_time)):
-            yield SqliteReader2._assemble_message(frame_data)
+        for frame_data in self._query():
+            yield self._assemble_message(frame_data)
+
+    def read_all(self):
+        return (self._assemble_message(frame) for frame in self._query().fetchall())
+
+    def _assemble_message(self, frame_data):
+        if self.compact:
+            timestamp, can_id, flags, dlc, data = frame_data
+            return Message(
+                timestamp=timestamp / self.scale,
+                is_remote_frame=bool(flags & FLAG_REMOTE),
+                is_extended_id=bool(flags & FLAG_EXTENDED),
+                is_error_frame=bool(flags & FLAG_ERROR),
+                arbitration_id=can_id,
+                dlc=dlc,
+                data=None if flags & FLAG_REMOTE else unpack_data(data, dlc)
+            )
+        timestamp, can_id, is_extended, is_remote, is_error, dlc, data = frame_data
+        return Message(
+            timestamp=timestamp / self.scale,
+            is_remote_frame=bool(is_remote),
+            is_extended_id=bool(is_extended),
+            is_error_frame=bool(is_error),
+            arbitration_id=can_id,
+            dlc=dlc,
+            data=data
+        )
@@ -0,0 +1,56 @@
+import json
+import random
+
+from catalog import CATALOG_NAME, find_segments, load_catalog, update_catalog
+
+
+def entry(name, start, end, offset=0.5):
+    return {"file": name, "start_ts": start, "end_ts": end, "gps_start_ts": start - offset,
+            "gps_end_ts": end - offset}
+
+
+def test_find_segments_matches_scan(tmp_path):
+    rng = random.Random(1)
+    entries = []
+    for i in range(300):
+        start = rng.uniform(0, 1000)
+        entries.append(entry("s%d.log" % i, start, start + rng.expovariate(1 / 20), rng.uniform(-2, 2)))
+    entries.append({"file": "empty.log", "start_ts": None, "end_ts": None, "gps_start_ts": None,
+                    "gps_end_ts": None})
+    for i in range(0, len(entries), 7):
+        update_catalog(str(tmp_path), entries[i:i + 7])
+    catalog = load_catalog(str(tmp_path))
+    assert len(catalog) == len(entries)
+    for _ in range(200):
+        ts = rng.uniform(-10, 1100)
+        for gps, start, end in (False, "start_ts", "end_ts"), (True, "gps_start_ts", "gps_end_ts"):
+            expected = {e["file"] for e in entries if e[start] is not None and e[start] <= ts <= e[end]}
+            found = find_segments(catalog, ts, gps)
+            assert {e["file"] for e in found} == expected
+            assert [e[start] for e in found] == sorted(e[start] for e in found)
+
+
+def test_update_catalog_appends_and_replaces(tmp_path):
+    directory = str(tmp_path)
+    update_catalog(directory, [entry("a.log", 10.0, 20.0), entry("b.log", 30.0, 40.0)])
+    update_catalog(directory, [entry("a.log", 50.0, 60.0)])
+    with open(tmp_path / CATALOG_NAME) as f:
+        assert [json.loads(line)["file"] for line in f] == ["a.log", "b.log", "a.log"]
+    catalog = load_catalog(directory)
+    assert [e["file"] for e in catalog] == ["b.log", "a.log"]
+    assert find_segments(catalog, 15.0) == []
+    assert [e["file"] for e in find_segments(catalog, 55.0)] == ["a.log"]
+
+
+def test_torn_line_is_skipped(tmp_path):
+    directory = str(tmp_path)
+    update_catalog(directory, [entry("a.log", 10.0, 20.0)])
+    with open(tmp_path / CATALOG_NAME, "a") as f:
+        f.write('{"file": "b.log", "sta')
+    update_catalog(directory, [entry("c.log", 30.0, 40.0)])
+    assert [e["file"] for e in load_catalog(directory)] == ["a.log", "c.log"]
+
+
+def test_no_catalog(tmp_path):
+    assert len(load_catalog(str(tmp_path))) == 0
+    assert find_segments(load_catalog(str(tmp_path)), 1.0, True) == []
@@ -0,0 +1,24 @@
+import pytest
+
+from correction import LogCorrector
+from loggen import LogGenerator
+
+
+def drift_estimate(tmp_path, seconds, clock_drift):
+    generator = LogGenerator(seed=1, signals=4, nodes=2, jump_rate=0, malformed_rate=0, clock_drift=clock_drift)
+    lines = b"".join(generator.window() for _ in range(seconds)).splitlines(keepends=True)
+    corrector = LogCorrector(True, output_dir=str(tmp_path), drift=True)
+    corrector.process(lines)
+    model = corrector.gps_buffer.model
+    assert len(model) == seconds
+    return model.b
+
+
+@pytest.mark.parametrize("clock_drift", [50e-6, -20e-6])
+def test_drift_comes_back(tmp_path, clock_drift):
+    assert drift_estimate(tmp_path, 1800, clock_drift) == pytest.approx(clock_drift, abs=5e-6)
+
+
+def test_drift_of_a_short_segment(tmp_path):
+    # 220 s, 11 ms of drift against about 30 ms scatter of the GPS time frames in their second
+    assert drift_estimate(tmp_path, 220, 50e-6) == pytest.approx(50e-6, abs=25e-6)
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from batch import BatchReport, InputResult
+from idstats import FrameStatistics
+
+
+def frames(start, period, n, can_id=329):
+    ts = start + period * np.arange(n, dtype=np.int64)
+    return np.full(n, can_id, np.int64), ts
+
+
+def test_combine_overlapping_inputs():
+    # two loggers of the same time, 20 ms frames, the second with its clock 7 ms later
+    a = FrameStatistics.from_frames(*frames(1565000000000000, 20000, 500))
+    b = FrameStatistics.from_frames(*frames(1565000000007000, 20000, 500))
+    stats = FrameStatistics()
+    stats.combine(a)
+    stats.combine(b)
+    (row,) = stats.rows()
+    can_id, count, first_ts, last_ts, mean, jitter, dropouts = row
+    assert (can_id, count, dropouts) == (329, 1000, 0)
+    assert first_ts == 1565000000.0
+    assert last_ts == pytest.approx(1565000000.007 + 499 * 0.02)
+    assert mean == pytest.approx(0.02)
+    assert jitter == 0.0
+
+
+def test_combine_keeps_each_input_jitter():
+    rng = np.random.default_rng(1)
+    ids_a, ts_a = frames(1565000000000000, 20000, 1000)
+    ids_b, ts_b = frames(1565000000003000, 20000, 1000)
+    ts_a = ts_a + rng.integers(-500, 500, len(ts_a))
+    ts_b = ts_b + rng.integers(-500, 500, len(ts_b))
+    stats = FrameStatistics()
+    stats.combine(FrameStatistics.from_frames(ids_a, ts_a))
+    stats.combine(FrameStatistics.from_frames(ids_b, ts_b))
+    intervals = np.concatenate((np.diff(ts_a), np.diff(ts_b))) / 1000000
+    (row,) = stats.rows()
+    assert row[4] == pytest.approx(intervals.mean())
+    assert row[5] == pytest.approx(intervals.std(ddof=1), abs=1e-9)
+
+
+def test_batch_report_overlapping_inputs():
+    report = BatchReport()
+    for start in 1565000000000000, 1565000000011000:
+        canIds = FrameStatistics.from_frames(*frames(start, 20000, 300))
+        nodeIds = FrameStatistics.from_frames(*frames(start, 20000, 300, can_id=5))
+        result = InputResult("x.log", "data/x")
+        result.frames, result.canIds, result.nodeIds = 300, canIds, nodeIds
+        report.add(result)
+    for stats in report.canIds, report.nodeIds:
+        (row,) = stats.rows()
+        assert row[1] == 600
+        assert row[4] == pytest.approx(0.02)
+        assert row[5] == 0.0
@@ -0,0 +1,37 @@
+import gzip
+
+import pytest
+
+from canrec import RecordWriter
+from player2 import LogReader2
+
+LOG = b"".join(b"(1565000000.%06d) can0 %03X#%02X\n" % (i * 100000, 0x100 + i, i) for i in range(10))
+
+
+def test_record_reader_start_time(tmp_path):
+    name = str(tmp_path / "seg.canrec")
+    with RecordWriter(name) as writer:
+        writer.write(LOG)
+    for start_time, first in (None, 0), (1565000000.25, 3), (1565000000.3, 3), (1565000001.0, 10):
+        reader = LogReader2(name, start_time)
+        try:
+            ids = [msg.arbitration_id for msg in reader]
+        finally:
+            reader.stop()
+        assert ids == list(range(0x100 + first, 0x10A))
+
+
+def test_compressed_start_time_is_an_error(tmp_path):
+    name = str(tmp_path / "log.log.gz")
+    with gzip.open(name, "wb") as f:
+        f.write(LOG)
+    with pytest.raises(ValueError, match="start time"):
+        LogReader2(name, 1565000000.25)
+
+
+def test_compressed_unknown_format(tmp_path):
+    name = str(tmp_path / "x.txt.gz")
+    with gzip.open(name, "wb") as f:
+        f.write(LOG)
+    with pytest.raises(ValueError, match="x.txt.gz"):
+        LogReader2(name, None)
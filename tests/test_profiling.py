@@ -0,0 +1,19 @@
+import json
+
+from profiling import StageProfiler, profiled
+
+
+def test_no_negative_times(tmp_path):
+    profiler = StageProfiler()
+    profiler.cost = (0.01, 0.01)  # an estimate far above the real cost of counting a call
+    step = profiler.wrap("step", lambda: None)
+    summary_file = str(tmp_path / "p.json")
+    with open(tmp_path / "report.txt", "w") as report:
+        with profiled(profiler, summary_file, report=report):
+            for _ in range(100):
+                step()
+    with open(summary_file) as f:
+        summary = json.load(f)
+    assert summary["other"]["wall_s"] >= 0 and summary["other"]["cpu_s"] >= 0
+    for stage in summary["stages"].values():
+        assert stage["wall_s"] >= 0 and stage["cpu_s"] >= 0
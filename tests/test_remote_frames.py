@@ -0,0 +1,39 @@
+from candump import parse_line, remote_dlc
+from candump_np import FLAG_REMOTE, parse_block
+from ingest import BatchReader
+
+LOG = (b"(1565000000.000000) can0 123#R3\n"
+       b"(1565000000.000001) can0 124#R\n"
+       b"(1565000000.000002) can0 12345678#R8\n"
+       b"(1565000000.000003) can0 125#0102\n")
+
+
+def test_remote_dlc():
+    assert remote_dlc(b"R3") == 3
+    assert remote_dlc(b"R") == 0
+    assert remote_dlc(b"0102") is None
+    assert remote_dlc(b"RX") is None
+
+
+def test_parse_line_remote_with_dlc():
+    assert parse_line(b"(1565000000.000000) can0 123#R3\n") == (1565000000000000, b"can0", b"123#R3", 0x123, b"")
+    assert parse_line(b"(1565000000.000000) can0 123#RX\n") is None
+
+
+def test_parse_block_remote_with_dlc():
+    block = parse_block(LOG, [])
+    assert block.valid.all()
+    assert (block.frames['flags'] & FLAG_REMOTE != 0).tolist() == [True, True, True, False]
+    assert block.frames['dlc'].tolist() == [3, 0, 8, 2]
+
+
+def test_batch_reader_remote_with_dlc(tmp_path):
+    log = tmp_path / "remote.log"
+    log.write_bytes(LOG)
+    # as can.CanutilsLogReader reads them: remote, the DLC, no data
+    assert list(BatchReader(str(log))) == [[
+        (1565000000000000, 0x123, 0, 1, 0, 3, b""),
+        (1565000000000001, 0x124, 0, 1, 0, 0, b""),
+        (1565000000000002, 0x12345678, 1, 1, 0, 8, b""),
+        (1565000000000003, 0x125, 0, 0, 0, 2, b"\x01\x02"),
+    ]]
@@ -0,0 +1,116 @@
+# coding: utf-8
+
+"""
+Sparse time index of a candump log, to start reading at a time without parsing the lines before it.
+
+Every INDEX_STRIDE-th frame is recorded with its byte offset and the latest time stamp of the frames
+before it. That time stamp never decreases, even if the log is not in time order, so a binary search
+finds an offset where all frames before have an earlier time stamp. The index is built with the
+vectorized parser on first use and cached next to the log (<log>.tidx); it is rebuilt when the size
+or modification time of the log changes. If the directory is not writable, it is kept in memory.
+"""
+
+import io
+import os
+
+import numpy as np
+
+from can import CanutilsLogReader
+
+from candump_np import read_blocks, parse_block
+
+INDEX_SUFFIX = ".tidx"
+INDEX_STRIDE = 1024
+MAGIC = b'CANTIDX\x01'
+
+HEADER_DTYPE = np.dtype([('magic', 'S8'), ('stride', '<u4'), ('reserved', '<u4'), ('size', '<i8'),
+                         ('mtime_ns', '<i8')])
+ENTRY_DTYPE = np.dtype([('ts', '<i8'), ('offset', '<i8')])  # latest time stamp before the offset, µs
+
+
+def build_index(file_name, stride=INDEX_STRIDE):
+    """
+    :return: array of :data:`ENTRY_DTYPE`
+    """
+    entries = []
+    latest = np.iinfo(np.int64).min
+    count = 0  # frames before the block
+    base = 0  # offset of the block
+    channels = []
+    with open(file_name, "rb") as f:
+        for buf in read_blocks(f):
+            block = parse_block(buf, channels)
+            rows = np.flatnonzero(block.valid)
+            if len(rows):
+                ts = block.frames['ts'][rows]
+                before = np.empty_like(ts)
+                before[0] = latest
+                np.maximum(np.maximum.accumulate(ts)[:-1], latest, out=before[1:])
+                picked = np.arange(-count % stride, len(rows), stride)
+                entry = np.empty(len(picked), ENTRY_DTYPE)
+                entry['ts'] = before[picked]
+                entry['offset'] = base + block.start[rows[picked]]
+                entries.append(entry)
+                latest = max(latest, int(ts.max()))
+                count += len(rows)
+            base += len(buf)
+    if not entries:
+        return np.zeros(0, ENTRY_DTYPE)
+    return np.concatenate(entries)
+
+
+def load_index(file_name):
+    """
+    :return: the index of the log file_name, from the cache if it is up to date
+    """
+    stat = os.stat(file_name)
+    index_name = file_name + INDEX_SUFFIX
+    try:
+        with open(index_name, "rb") as f:
+            header = np.frombuffer(f.read(HEADER_DTYPE.itemsize), HEADER_DTYPE)
+            if len(header) and header['magic'][0] == MAGIC and header['stride'][0] == INDEX_STRIDE \
+                    and header['size'][0] == stat.st_size and header['mtime_ns'][0] == stat.st_mtime_ns:
+                return np.frombuffer(f.read(), ENTRY_DTYPE)
+    except FileNotFoundError:
+        pass
+    index = build_index(file_name)
+    header = np.zeros(1, HEADER_DTYPE)
+    header['magic'] = MAGIC
+    header['stride'] = INDEX_STRIDE
+    header['size'] = stat.st_size
+    header['mtime_ns'] = stat.st_mtime_ns
+    try:
+        with open(index_name + ".tmp", "wb") as f:
+            f.write(header.tobytes())
+            f.write(index.tobytes())
+        os.replace(index_name + ".tmp", index_name)
+    except OSError:
+        pass
+    return index
+
+
+def seek_offset(index, start_time):
+    """
+    :param float start_time: time in s
+    :return: offset in the log where all frames before are earlier than start_time
+    """
+    k = np.searchsorted(index['ts'], round(start_time * 1000000), side='left') - 1
+    return int(index['offset'][k]) if k > 0 else 0
+
+
+class IndexedLogReader(CanutilsLogReader):
+    """
+    Iterator over the frames of a candump log from start_time on, see can.CanutilsLogReader.
+    """
+
+    def __init__(self, file_name, start_time):
+        f = open(file_name, "rb")
+        f.seek(seek_offset(load_index(file_name), start_time))
+        super().__init__(io.TextIOWrapper(f))
+        self.start_time = start_time
+
+    def __iter__(self):
+        start_time = self.start_time
+        for message in super().__iter__():
+            if message.timestamp >= start_time:
+                yield message
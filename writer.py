@@ -0,0 +1,122 @@
+# coding: utf-8
+
+"""
+Output files written in large chunks: the segment files and GPS corrected copies of correct-ts.py.
+
+:class:`ChunkWriter` collects the written lines in a buffer of CHUNK_SIZE bytes, allocated once per
+file and reused, and writes it with one os.write per chunk instead of one per 8 KiB of the default
+buffered file. Compressed files (compressed.py) write their compressed data through it as well.
+
+The fsync policy (correct-ts.py -fsync) trades speed for how much of the output survives a crash of
+the machine: 'none' leaves it to the OS, 'close' syncs each file when it is closed (a finished
+segment is on disk), 'chunk' after every chunk (at most one chunk per file is lost).
+SYSCALLS counts the os.write and os.fsync calls of all closed ChunkWriters of the process.
+"""
+
+import io
+import os
+import threading
+from collections import Counter
+
+CHUNK_SIZE = 4 * 1024 * 1024
+FSYNC_POLICIES = ("none", "close", "chunk")
+
+SYSCALLS = Counter()
+_syscalls_lock = threading.Lock()  # compressed files are written by a background thread
+fsync_policy = "none"  # of the ChunkWriters opened from now on
+
+
+def set_fsync_policy(policy):
+    """
+    :param str policy: one of FSYNC_POLICIES
+    """
+    global fsync_policy
+    if policy not in FSYNC_POLICIES:
+        raise ValueError("unknown fsync policy {!r}".format(policy))
+    fsync_policy = policy
+
+
+def count_syscalls(syscalls):
+    with _syscalls_lock:
+        SYSCALLS.update(syscalls)
+
+
+class ChunkWriter(io.BufferedIOBase):
+    """
+    Binary file for writing, flushed in chunks of chunk_size bytes.
+    """
+
+    def __init__(self, file_name, mode="wb", chunk_size=CHUNK_SIZE, policy=None):
+        """
+        :param str mode: 'wb' or 'ab'
+        :param str policy: fsync policy, default the one set with :func:`set_fsync_policy`
+        """
+        super().__init__()
+        flags = os.O_WRONLY | os.O_CREAT | (os.O_APPEND if "a" in mode else os.O_TRUNC)
+        self.fd = os.open(file_name, flags, 0o666)
+        self.name = file_name
+        self.mode = mode
+        self.policy = policy or fsync_policy
+        self.buffer = bytearray(chunk_size)
+        self.view = memoryview(self.buffer)
+        self.pos = 0
+        self.syscalls = Counter()
+
+    def writable(self):
+        return True
+
+    def fileno(self):
+        return self.fd
+
+    def write(self, data):
+        """
+        :param data: bytes or any other contiguous buffer, e.g. a numpy.ndarray
+        :return: the number of bytes
+        """
+        if not isinstance(data, bytes):
+            data = memoryview(data).cast("B")
+        n = len(data)
+        pos = self.pos
+        if pos + n > len(self.buffer):
+            self.write_buffer()
+            pos = 0
+            if n >= len(self.buffer):
+                self.write_all(data)
+                return n
+        self.view[pos:pos + n] = data
+        self.pos = pos + n
+        return n
+
+    def write_all(self, data):
+        view = memoryview(data)
+        while len(view):
+            view = view[os.write(self.fd, view):]
+            self.syscalls["write"] += 1
+        if self.policy == "chunk":
+            self.fsync()
+
+    def fsync(self):
+        os.fsync(self.fd)
+        self.syscalls["fsync"] += 1
+
+    def write_buffer(self):
+        if self.pos:
+            self.write_all(self.view[:self.pos])
+            self.pos = 0
+
+    def flush(self):
+        if not self.closed:
+            self.write_buffer()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.write_buffer()
+            if self.policy == "close":
+                self.fsync()
+        finally:
+            os.close(self.fd)
+            self.view.release()
+            count_syscalls(self.syscalls)
+            super().close()